@@ -0,0 +1,895 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: set ts=2 sw=2 et sts=2 ai:
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# Disable the missing docstrings as benchmarks are 'self documenting'.
+# pylint: disable=missing-docstring,protected-access
+
+"""Micro benchmarks for the datetime_tz module.
+
+Every bench_* function times a hot path next to the code it is meant to beat
+and prints the cost of a single operation. Run all of them with
+
+  python benchmarks.py
+
+or only some of them by name, for example
+
+  python benchmarks.py adopt
+"""
+
+import array
+import copy
+import datetime
+import os
+import pickle
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+import warnings
+
+import dateutil.parser
+import dateutil.relativedelta
+import pytz
+
+import datetime_tz
+
+# Number of operations per timing run, the best of REPEAT runs is reported.
+NUMBER = 20000
+REPEAT = 3
+
+
+def _time(func, number=NUMBER):
+  """Returns the best time in seconds of a single call to func."""
+  return min(timeit.repeat(func, number=number, repeat=REPEAT)) / number
+
+
+def _report(title, timings):
+  """Prints timings relative to the first one, which is the baseline."""
+  print(title)
+  baseline = timings[0][1]
+  for label, seconds in timings:
+    print("  %-48s %9.3f us  (x%.2f)" % (label, seconds * 1e6,
+                                          baseline / seconds))
+
+
+def bench_adopt():
+  tz = pytz.timezone("Australia/Sydney")
+  dt = tz.localize(datetime.datetime(2015, 7, 11, 12, 34, 54))
+  dtz = datetime_tz.datetime_tz(dt)
+
+  _report("Construction from an aware, pytz localized datetime", [
+      ("datetime_tz(dt)",
+       _time(lambda: datetime_tz.datetime_tz(dt))),
+      ("datetime_tz.adopt(dt)",
+       _time(lambda: datetime_tz.datetime_tz.adopt(dt))),
+      ("datetime_tz.adopt(datetime_tz)",
+       _time(lambda: datetime_tz.datetime_tz.adopt(dtz))),
+  ])
+
+
+def bench_zones():
+  def legacy_tzinfome(name):
+    tzinfo = pytz.timezone(name)
+    assert tzinfo.zone in pytz.all_timezones
+    return tzinfo
+
+  for name in ("Africa/Abidjan", "US/Eastern", "Zulu"):
+    _report("Zone lookup by name (%s)" % name, [
+        ("pytz.timezone + all_timezones scan",
+         _time(lambda: legacy_tzinfome(name), number=2000)),
+        ("_tzinfome",
+         _time(lambda: datetime_tz._tzinfome(name))),
+    ])
+
+
+def _legacy_localize(dt, tzinfo, is_dst=None):
+  """datetime_tz(dt, tzinfo) for a naive dt, as it was before tzindex."""
+  try:
+    dt = tzinfo.localize(dt, is_dst=None)
+  except pytz.AmbiguousTimeError:
+    dt = tzinfo.localize(dt, is_dst)
+  newargs = list(dt.timetuple()[0:6]) + [dt.microsecond, dt.tzinfo]
+  obj = datetime.datetime.__new__(datetime_tz.datetime_tz, *newargs)
+  obj.is_dst = obj.dst() != datetime.timedelta(0)
+  return obj
+
+
+def bench_localize():
+  cases = (
+      ("Australia/Sydney", datetime.datetime(2015, 1, 11, 12, 34, 54), None),
+      ("Australia/Sydney", datetime.datetime(2015, 4, 5, 2, 30), True),
+      ("America/New_York", datetime.datetime(2015, 7, 11, 12, 34, 54), None),
+      ("America/New_York", datetime.datetime(2015, 11, 1, 1, 30), False),
+  )
+  for zone, dt, is_dst in cases:
+    tz = pytz.timezone(zone)
+    _report("Construction from naive %s in %s" % (dt, zone), [
+        ("pytz localize (old __new__)",
+         _time(lambda: _legacy_localize(dt, tz, is_dst))),
+        ("datetime_tz(dt, tz)",
+         _time(lambda: datetime_tz.datetime_tz(dt, tz, is_dst=is_dst))),
+    ])
+
+  # A year of hourly wall clock times, crossing both transitions.
+  for zone in ("Australia/Sydney", "America/New_York"):
+    tz = pytz.timezone(zone)
+    start = datetime.datetime(2015, 1, 1)
+    hours = [start + datetime.timedelta(hours=i) for i in range(24 * 365)]
+
+    def legacy_year(hours=hours, tz=tz):
+      for dt in hours:
+        try:
+          _legacy_localize(dt, tz, False)
+        except pytz.NonExistentTimeError:
+          pass
+
+    def new_year(hours=hours, tz=tz):
+      for dt in hours:
+        try:
+          datetime_tz.datetime_tz(dt, tz, is_dst=False)
+        except pytz.NonExistentTimeError:
+          pass
+
+    _report("Construction of every hour of 2015 in %s" % zone, [
+        ("pytz localize (old __new__)", _time(legacy_year, number=3)),
+        ("datetime_tz(dt, tz)", _time(new_year, number=3)),
+    ])
+
+
+def _legacy_astimezone(dtz, tzinfo):
+  """datetime_tz.astimezone as it was before tzindex."""
+  args = list(dtz.timetuple()[0:6]) + [dtz.microsecond, dtz.tzinfo]
+  d = datetime.datetime(*args).astimezone(tzinfo)
+  newargs = list(d.timetuple()[0:6]) + [d.microsecond, d.tzinfo]
+  d = d.tzinfo.normalize(datetime.datetime(*newargs))
+  newargs = list(d.timetuple()[0:6]) + [d.microsecond, d.tzinfo]
+  obj = datetime.datetime.__new__(datetime_tz.datetime_tz, *newargs)
+  obj.is_dst = obj.dst() != datetime.timedelta(0)
+  return obj
+
+
+def bench_astimezone():
+  utc_dt = datetime_tz.datetime_tz(2015, 7, 11, 12, 34, 54, tzinfo=pytz.utc)
+  for zone in ("Australia/Sydney", "America/New_York"):
+    tz = pytz.timezone(zone)
+    _report("astimezone from UTC to %s" % zone, [
+        ("old astimezone", _time(lambda: _legacy_astimezone(utc_dt, tz))),
+        ("astimezone", _time(lambda: utc_dt.astimezone(tz))),
+    ])
+
+  # A stream of events a minute apart converted from UTC to a user's zone.
+  tz = pytz.timezone("America/New_York")
+  start = datetime_tz.datetime_tz(2015, 10, 31, tzinfo=pytz.utc)
+  events = [start + datetime.timedelta(minutes=i) for i in range(5000)]
+
+  def legacy_stream():
+    for event in events:
+      _legacy_astimezone(event, tz)
+
+  def new_stream():
+    for event in events:
+      event.astimezone(tz)
+
+  _report("astimezone of 5000 UTC events to America/New_York (per event)", [
+      ("old astimezone", _time(legacy_stream, number=5) / len(events)),
+      ("astimezone", _time(new_stream, number=5) / len(events)),
+  ])
+
+
+def _legacy_replace(dtz, **kw):
+  """datetime_tz.replace as it was before tzindex."""
+  args = list(dtz.timetuple()[0:6]) + [dtz.microsecond]
+  replaced = datetime.datetime(*args).replace(**kw)
+  tzinfo = pytz.timezone(dtz.tzinfo.zone)
+  assert tzinfo.zone in pytz.all_timezones
+  return _legacy_localize(replaced, tzinfo, dtz.is_dst)
+
+
+def bench_replace():
+  day = datetime.timedelta(days=1)
+  microsecond = datetime.timedelta(microseconds=1)
+  for zone in ("Australia/Sydney", "America/New_York"):
+    now = datetime_tz.datetime_tz(2015, 7, 11, 12, 34, 54, 1234, zone)
+
+    # The default smartparse builds for "start of ..."
+    _report("replace to the start of the day in %s" % zone, [
+        ("old replace", _time(lambda: _legacy_replace(
+            now, hour=0, minute=0, second=0, microsecond=0))),
+        ("replace", _time(lambda: now.replace(
+            hour=0, minute=0, second=0, microsecond=0))),
+    ])
+
+    # The default smartparse builds for "end of ..."
+    _report("replace to the end of the day in %s" % zone, [
+        ("old replace", _time(lambda: _legacy_replace(
+            now + day, hour=0, minute=0, second=0, microsecond=0) -
+                              microsecond)),
+        ("replace", _time(lambda: (now + day).replace(
+            hour=0, minute=0, second=0, microsecond=0) - microsecond)),
+    ])
+
+
+def _legacy_aware_new(dt):
+  """datetime_tz(dt) for an aware dt, as it was before tzindex."""
+  args = list(dt.timetuple()[0:6]) + [dt.microsecond, dt.tzinfo]
+  dt = dt.tzinfo.normalize(datetime.datetime(*args))
+  args = list(dt.timetuple()[0:6]) + [dt.microsecond, dt.tzinfo]
+  obj = datetime.datetime.__new__(datetime_tz.datetime_tz, *args)
+  obj.is_dst = obj.dst() != datetime.timedelta(0)
+  return obj
+
+
+def _legacy_add(dtz, delta):
+  """datetime_tz.__add__ as it was when wrapped by _wrap_method."""
+  args = list(dtz.timetuple()[0:6]) + [dtz.microsecond, dtz.tzinfo]
+  return _legacy_aware_new(datetime.datetime(*args) + delta)
+
+
+def _legacy_sub(dtz, other):
+  """datetime_tz.__sub__ as it was when wrapped by _wrap_method."""
+  args = list(dtz.timetuple()[0:6]) + [dtz.microsecond, dtz.tzinfo]
+  return datetime.datetime(*args) - other
+
+
+def bench_arithmetic():
+  tz = pytz.timezone("Australia/Sydney")
+  plain = tz.localize(datetime.datetime(2015, 7, 11, 12, 34, 54))
+  dtz = datetime_tz.datetime_tz(plain)
+  other = dtz + datetime.timedelta(days=3)
+  delta = datetime.timedelta(hours=1)
+
+  _report("datetime_tz + timedelta", [
+      ("old __add__", _time(lambda: _legacy_add(dtz, delta))),
+      ("__add__", _time(lambda: dtz + delta)),
+      ("datetime + timedelta (naive arithmetic)", _time(lambda: plain + delta)),
+  ])
+  _report("datetime_tz - datetime_tz", [
+      ("old __sub__", _time(lambda: _legacy_sub(other, dtz))),
+      ("__sub__", _time(lambda: other - dtz)),
+  ])
+
+  start = datetime_tz.datetime_tz(2015, 1, 1, tzinfo=tz)
+  end = datetime_tz.datetime_tz(2016, 1, 1, tzinfo=tz)
+
+  def legacy_between():
+    toyield = start
+    while toyield < end:
+      toyield = _legacy_add(toyield, delta)
+
+  def new_between():
+    for _ in datetime_tz.iterate.between(start, delta, end):
+      pass
+
+  _report("iterate.between over a year in hourly steps (per step)", [
+      ("old __add__", _time(legacy_between, number=3) / (24 * 365)),
+      ("__add__", _time(new_between, number=3) / (24 * 365)),
+  ])
+
+
+def bench_from_fields_many():
+  # A day of per second rows, as separate columns from a binary feed.
+  rows = 24 * 60 * 60
+  years = array.array("H", [2015] * rows)
+  months = array.array("B", [7] * rows)
+  days = array.array("B", [11] * rows)
+  hours = array.array("B", [i // 3600 for i in range(rows)])
+  minutes = array.array("B", [i // 60 % 60 for i in range(rows)])
+  seconds = array.array("B", [i % 60 for i in range(rows)])
+
+  def loop():
+    return [datetime_tz.datetime_tz(*row + ("Australia/Sydney",))
+            for row in zip(years, months, days, hours, minutes, seconds)]
+
+  def many():
+    return datetime_tz.datetime_tz.from_fields_many(
+        years, months, days, hours, minutes, seconds,
+        tzinfo="Australia/Sydney")
+
+  _report("%d rows of fields in Australia/Sydney (per row)" % rows, [
+      ("datetime_tz(...) per row", _time(loop, number=1) / rows),
+      ("from_fields_many", _time(many, number=1) / rows),
+  ])
+
+
+def bench_sort():
+  # Events from a year, each in one of a few zones.
+  random.seed(8)
+  start = datetime_tz.datetime_tz(2015, 1, 1, tzinfo=pytz.utc)
+  zones = ("America/New_York", "Australia/Sydney", "Europe/London", "UTC")
+  events = [(start + datetime.timedelta(seconds=random.randrange(
+      365 * 24 * 60 * 60))).astimezone(random.choice(zones))
+            for _ in range(50000)]
+  plain = [event.asdatetime(naive=False) for event in events]
+
+  def fresh():
+    # A new copy of the events, without cached sort keys.
+    return [datetime_tz.datetime_tz.adopt(event) for event in plain]
+
+  _report("Sorting %d events in mixed zones (per event)" % len(events), [
+      ("sorted(datetimes)", _time(lambda: sorted(plain), number=1) /
+       len(events)),
+      ("sorted(datetime_tzs)", _time(lambda: sorted(fresh()), number=1) /
+       len(events)),
+      ("sorted_events(datetime_tzs)",
+       _time(lambda: datetime_tz.sorted_events(fresh()), number=1) /
+       len(events)),
+  ])
+
+  a, b = events[0], events[1]
+  plain_a, plain_b = plain[0], plain[1]
+  _report("Comparing events in different zones", [
+      ("datetime < datetime", _time(lambda: plain_a < plain_b)),
+      ("datetime_tz < datetime_tz", _time(lambda: a < b)),
+  ])
+
+
+class _LegacyPickle(datetime_tz.datetime_tz):
+  """Pickles the way datetime_tz did before it had a __reduce__."""
+  __slots__ = []
+  __reduce_ex__ = datetime.datetime.__reduce_ex__
+
+
+def bench_pickle():
+  for zone in ("Australia/Sydney", "UTC"):
+    dtz = datetime_tz.datetime_tz(2015, 7, 11, 12, 34, 54, 1234, zone)
+    legacy = _LegacyPickle(dtz)
+    events = [dtz + datetime.timedelta(minutes=i) for i in range(1000)]
+    legacy_events = [_LegacyPickle(event) for event in events]
+
+    for protocol in (2, pickle.HIGHEST_PROTOCOL):
+      print("Pickle size in %s (protocol %d): old %d bytes, new %d bytes, "
+            "1000 events: old %d bytes, new %d bytes" % (
+                zone, protocol, len(pickle.dumps(legacy, protocol)),
+                len(pickle.dumps(dtz, protocol)),
+                len(pickle.dumps(legacy_events, protocol)),
+                len(pickle.dumps(events, protocol))))
+
+    _report("pickle round trip in %s" % zone, [
+        ("old pickle", _time(lambda: pickle.loads(pickle.dumps(legacy, 2)))),
+        ("pickle", _time(lambda: pickle.loads(pickle.dumps(dtz, 2)))),
+    ])
+    _report("pickle round trip of 1000 events in %s (per event)" % zone, [
+        ("old pickle", _time(lambda: pickle.loads(pickle.dumps(
+            legacy_events, 2)), number=20) / len(events)),
+        ("pickle", _time(lambda: pickle.loads(pickle.dumps(
+            events, 2)), number=20) / len(events)),
+    ])
+
+
+def _legacy_deepcopy(dtz, memo):
+  """datetime_tz.__deepcopy__ as it was, rebuilding the object."""
+  dpcpy = datetime_tz.datetime_tz(dtz)
+  memo[id(dtz)] = dpcpy
+  return dpcpy
+
+
+class _LegacyCopy(datetime_tz.datetime_tz):
+  __slots__ = []
+  __deepcopy__ = _legacy_deepcopy
+
+
+def bench_deepcopy():
+  # A config like structure, holding a few timestamps per entry.
+  start = datetime_tz.datetime_tz(2015, 7, 11, 12, 34, 54, "Australia/Sydney")
+
+  def config(cls):
+    return {"jobs": [
+        {"name": "job%d" % i,
+         "created": cls(start + datetime.timedelta(hours=i)),
+         "schedule": [cls(start + datetime.timedelta(days=i, hours=j))
+                      for j in range(5)]}
+        for i in range(1000)]}
+
+  legacy = config(_LegacyCopy)
+  new = config(datetime_tz.datetime_tz)
+  _report("deepcopy of 1000 entries holding 6000 datetime_tz objects", [
+      ("old __deepcopy__", _time(lambda: copy.deepcopy(legacy), number=5)),
+      ("__deepcopy__", _time(lambda: copy.deepcopy(new), number=5)),
+  ])
+
+
+def _log_corpus(size=2000):
+  """Timestamps as they appear in logs, mostly (but not all) ISO 8601."""
+  random.seed(11)
+  start = datetime_tz.datetime_tz(2015, 7, 11, tzinfo=pytz.utc)
+  corpus = []
+  for i in range(size):
+    dt = start + datetime.timedelta(seconds=i * 7, microseconds=i * 1013)
+    kind = random.random()
+    if kind < 0.5:
+      corpus.append(dt.strftime("%Y-%m-%dT%H:%M:%S.%fZ"))
+    elif kind < 0.75:
+      corpus.append(dt.astimezone("America/New_York").isoformat())
+    elif kind < 0.96:
+      corpus.append(dt.strftime("%Y-%m-%d %H:%M:%S"))
+    else:
+      corpus.append(dt.strftime("%d %b %Y %H:%M:%S"))
+  return corpus
+
+
+def _legacy_smartparse(toparse, tzinfo):
+  """smartparse on the dateutil path, as it was before the ISO 8601 one."""
+  toparse = toparse.strip()
+  default = datetime_tz.datetime_tz.now(tzinfo).replace(
+      hour=0, minute=0, second=0, microsecond=0)
+  dt = dateutil.parser.parse(toparse, default=default.asdatetime(),
+                             tzinfos=datetime_tz.pytz_abbr.tzinfos)
+  if dt.tzinfo is datetime_tz.pytz_abbr.unknown:
+    dt = dt.replace(tzinfo=None)
+  if dt.tzinfo is None:
+    return datetime_tz.datetime_tz(dt, tzinfo)
+  if isinstance(dt.tzinfo, datetime_tz.pytz_abbr.tzabbr):
+    abbr = dt.tzinfo
+    dt = datetime_tz.datetime_tz(dt.replace(tzinfo=None), abbr.zone,
+                                 is_dst=abbr.is_dst)
+  return datetime_tz.datetime_tz(dt)
+
+
+def bench_smartparse_iso8601():
+  tz = pytz.timezone("Australia/Sydney")
+  corpus = _log_corpus()
+
+  def legacy():
+    for toparse in corpus:
+      _legacy_smartparse(toparse, tz)
+
+  def new():
+    for toparse in corpus:
+      datetime_tz.datetime_tz.smartparse(toparse, tz)
+
+  # Time the parsing, not the cache (see bench_smartparse_cache).
+  maxsize = datetime_tz.smartparse_cache.info().maxsize
+  datetime_tz.smartparse_cache.resize(0)
+  _report("smartparse of %d log timestamps, 96%% ISO 8601 (per string)" %
+          len(corpus), [
+              ("dateutil", _time(legacy, number=3) / len(corpus)),
+              ("smartparse", _time(new, number=3) / len(corpus)),
+          ])
+  datetime_tz.smartparse_cache.resize(maxsize)
+  _report("iso8601.parse of a single timestamp", [
+      ("dateutil.parser.parse", _time(lambda: dateutil.parser.parse(
+          "2015-07-11T12:34:54.001234+10:00"), number=2000)),
+      ("iso8601.parse", _time(lambda: datetime_tz.iso8601.parse(
+          "2015-07-11T12:34:54.001234+10:00"))),
+  ])
+
+
+def bench_smartparse_cache():
+  tz = pytz.timezone("Australia/Sydney")
+  # Log lines where many share the same second, as syslog writes them.
+  start = datetime.datetime(2015, 7, 11, 12, 34, 54)
+  lines = [(start + datetime.timedelta(seconds=i // 20)).strftime(
+      "%b %d %H:%M:%S %Y") for i in range(2000)]
+  # Report headers and config values, a handful of distinct ISO strings.
+  headers = ["2015-07-%02dT00:00:00+10:00" % (i % 5 + 1) for i in range(2000)]
+  cache = datetime_tz.smartparse_cache
+  maxsize = cache.info().maxsize
+
+  for title, corpus in (("syslog timestamps, 20 per second", lines),
+                        ("repeated ISO 8601 headers", headers)):
+    def parse_all(corpus=corpus):
+      for toparse in corpus:
+        datetime_tz.datetime_tz.smartparse(toparse, tz)
+
+    cache.resize(0)
+    uncached = _time(parse_all, number=3) / len(corpus)
+    cache.resize(maxsize)
+    cache.clear()
+    cached = _time(parse_all, number=3) / len(corpus)
+    _report("smartparse of %d %s (per string)" % (len(corpus), title), [
+        ("smartparse_cache disabled", uncached),
+        ("smartparse_cache", cached),
+    ])
+    print("  %s" % (cache.info(),))
+
+
+def bench_smartparse_many():
+  tz = pytz.timezone("Australia/Sydney")
+  start = datetime.datetime(2015, 7, 11, 12, 34, 54)
+  for fmt in ("%b %d %H:%M:%S %Y", "%Y-%m-%d %H:%M:%S",
+              "%Y-%m-%dT%H:%M:%S.%f+10:00"):
+    column = [(start + datetime.timedelta(seconds=i * 13)).strftime(fmt)
+              for i in range(5000)]
+
+    def loop(column=column):
+      for toparse in column:
+        datetime_tz.datetime_tz.smartparse(toparse, tz)
+
+    def many(column=column):
+      for _ in datetime_tz.datetime_tz.smartparse_many(column, tz):
+        pass
+
+    _report("%d distinct %r strings (per string)" % (len(column), fmt), [
+        ("smartparse per string", _time(loop, number=1) / len(column)),
+        ("smartparse_many", _time(many, number=1) / len(column)),
+    ])
+
+
+def bench_try_smartparse():
+  tz = pytz.timezone("Australia/Sydney")
+  start = datetime.datetime(2015, 7, 11, 12, 34, 54)
+  garbage = ["-", "null", "N/A", "", "#VALUE!", "unknown"]
+  column = []
+  for i in range(5000):
+    if i % 50 == 7:
+      column.append(garbage[i % len(garbage)])
+    else:
+      dt = start + datetime.timedelta(seconds=i * 13)
+      column.append(dt.strftime("%b %d %H:%M:%S %Y"))
+
+  def loop():
+    for toparse in column:
+      try:
+        datetime_tz.datetime_tz.smartparse(toparse, tz)
+      except ValueError:
+        pass
+
+  def many():
+    datetime_tz.datetime_tz.try_smartparse_many(column, tz)
+
+  _report("%d strings, 2%% garbage (per string)" % len(column), [
+      ("smartparse, catching ValueError", _time(loop, 1) / len(column)),
+      ("try_smartparse_many", _time(many, 1) / len(column)),
+  ])
+
+  _report("a garbage string", [
+      ("smartparse raising ValueError",
+       _time(lambda: _fails(datetime_tz.datetime_tz.smartparse, "null"))),
+      ("try_smartparse",
+       _time(lambda: datetime_tz.datetime_tz.try_smartparse("null"))),
+  ])
+
+
+def _fails(parse, toparse):
+  try:
+    parse(toparse)
+  except ValueError:
+    pass
+
+
+def bench_epoch():
+  tz = pytz.timezone("Australia/Sydney")
+  parse = datetime_tz.datetime_tz.smartparse
+  for toparse, per_second in (("1436618094", 1), ("1436618094123", 1000)):
+    _report("smartparse(%r) with the cache off" % toparse, [
+        ("float + utcfromtimestamp + astimezone", _time(
+            lambda: datetime_tz.datetime_tz.utcfromtimestamp(
+                float(toparse) / per_second).astimezone(tz))),
+        ("smartparse", _time(lambda: _uncached(parse, toparse, tz))),
+    ])
+
+  column = ["%d" % (1436618094123 + i * 13001) for i in range(5000)]
+  _report("%d distinct millisecond timestamps (per string)" % len(column), [
+      ("smartparse per string", _time(
+          lambda: [parse(toparse, tz) for toparse in column], 1) / 5000),
+      ("smartparse_many", _time(
+          lambda: list(datetime_tz.datetime_tz.smartparse_many(column, tz)),
+          1) / 5000),
+  ])
+
+
+def _uncached(parse, toparse, tzinfo):
+  datetime_tz.smartparse_cache.clear()
+  return parse(toparse, tzinfo)
+
+
+def _legacy_tzabbr_localized(abbr, dt):
+  """pytz_abbr.tzabbr._get_localized as it was before tzindex."""
+  return abbr.zone.localize(dt.replace(tzinfo=None), is_dst=abbr.is_dst)
+
+
+def bench_tzabbr():
+  abbr = datetime_tz.pytz_abbr.all["EST"]
+  dt = datetime.datetime(2002, 10, 27, 1, 20, tzinfo=abbr)
+  _report("tzabbr.tzname", [
+      ("zone.localize", _time(
+          lambda: _legacy_tzabbr_localized(abbr, dt).tzname())),
+      ("tzindex", _time(
+          lambda: abbr.tzname(dt + datetime.timedelta(minutes=1)))),
+      ("repeated time", _time(lambda: abbr.tzname(dt))),
+  ])
+
+  toparse = "Sun Oct 27 01:20:00 EST 2002"
+  _report("smartparse(%r) with the cache off" % toparse, [
+      ("smartparse", _time(lambda: _uncached(
+          datetime_tz.datetime_tz.smartparse, toparse, None))),
+  ])
+
+
+def bench_tzinfos():
+  tzinfos = datetime_tz.pytz_abbr.tzinfos
+  _report("pytz_abbr.tzinfos(None, 19800)", [
+      ("pytz.FixedOffset(offset/60)", _time(
+          lambda: pytz.FixedOffset(19800 / 60))),
+      ("tzinfos", _time(lambda: tzinfos(None, 19800))),
+  ])
+  _report("pytz_abbr.tzinfos('EST', -18000)", [
+      ("tzinfos", _time(lambda: tzinfos("EST", -18000))),
+  ])
+
+  toparse = "2015-07-11 12:34:54 +0530"
+  _report("smartparse(%r) with the cache off" % toparse, [
+      ("smartparse", _time(lambda: _uncached(
+          datetime_tz.datetime_tz.smartparse, toparse, None))),
+  ])
+
+
+def bench_strptime():
+  tz = pytz.timezone("Australia/Sydney")
+  start = datetime.datetime(2015, 7, 11, 12, 34, 54)
+  for fmt in ("%Y-%m-%d %H:%M:%S", "%d/%b/%Y:%H:%M:%S %z",
+              "%a %b %d %H:%M:%S %Z %Y"):
+    column = [tz.localize(start + datetime.timedelta(seconds=i * 13)).strftime(
+        fmt) for i in range(1000)]
+    strptime = datetime.datetime.strptime
+
+    def legacy(column=column, fmt=fmt):
+      for toparse in column:
+        dt = strptime(toparse.replace(" AEST ", " "),
+                      fmt.replace(" %Z ", " "))
+        if dt.tzinfo is None:
+          datetime_tz.datetime_tz(dt, tz)
+        else:
+          offset = pytz.FixedOffset(dt.utcoffset().total_seconds() // 60)
+          datetime_tz.datetime_tz(dt.replace(tzinfo=offset))
+
+    def compiled(column=column, fmt=fmt):
+      for toparse in column:
+        datetime_tz.datetime_tz.strptime(toparse, fmt, tz)
+
+    def many(column=column, fmt=fmt):
+      datetime_tz.datetime_tz.strptime_many(column, fmt, tz)
+
+    _report("strptime %r (per string)" % fmt, [
+        ("datetime.strptime + datetime_tz()", _time(legacy, 20) / len(column)),
+        ("datetime_tz.strptime", _time(compiled, 20) / len(column)),
+        ("datetime_tz.strptime_many", _time(many, 20) / len(column)),
+    ])
+
+
+def _legacy_relative(toparse, dt):
+  """The relative part of smartparse as it was before the relative module."""
+  toparse = toparse.strip()
+  if toparse.lower().startswith("end of "):
+    toparse = toparse[7:].strip()
+    dt += datetime.timedelta(days=1)
+    dt = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    dt -= datetime.timedelta(microseconds=1)
+  elif toparse.lower().startswith("start of "):
+    toparse = toparse[9:].strip()
+    dt = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+
+  toparselower = toparse.lower()
+  if toparselower in ["now", "today"]:
+    pass
+  elif toparselower == "yesterday":
+    dt -= datetime.timedelta(days=1)
+  elif toparselower in ("tomorrow", "tommorrow"):
+    dt += datetime.timedelta(days=1)
+  elif "ago" in toparselower:
+    toparselower = toparselower[:-3]
+    toparselower = toparselower.replace("a ", "1 ")
+    toparselower = toparselower.replace("an ", "1 ")
+    toparselower = toparselower.replace(" and ", " ")
+    tocheck = ("seconds", "minutes", "hours", "days", "weeks", "months",
+               "years")
+    result = {}
+    for match in re.finditer("([0-9]+)([^0-9]*)", toparselower):
+      amount = int(match.group(1))
+      unit = match.group(2).strip()
+      for bit in tocheck:
+        regex = "^([%s]|((%s)s?))$" % (bit[0], bit[:-1])
+        if re.search(regex, unit):
+          result[bit] = amount
+          break
+      else:
+        raise ValueError("Was not able to parse date unit %r!" % unit)
+    dt -= dateutil.relativedelta.relativedelta(**result)
+  return dt
+
+
+def _relative(toparse, now):
+  boundary, toparse = datetime_tz.relative.split_boundary(toparse)
+  return datetime_tz.relative.parse(toparse, boundary).resolve(now, boundary)
+
+
+def bench_relative():
+  now = datetime_tz.datetime_tz(2015, 7, 11, 12, 34, 54, 1234,
+                                "Australia/Sydney")
+  for toparse in ("10h5m ago", "2 days and an hour ago",
+                  "3m4months and 1y ago", "start of yesterday",
+                  "end of tomorrow"):
+    _report("relative expression %r" % toparse, [
+        ("old smartparse branch", _time(
+            lambda: _legacy_relative(toparse, now))),
+        ("relative module", _time(lambda: _relative(toparse, now))),
+    ])
+
+
+def _legacy_now(tzinfo):
+  """datetime_tz.now as it was before reference_time."""
+  obj = datetime_tz.datetime_tz(datetime.datetime.utcnow(), tzinfo=pytz.utc)
+  return obj.astimezone(tzinfo)
+
+
+def bench_now():
+  tz = pytz.timezone("Australia/Sydney")
+  ref = datetime_tz.datetime_tz.now(tz)
+  with datetime_tz.reference_time(ref):
+    fixed = _time(lambda: datetime_tz.datetime_tz.now(tz))
+  _report("datetime_tz.now", [
+      ("utcnow + astimezone", _time(lambda: _legacy_now(tz))),
+      ("now", _time(lambda: datetime_tz.datetime_tz.now(tz))),
+      ("now inside reference_time", fixed),
+  ])
+
+  lines = ["%d minutes ago" % i for i in range(100)]
+  parse = datetime_tz.datetime_tz.smartparse
+
+  def batch():
+    for line in lines:
+      parse(line, tz)
+
+  def batch_reference():
+    with datetime_tz.reference_time(ref):
+      for line in lines:
+        parse(line, tz)
+
+  _report("smartparse 100 relative lines", [
+      ("system clock", _time(batch, NUMBER // 100)),
+      ("now= argument", _time(
+          lambda: [parse(line, tz, now=ref) for line in lines], NUMBER // 100)),
+      ("reference_time", _time(batch_reference, NUMBER // 100)),
+  ])
+
+
+def _legacy_load_local_tzinfo():
+  """The local zoneinfo database, loaded as it was before the digest index."""
+  tzdir = os.environ.get("TZDIR", "/usr/share/zoneinfo/posix")
+  localtzdata = {}
+  for dirpath, _, filenames in os.walk(tzdir):
+    for filename in filenames:
+      filepath = os.path.join(dirpath, filename)
+      with open(filepath, "rb") as f:
+        localtzdata[os.path.relpath(filepath, tzdir)] = (
+            pytz.tzfile.build_tzinfo(filepath, f))
+  return localtzdata
+
+
+def bench_detect_localtime():
+  if not os.path.exists("/etc/localtime"):
+    print("No /etc/localtime, skipping.")
+    return
+
+  def contents():
+    from_symlink = datetime_tz._zone_from_symlink
+    datetime_tz._zone_from_symlink = lambda path: None
+    try:
+      return datetime_tz._detect_timezone_etc_localtime()
+    finally:
+      datetime_tz._zone_from_symlink = from_symlink
+
+  _report("Local zoneinfo database (%s)" % os.environ.get(
+      "TZDIR", "/usr/share/zoneinfo/posix"), [
+          ("build_tzinfo on every file", _time(_legacy_load_local_tzinfo, 3)),
+          ("digest index", _time(datetime_tz._load_local_zoneinfo_index, 3)),
+      ])
+  with warnings.catch_warnings():
+    warnings.simplefilter("ignore")
+    _report("_detect_timezone_etc_localtime", [
+        ("by contents", _time(contents, 3)),
+        ("symlink (if /etc/localtime is one)",
+         _time(datetime_tz._detect_timezone_etc_localtime, 3)),
+    ])
+
+
+def bench_localtz_cache():
+  cachedir = tempfile.mkdtemp()
+  old_cachedir = os.environ.get("DATETIME_TZ_CACHE_DIR")
+  os.environ["DATETIME_TZ_CACHE_DIR"] = cachedir
+  try:
+    with warnings.catch_warnings():
+      warnings.simplefilter("ignore")
+      datetime_tz.detect_timezone()
+      # As on systems where /etc/localtime is a copy rather than a symlink.
+      from_symlink = datetime_tz._zone_from_symlink
+      datetime_tz._zone_from_symlink = lambda path: None
+      try:
+        by_contents = _time(datetime_tz._detect_timezone_etc_localtime, 10)
+      finally:
+        datetime_tz._zone_from_symlink = from_symlink
+      _report("Matching a copied /etc/localtime in a new process", [
+          ("_detect_timezone_etc_localtime", by_contents),
+          ("tzcache.load(tzcache.key())",
+           _time(lambda: datetime_tz.tzcache.load(datetime_tz.tzcache.key()),
+                 100)),
+      ])
+  finally:
+    shutil.rmtree(cachedir)
+    if old_cachedir is None:
+      del os.environ["DATETIME_TZ_CACHE_DIR"]
+    else:
+      os.environ["DATETIME_TZ_CACHE_DIR"] = old_cachedir
+
+
+def _legacy_detect_timezone_php():
+  """_detect_timezone_php as it was before the signatures index."""
+  tomatch = (time.tzname[0], time.timezone, time.daylight)
+  now = datetime.datetime.now()
+  matches = []
+  for tzname in pytz.all_timezones:
+    tz = pytz.timezone(tzname)
+    try:
+      indst = tz.localize(now).timetuple()[-1]
+      if tomatch == (tz._tzname, -tz._utcoffset.seconds, indst):
+        matches.append(tzname)
+    except AttributeError:
+      pass
+  if matches:
+    return pytz.timezone(matches[0])
+
+
+def bench_detect_php():
+  cachedir = tempfile.mkdtemp()
+  old_cachedir = os.environ.get("DATETIME_TZ_CACHE_DIR")
+  os.environ["DATETIME_TZ_CACHE_DIR"] = cachedir
+  year = datetime.date.today().year
+
+  def legacy_cold():
+    pytz._tzinfo_cache.clear()
+    return _legacy_detect_timezone_php()
+
+  def from_cache():
+    datetime_tz.signatures._indexes.clear()
+    return datetime_tz._detect_timezone_php()
+
+  loaded = dict(pytz._tzinfo_cache)
+
+  try:
+    with warnings.catch_warnings():
+      warnings.simplefilter("ignore")
+      _report("PHP method detection", [
+          ("pytz.timezone and localize for every zone",
+           _time(legacy_cold, 3)),
+          ("building the signatures index",
+           _time(lambda: datetime_tz.signatures.build(year), 3)),
+          ("signatures index from the tzcache file", _time(from_cache, 100)),
+          ("signatures index in memory",
+           _time(datetime_tz._detect_timezone_php, 1000)),
+      ])
+  finally:
+    pytz._tzinfo_cache.clear()
+    pytz._tzinfo_cache.update(loaded)
+    shutil.rmtree(cachedir)
+    if old_cachedir is None:
+      del os.environ["DATETIME_TZ_CACHE_DIR"]
+    else:
+      os.environ["DATETIME_TZ_CACHE_DIR"] = old_cachedir
+
+
+def main(argv):
+  names = argv[1:] or sorted(
+      name[len("bench_"):] for name in globals() if name.startswith("bench_"))
+  for name in names:
+    globals()["bench_" + name]()
+
+
+if __name__ == "__main__":
+  main(sys.argv)
@@ -36,11 +36,16 @@ try and do the detection.
 __author__ = "tansell@google.com (Tim Ansell)"
 
 import calendar
+import contextlib
 import datetime
+import hashlib
+import io
+import itertools
 import os
 import os.path
 import re
 import sys
+import threading
 import time
 import warnings
 import dateutil.parser
@@ -48,31 +53,34 @@ import dateutil.relativedelta
 import dateutil.tz
 import pytz
 
-from . import pytz_abbr  # pylint: disable=g-bad-import-order
+from . import epoch  # pylint: disable=g-bad-import-order
+from . import formats
+from . import iso8601
+from . import lrucache
+from . import pytz_abbr
+from . import relative
+from . import signatures
+from . import tzcache
+from . import tzindex
+from . import zones
 
 if sys.platform == "win32":
   # pylint: disable=g-import-not-at-top
   from .detect_windows import _detect_timezone_windows
 
+try:
+  # pylint: disable=g-import-not-at-top
+  import contextvars
+except ImportError:
+  # Python < 3.7, reference_time falls back to being per thread.
+  contextvars = None
+
 try:
   basestring
 except NameError:
   # pylint: disable=redefined-builtin
   basestring = str
 
-try:
-  # pylint: disable=g-import-not-at-top
-  import functools
-except ImportError as e:
-
-  class functools(object):
-    """Fake replacement for a full functools."""
-
-    # pylint: disable=unused-argument
-    @staticmethod
-    def wraps(f, *args, **kw):
-      return f
-
 
 # Need to patch pytz.utc to have a _utcoffset so you can normalize/localize
 # using it.
@@ -81,6 +89,8 @@ pytz.utc._utcoffset = datetime.timedelta()
 
 timedelta = datetime.timedelta
 
+_ZERO = datetime.timedelta(0)
+
 
 def _tzinfome(tzinfo):
   """Gets a tzinfo object from a string.
@@ -96,16 +106,43 @@ def _tzinfome(tzinfo):
   """
   if not isinstance(tzinfo, datetime.tzinfo):
     try:
-      tzinfo = pytz.timezone(tzinfo)
-      assert tzinfo.zone in pytz.all_timezones
+      tzinfo = zones.get(tzinfo)
     except AttributeError:
       raise pytz.UnknownTimeZoneError("Unknown timezone! %s" % tzinfo)
   return tzinfo
 
 
+class _ThreadLocalVar(threading.local):
+  """The parts of contextvars.ContextVar we use, for Pythons without it."""
+
+  value = None
+
+  def get(self):
+    return self.value
+
+  def set(self, value):
+    token = self.value
+    self.value = value
+    return token
+
+  def reset(self, token):
+    self.value = token
+
+
 # Our "local" timezone
 _localtz = None
 
+# The timezone of the innermost local_timezone(), which overrides _localtz.
+if contextvars is not None:
+  _localtz_override = contextvars.ContextVar("datetime_tz_localtz",
+                                             default=None)
+else:
+  _localtz_override = _ThreadLocalVar()
+
+# Held while detecting (or setting) the local timezone, so only one thread
+# does the detection.
+_localtz_lock = threading.Lock()
+
 
 def localize(dt, force_to_local=True):
   """Localize a datetime to the local timezone.
@@ -148,6 +185,28 @@ def get_naive(dt):
   return dt.replace(tzinfo=None)
 
 
+def sorted_events(events, key=None, reverse=False):
+  """Sorts datetime_tz objects, or things with one, by the time they happened.
+
+  Uses datetime_tz.sort_key, so each time is only converted to UTC once
+  however many comparisons the sort makes.
+
+  Args:
+    events: An iterable of datetime_tz objects (or of anything key gets one
+            from).
+    key: Optional function which returns the datetime_tz of an event.
+    reverse: Sort the latest event first.
+
+  Returns:
+    A new sorted list.
+  """
+  if key is None:
+    sort_key = datetime_tz.sort_key
+  else:
+    sort_key = lambda event: key(event).sort_key()
+  return sorted(events, key=sort_key, reverse=reverse)
+
+
 def localtz():
   """Get the local timezone.
 
@@ -156,9 +215,19 @@ def localtz():
   """
   # pylint: disable=global-statement
   global _localtz
-  if _localtz is None:
-    _localtz = detect_timezone()
-  return _localtz
+  tz = _localtz_override.get()
+  if tz is not None:
+    return tz
+
+  tz = _localtz
+  if tz is None:
+    # Other threads wait for the first one to finish the detection, rather than
+    # all doing it at once.
+    with _localtz_lock:
+      tz = _localtz
+      if tz is None:
+        tz = _localtz = detect_timezone()
+  return tz
 
 
 def localtz_name():
@@ -170,7 +239,37 @@ def localtz_set(timezone):
   """Set the local timezone."""
   # pylint: disable=global-statement
   global _localtz
-  _localtz = _tzinfome(timezone)
+  tz = _tzinfome(timezone)
+  # Wait for any detection in progress, so it doesn't replace this.
+  with _localtz_lock:
+    _localtz = tz
+
+
+@contextlib.contextmanager
+def local_timezone(timezone):
+  """Makes localtz() return a different timezone inside a with block.
+
+  Unlike localtz_set this doesn't change the timezone for everyone, so each
+  request in a server can have its own,
+
+    with datetime_tz.local_timezone(user.timezone):
+      when = datetime_tz.datetime_tz.smartparse(form["when"])
+
+  Local timezones nest, and are per thread (per context for asyncio on Python
+  3.7+).
+
+  Args:
+    timezone: A tzinfo object or the name of a timezone.
+
+  Yields:
+    The timezone, as a tzinfo object.
+  """
+  tz = _tzinfome(timezone)
+  token = _localtz_override.set(tz)
+  try:
+    yield tz
+  finally:
+    _localtz_override.reset(token)
 
 
 def require_timezone(zone):
@@ -180,6 +279,93 @@ def require_timezone(zone):
       "or on Linux by exporting TZ=%(zone)s") % {"zone": zone}
 
 
+# The _Clock of the innermost reference_time, or None for the system clock.
+if contextvars is not None:
+  _clock = contextvars.ContextVar("datetime_tz_clock", default=None)
+else:
+  _clock = _ThreadLocalVar()
+
+
+class _Clock(object):
+  """Where datetime_tz.now gets the time from inside reference_time()."""
+
+  def __init__(self, now):
+    if callable(now):
+      self._provider = now
+      self._fixed = None
+    else:
+      self._provider = None
+      self._fixed = _reference_aware(now)
+    # A fixed time converted to each (class, timezone) asked for.
+    self._converted = {}
+
+  def now(self, cls, tzinfo):
+    """Returns the current time as a cls object in tzinfo (None for local)."""
+    if tzinfo is None:
+      tzinfo = localtz()
+    else:
+      tzinfo = _tzinfome(tzinfo)
+
+    if self._provider is not None:
+      return _reference_in(cls, _reference_aware(self._provider()), tzinfo)
+
+    key = (cls, tzinfo)
+    obj = self._converted.get(key)
+    if obj is None:
+      obj = self._converted[key] = _reference_in(cls, self._fixed, tzinfo)
+    return obj
+
+
+def _reference_aware(now):
+  """Returns a reference time as an aware datetime.
+
+  Args:
+    now: A datetime, naive ones are taken to be in the local timezone.
+
+  Returns:
+    A datetime with a tzinfo.
+  """
+  if now.tzinfo is None:
+    return datetime_tz(now, localtz())
+  return now
+
+
+def _reference_in(cls, now, tzinfo):
+  """Converts an aware datetime to a cls object in tzinfo."""
+  index = tzindex.get(tzinfo)
+  if index is not None:
+    return _new_from_utc(cls, tzindex.utc_naive(now), index)
+  return cls(now).astimezone(tzinfo)
+
+
+@contextlib.contextmanager
+def reference_time(now):
+  """Makes datetime_tz.now() (and so smartparse) use a reference time.
+
+  Useful for batch jobs which want everything resolved against one time,
+
+    with datetime_tz.reference_time(job_start):
+      for line in log:
+        when = datetime_tz.datetime_tz.smartparse(line)  # "5 minutes ago"
+
+  Reference times nest, and are per thread (per context for asyncio on Python
+  3.7+).
+
+  Args:
+    now: The datetime to use as the current time, naive ones are taken to be
+         in the local timezone. Or a function returning one, which is called
+         every time the current time is needed.
+
+  Yields:
+    Nothing.
+  """
+  token = _clock.set(_Clock(now))
+  try:
+    yield
+  finally:
+    _clock.reset(token)
+
+
 def detect_timezone():
   """Try and detect the timezone that Python is currently running in.
 
@@ -188,6 +374,8 @@ def detect_timezone():
     * In windows, use win32timezone.TimeZoneInfo.local()
     * Try TZ environment variable.
     * Try and find /etc/timezone file (with timezone name).
+    * Use the zone found by an earlier process, if none of the inputs to the
+      methods below have changed (see the tzcache module).
     * Try and find /etc/localtime file (with timezone data).
     * Try and match a TZ to the current dst/offset/shortname.
 
@@ -212,22 +400,30 @@ def detect_timezone():
   if tz is not None:
     return tz
 
+  # The remaining methods are slow, so reuse the zone an earlier process found
+  # if none of the inputs have changed since.
+  cachekey = tzcache.key()
+  zone = tzcache.load(cachekey)
+  if zone in zones.names():
+    return _tzinfome(zone)
+
   # Next we try and see if something matches the tzinfo in /etc/localtime
   tz = _detect_timezone_etc_localtime()
-  if tz is not None:
-    return tz
+  if tz is None:
+    # Next we try and use a similar method to what PHP does.
+    # We first try to search on time.tzname, time.timezone, time.daylight to
+    # match a pytz zone.
+    warnings.warn("Had to fall back to worst detection method (the 'PHP' "
+                  "method).")
 
-  # Next we try and use a similar method to what PHP does.
-  # We first try to search on time.tzname, time.timezone, time.daylight to
-  # match a pytz zone.
-  warnings.warn("Had to fall back to worst detection method (the 'PHP' "
-                "method).")
+    tz = _detect_timezone_php()
+    if tz is None:
+      raise pytz.UnknownTimeZoneError("Unable to detect your timezone!")
 
-  tz = _detect_timezone_php()
-  if tz is not None:
-    return tz
-
-  raise pytz.UnknownTimeZoneError("Unable to detect your timezone!")
+  # Only zones in the pytz database can be recreated from their name.
+  if getattr(tz, "zone", None) in zones.names():
+    tzcache.store(cachekey, tz.zone)
+  return tz
 
 
 def _detect_timezone_environ():
@@ -254,117 +450,415 @@ def _detect_timezone_etc_timezone():
       warnings.warn("Could not access your /etc/timezone file: %s" % eo)
 
 
-def _load_local_tzinfo():
-  """Load zoneinfo from local disk."""
+def _load_local_zoneinfo_index():
+  """Index the local zoneinfo files by a digest of their contents.
+
+  Returns:
+    A dictionary of SHA-1 digest to the list of zone names with that data.
+  """
   tzdir = os.environ.get("TZDIR", "/usr/share/zoneinfo/posix")
 
-  localtzdata = {}
+  index = {}
   for dirpath, _, filenames in os.walk(tzdir):
+    reldir = os.path.relpath(dirpath, tzdir)
     for filename in filenames:
-      filepath = os.path.join(dirpath, filename)
-      name = os.path.relpath(filepath, tzdir)
+      name = filename if reldir == "." else os.path.join(reldir, filename)
 
-      f = open(filepath, "rb")
-      tzinfo = pytz.tzfile.build_tzinfo(name, f)
+      f = open(os.path.join(dirpath, filename), "rb")
+      digest = hashlib.sha1(f.read()).digest()
       f.close()
-      localtzdata[name] = tzinfo
+      index.setdefault(digest, []).append(name)
 
-  return localtzdata
+  return index
+
+
+def _zone_from_symlink(path):
+  """Get the zone name for a symlink into a zoneinfo directory.
+
+  Args:
+    path: Path of the symlink, such as "/etc/localtime".
+
+  Returns:
+    The zone name (such as "Australia/Sydney") if the link points into a
+    zoneinfo tree at a zone pytz knows, otherwise None.
+  """
+  target = os.path.normpath(os.path.join(
+      os.path.dirname(path), os.readlink(path)))
+  _, found, name = target.rpartition("/zoneinfo/")
+  if not found:
+    return None
+  if name.startswith("posix/"):
+    name = name[len("posix/"):]
+  if name in zones.names():
+    return name
+  return None
+
+
+def _same_tzinfo(tz, other):
+  """Checks two tzinfo objects have the same transitions and offsets."""
+  if dir(tz) != dir(other):
+    return False
+
+  for attrib in dir(tz):
+    # Ignore functions and specials
+    if callable(getattr(tz, attrib)) or attrib.startswith("__"):
+      continue
+
+    # This will always be different
+    if attrib == "zone" or attrib == "_tzinfos":
+      continue
+
+    if getattr(tz, attrib) != getattr(other, attrib):
+      return False
+
+  return True
 
 
 def _detect_timezone_etc_localtime():
   """Detect timezone based on /etc/localtime file."""
+  if not os.path.exists("/etc/localtime"):
+    return None
+
+  # Most systems link /etc/localtime into the zoneinfo directory, in which case
+  # the link already names the zone.
+  if os.path.islink("/etc/localtime"):
+    tzname = _zone_from_symlink("/etc/localtime")
+    if tzname is not None:
+      return _tzinfome(tzname)
+
+  f = open("/etc/localtime", "rb")
+  data = f.read()
+  f.close()
+
+  # Otherwise /etc/localtime is normally a copy of a file in the local
+  # database, so look for files with exactly the same contents. Once we have
+  # found a name for /etc/localtime, we can use the name to get the "same"
+  # timezone from the inbuilt pytz database.
   matches = []
-  if os.path.exists("/etc/localtime"):
-    f = open("/etc/localtime", "rb")
-    localtime = pytz.tzfile.build_tzinfo("/etc/localtime", f)
-    f.close()
-
-    # We want to match against the local database because /etc/localtime will
-    # be copied from that. Once we have found a name for /etc/localtime, we can
-    # use the name to get the "same" timezone from the inbuilt pytz database.
-
-    tzdatabase = _load_local_tzinfo()
-    if tzdatabase:
-      tznames = tzdatabase.keys()
-      tzvalues = tzdatabase.__getitem__
-    else:
-      tznames = pytz.all_timezones
-      tzvalues = _tzinfome
+  tznames = _load_local_zoneinfo_index().get(hashlib.sha1(data).digest(), ())
+  for tzname in tznames:
+    if tzname not in zones.names():
+      warnings.warn("Skipping %s because not in pytz database." % tzname)
+      continue
+    matches.append(_tzinfome(tzname))
 
-    # See if we can find a "Human Name" for this..
-    for tzname in tznames:
-      tz = tzvalues(tzname)
+  localtime = None
+  if not tznames:
+    # Nothing in the local database has the same bytes (it may have been
+    # compiled by a different version of zic), fall back to finding a zone in
+    # the pytz database with the same transitions.
+    localtime = pytz.tzfile.build_tzinfo("/etc/localtime", io.BytesIO(data))
+    for tzname in pytz.all_timezones:
+      tz = _tzinfome(tzname)
+      if _same_tzinfo(tz, localtime):
+        matches.append(tz)
 
-      if dir(tz) != dir(localtime):
-        continue
+  matches.sort(key=lambda x: x.zone)
 
-      for attrib in dir(tz):
-        # Ignore functions and specials
-        if callable(getattr(tz, attrib)) or attrib.startswith("__"):
-          continue
+  if len(matches) == 1:
+    return matches[0]
 
-        # This will always be different
-        if attrib == "zone" or attrib == "_tzinfos":
-          continue
+  if len(matches) > 1:
+    warnings.warn("We detected multiple matches for your /etc/localtime. "
+                  "(Matches where %s)" % matches)
+    return matches[0]
+  else:
+    warnings.warn("We detected no matches for your /etc/localtime.")
 
-        if getattr(tz, attrib) != getattr(localtime, attrib):
-          break
+  if localtime is None:
+    localtime = pytz.tzfile.build_tzinfo("/etc/localtime", io.BytesIO(data))
+
+  # Register /etc/localtime as the timezone loaded.
+  pytz._tzinfo_cache["/etc/localtime"] = localtime
+  zones.register("/etc/localtime", localtime)
+  return localtime
+
+
+def _detect_timezone_php():
+  tomatch = (time.tzname[0], time.timezone, bool(time.daylight))
+  matches = signatures.lookup(tomatch, datetime.date.today().year)
+
+  if len(matches) > 1:
+    warnings.warn("We detected multiple matches for the timezone, choosing "
+                  "the first %s. (Matches where %s)" % (matches[0], matches))
+  if matches:
+    return pytz.timezone(matches[0])
 
-      # We get here iff break didn't happen, i.e. no meaningful attributes
-      # differ between tz and localtime
-      else:
-        # Try and get a timezone from pytz which has the same name as the zone
-        # which matches in the local database.
-        if tzname not in pytz.all_timezones:
-          warnings.warn("Skipping %s because not in pytz database." % tzname)
-          continue
 
-        matches.append(_tzinfome(tzname))
+def _new_in_period(cls, wall, index, period):
+  """Creates a datetime_tz for a wall clock time in a known period of a zone.
+
+  Args:
+    cls: The datetime_tz (sub)class to create.
+    wall: A naive datetime.
+    index: The tzindex.ZoneIndex of the zone.
+    period: The period of the zone wall is in.
+
+  Returns:
+    A cls object.
+  """
+  obj = datetime.datetime.__new__(
+      cls, tzindex.state(wall), index.tzinfos[period])
+  obj.is_dst = index.dsts[period]
+  return obj
+
+
+def _new_from_utc(cls, utc, index):
+  """Creates a datetime_tz for a UTC time in an indexed zone.
+
+  Args:
+    cls: The datetime_tz (sub)class to create.
+    utc: A naive datetime in UTC.
+    index: The tzindex.ZoneIndex of the zone.
+
+  Returns:
+    A cls object.
+  """
+  period = index.period_utc(utc)
+  return _new_in_period(cls, utc + index.offsets[period], index, period)
+
+
+# (tzinfo, zone name) keyed by id(tzinfo), for the tzinfo objects of the named
+# pytz zones datetime_tz.__reduce__ has pickled. pytz interns those, so this is
+# bounded by the number of zones (and their periods).
+_pickle_zones = {}
+
+# (transitions, transition info, tzinfo) of the zones _rebuild_zone has
+# created, keyed by name.
+_rebuilt_zones = {}
+
+
+def _unpickle(epoch_us, zone, cls=None):
+  """Recreates a pickled datetime_tz, see datetime_tz.__reduce__.
+
+  Args:
+    epoch_us: The datetime_tz.sort_key() of the pickled object.
+    zone: The name of its zone, the _zone_data() of a pytz zone which isn't in
+          the pytz database, or its tzinfo object if it has no name.
+    cls: The datetime_tz subclass to create, None for datetime_tz.
+
+  Returns:
+    A cls object.
+  """
+  if cls is None:
+    cls = datetime_tz
+
+  if isinstance(zone, basestring):
+    tzinfo = zones.get(zone)
+  elif isinstance(zone, tuple):
+    tzinfo = _rebuild_zone(*zone)
+  else:
+    tzinfo = zone
+  return _from_epoch_us(cls, epoch_us, tzinfo)
+
+
+def _zone_data(tzinfo):
+  """Gets what _rebuild_zone needs to recreate a pytz zone.
+
+  Args:
+    tzinfo: A pytz DstTzInfo or StaticTzInfo object.
+
+  Returns:
+    A (name, transitions, transition info) tuple, the transitions are None for
+    a StaticTzInfo and the info is its (utcoffset, tzname).
+  """
+  transitions = getattr(tzinfo, "_utc_transition_times", None)
+  if transitions is None:
+    return (tzinfo.zone, None, (tzinfo._utcoffset, tzinfo._tzname))
+  return (tzinfo.zone, transitions, tzinfo._transition_info)
+
+
+def _rebuild_zone(name, transitions, info):
+  """Recreates a pytz zone from its _zone_data(), as build_tzinfo does.
+
+  Unpickling many times in the same zone gives the same tzinfo object.
+  """
+  entry = _rebuilt_zones.get(name)
+  if entry is not None and entry[0] == transitions and entry[1] == info:
+    return entry[2]
+
+  if transitions is None:
+    tzclass = type(str(name), (pytz.tzinfo.StaticTzInfo,), dict(
+        zone=name, _utcoffset=info[0], _tzname=info[1]))
+  else:
+    tzclass = type(str(name), (pytz.tzinfo.DstTzInfo,), dict(
+        zone=name, _utc_transition_times=transitions,
+        _transition_info=[tuple(i) for i in info]))
+  tzinfo = tzclass()
+  _rebuilt_zones[name] = (transitions, info, tzinfo)
+  return tzinfo
 
-    matches.sort(key=lambda x: x.zone)
 
-    if len(matches) == 1:
-      return matches[0]
+def _from_epoch_us(cls, epoch_us, tzinfo):
+  """Creates a datetime_tz from an exact Unix time.
 
-    if len(matches) > 1:
-      warnings.warn("We detected multiple matches for your /etc/localtime. "
-                    "(Matches where %s)" % matches)
-      return matches[0]
+  Args:
+    cls: The datetime_tz (sub)class to create.
+    epoch_us: Integer microseconds since the epoch.
+    tzinfo: The tzinfo object of the result.
+
+  Returns:
+    A cls object.
+
+  Raises:
+    OverflowError: If the time is out of range.
+  """
+  utc = tzindex._EPOCH_NAIVE + datetime.timedelta(0, 0, epoch_us)
+  index = tzindex.get(tzinfo)
+  if index is None:
+    return cls(utc, pytz.utc).astimezone(tzinfo)
+
+  obj = _new_from_utc(cls, utc, index)
+  obj._epoch_us = epoch_us
+  return obj
+
+
+_UTC_INDEX = tzindex.get(pytz.utc)
+
+# The tzinfo classes which datetime_tz.adopt trusts to be already localized.
+_PYTZ_TZINFO_TYPES = (pytz.tzinfo.BaseTzInfo, pytz._FixedOffset)
+
+
+class _parse_default(datetime.datetime):
+  """The default datetime given to dateutil, recording which fields it sets.
+
+  dateutil fills in the fields missing from a string by calling replace() on
+  the default with the fields it did find.
+  """
+
+  replaced = None
+
+  def replace(self, **kw):
+    self.replaced = kw
+    return datetime.datetime(
+        tzindex.state(datetime.datetime.replace(self, **kw)))
+
+  def clock_independent(self):
+    """Returns True if the date didn't come from the default."""
+    replaced = self.replaced
+    if (replaced is None or "year" not in replaced or "month" not in replaced or
+        "day" not in replaced):
+      return False
+    # dateutil sets the day to the end of the month itself when the default
+    # day is past it.
+    day = replaced["day"]
+    return day >= self.day or day != calendar.monthrange(
+        replaced["year"], replaced["month"])[1]
+
+
+# The strptime formats datetime_tz.smartparse_many tries, the ones dateutil
+# reads the same way and which have a full date.
+_SMARTPARSE_MANY_FORMATS = (
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M:%S,%f",
+    "%Y/%m/%d %H:%M:%S",
+    "%Y/%m/%d",
+    "%m/%d/%Y %H:%M:%S",
+    "%m/%d/%Y",
+    "%b %d %H:%M:%S %Y",
+    "%a %b %d %H:%M:%S %Y",
+    "%a, %d %b %Y %H:%M:%S",
+    "%d %b %Y %H:%M:%S",
+    "%d %b %Y",
+    "%d %B %Y",
+    "%d-%b-%Y %H:%M:%S",
+    "%B %d, %Y",
+    "%Y%m%d%H%M%S",
+    "%Y%m%d",
+)
+
+
+def _infer_parser(cls, sample, parsed, tzinfo, epoch_unit=None):
+  """Finds a parser which gives the same results as smartparse on a sample.
+
+  Args:
+    cls: The datetime_tz (sub)class to create.
+    sample: A list of strings.
+    parsed: The smartparse (result, exception) for each string in sample.
+    tzinfo: The tzinfo object smartparse was given.
+    epoch_unit: The epoch_unit smartparse was given.
+
+  Returns:
+    A function which parses a string into a cls object, raising ValueError if
+    the string doesn't fit, or None if nothing fits the sample.
+  """
+  def iso8601_parser(toparse):
+    dt = iso8601.parse(toparse.strip())
+    if dt.tzinfo is not None:
+      return cls(dt)
+    return cls(dt, tzinfo)
+
+  def epoch_parser(toparse):
+    epoch_us = epoch.parse(toparse.strip(), epoch_unit)
+    if epoch_us is None:
+      raise ValueError("Not a timestamp: %r" % toparse)
+    return _from_epoch_us(cls, epoch_us, tzinfo)
+
+  def strptime_parser(fmt):
+    return lambda toparse: cls.strptime(toparse.strip(), fmt, tzinfo)
+
+  candidates = [iso8601_parser, epoch_parser] + [
+      strptime_parser(fmt) for fmt in _SMARTPARSE_MANY_FORMATS]
+
+  expected = [(toparse, result) for toparse, (result, _) in zip(sample, parsed)
+              if result is not None]
+  if not expected:
+    return None
+
+  for parser in candidates:
+    for toparse, result in expected:
+      try:
+        dt = parser(toparse)
+      except Exception:  # pylint: disable=broad-except
+        break
+      if dt.tzinfo is not result.tzinfo or dt.asdatetime() != (
+          result.asdatetime()):
+        break
     else:
-      warnings.warn("We detected no matches for your /etc/localtime.")
+      return parser
+  return None
 
-    # Register /etc/localtime as the timezone loaded.
-    pytz._tzinfo_cache["/etc/localtime"] = localtime
-    return localtime
 
+# Parsed smartparse results, keyed by (class, string, tzinfo).
+smartparse_cache = lrucache.LRUCache(1024)
 
-def _detect_timezone_php():
-  tomatch = (time.tzname[0], time.timezone, time.daylight)
-  now = datetime.datetime.now()
+# Error codes of datetime_tz.try_smartparse_many.
+PARSE_OK = 0
+PARSE_EMPTY = 1  # Nothing but whitespace.
+PARSE_NOT_A_DATE = 2  # Rejected without parsing, see _could_be_date.
+PARSE_INVALID = 3  # Not understood, or not a valid date.
+PARSE_AMBIGUOUS = 4  # A local time which happens twice.
+PARSE_NONEXISTENT = 5  # A local time skipped by a DST transition.
 
-  matches = []
-  for tzname in pytz.all_timezones:
-    try:
-      tz = pytz.timezone(tzname)
-    except IOError:
-      continue
+_DIGIT = re.compile(r"\d")
+_WORD = re.compile(r"[a-z]+")
 
-    try:
-      indst = tz.localize(now).timetuple()[-1]
+# The words dateutil can make a date from without any digits.
+_DATE_WORDS = relative.DATE_WORDS.union(
+    name.lower()
+    for names in (dateutil.parser.parserinfo.MONTHS +
+                  dateutil.parser.parserinfo.WEEKDAYS)
+    for name in names)
 
-      if tomatch == (tz._tzname, -tz._utcoffset.seconds, indst):
-        matches.append(tzname)
 
-    # pylint: disable=pointless-except
-    except AttributeError:
-      pass
+def _could_be_date(toparse):
+  """Cheaply checks a string isn't obviously something other than a date.
 
-  if len(matches) > 1:
-    warnings.warn("We detected multiple matches for the timezone, choosing "
-                  "the first %s. (Matches where %s)" % (matches[0], matches))
-  if matches:
-    return pytz.timezone(matches[0])
+  Strings smartparse understands either have a digit in them or the name of a
+  month or weekday, or a word like "yesterday" or "hour".
+
+  Args:
+    toparse: A stripped string.
+
+  Returns:
+    False if smartparse is sure to fail on the string.
+  """
+  if _DIGIT.search(toparse):
+    return True
+  for word in _WORD.findall(toparse.lower()):
+    if word in _DATE_WORDS:
+      return True
+  return False
 
 
 class _default_tzinfos(object):
@@ -383,7 +877,7 @@ class _default_tzinfos(object):
 
   def __getitem__(self, key, default=_marker):
     try:
-      return pytz.timezone(key)
+      return zones.get(key)
     except KeyError:
       if default is self._marker:
         raise KeyError(key)
@@ -392,7 +886,9 @@ class _default_tzinfos(object):
   get = __getitem__
 
   def has_key(self, key):
-    return key in pytz.all_timezones
+    return zones.is_valid(key)
+
+  __contains__ = has_key
 
   def __iter__(self):
     for i in pytz.all_timezones:
@@ -410,7 +906,8 @@ class datetime_tz(datetime.datetime):
     * Full integration with pytz (just give it the string of the timezone!)
     * Proper support for going to/from Unix timestamps (which are in UTC!).
   """
-  __slots__ = ["is_dst"]
+  # _epoch_us is the sort_key(), calculated the first time it is needed.
+  __slots__ = ["is_dst", "_epoch_us"]
 
   def __new__(cls, *args, **kw):
     args = list(args)
@@ -424,12 +921,11 @@ class datetime_tz(datetime.datetime):
     elif kw.get("tzinfo", None) is not None:
       tzinfo = _tzinfome(kw.pop("tzinfo"))
 
+    is_dst = kw.pop("is_dst", None)
+
     # Create a datetime object if we don't have one
     if isinstance(args[0], datetime.datetime):
-      # Convert the datetime instance to a datetime object.
-      newargs = (list(args[0].timetuple()[0:6]) +
-                 [args[0].microsecond, args[0].tzinfo])
-      dt = datetime.datetime(*newargs)
+      dt = args[0]
 
       if tzinfo is None and dt.tzinfo is None:
         raise TypeError("Must specify a timezone!")
@@ -441,20 +937,28 @@ class datetime_tz(datetime.datetime):
       dt = datetime.datetime(*args, **kw)
 
     if dt.tzinfo is not None:
-      # Re-normalize the dt object
-      dt = dt.tzinfo.normalize(dt)
+      index = tzindex.get(dt.tzinfo)
+      if index is not None:
+        # Re-normalize the dt object
+        utc = tzindex.utc_naive(dt)
+        period = index.period_utc(utc)
+        return _new_in_period(cls, utc + index.offsets[period], index, period)
+
+      # Not a pytz timezone, let it normalize itself.
+      newargs = (list(dt.timetuple()[0:6]) + [dt.microsecond, dt.tzinfo])
+      dt = dt.tzinfo.normalize(datetime.datetime(*newargs))
 
     else:
       if tzinfo is None:
         tzinfo = localtz()
 
+      index = tzindex.get(tzinfo)
+      if index is not None:
+        return _new_in_period(cls, dt, index, index.resolve(dt, is_dst))
+
       try:
         dt = tzinfo.localize(dt, is_dst=None)
       except pytz.AmbiguousTimeError:
-        is_dst = None
-        if "is_dst" in kw:
-          is_dst = kw.pop("is_dst")
-
         try:
           dt = tzinfo.localize(dt, is_dst)
         except IndexError:
@@ -465,13 +969,142 @@ class datetime_tz(datetime.datetime):
     obj.is_dst = obj.dst() != datetime.timedelta(0)
     return obj
 
+  @classmethod
+  def adopt(cls, dt):
+    """Wrap an aware datetime which is already normalized, without checking it.
+
+    This is a trusted alternative to datetime_tz(dt) for values which came out
+    of pytz (tzinfo.localize, tzinfo.normalize, astimezone with a pytz zone).
+    The tzinfo is used as is, so the caller must guarantee it is the correct
+    localized instance for dt. Passing a datetime with a tzinfo which was not
+    localized (for example datetime(..., tzinfo=pytz.timezone(...))) gives a
+    wrong result.
+
+    Datetimes with a tzinfo which is not from pytz fall back to the normal
+    constructor.
+
+    Args:
+      dt: A timezone aware datetime object.
+
+    Returns:
+      A datetime_tz object (dt itself if it is already one).
+
+    Raises:
+      TypeError: If dt is naive.
+    """
+    if type(dt) is cls:
+      return dt
+
+    tzinfo = dt.tzinfo
+    if tzinfo is None:
+      raise TypeError("Must specify a timezone!")
+
+    if not isinstance(tzinfo, _PYTZ_TZINFO_TYPES):
+      return cls(dt)
+
+    obj = datetime.datetime.__new__(
+        cls, dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second,
+        dt.microsecond, tzinfo)
+    obj.is_dst = obj.dst() != _ZERO
+    return obj
+
+  @classmethod
+  def from_fields_many(cls, years, months, days, hours=None, minutes=None,
+                       seconds=None, microseconds=None, tzinfo=None,
+                       is_dst=None):
+    """Creates datetime_tz objects from columns of wall clock time fields.
+
+    Row i of the result is datetime_tz(years[i], months[i], days[i], hours[i],
+    minutes[i], seconds[i], microseconds[i], tzinfo, is_dst=is_dst), but the
+    timezone is only looked up once for the whole batch.
+
+    Args:
+      years, months, days: Sequences (or any iterables, such as array.array
+                           objects) of the date fields.
+      hours, minutes, seconds, microseconds: Optional sequences of the time
+                                             fields, missing ones are 0.
+      tzinfo: Timezone all the fields are in. (Defaults to your local
+              timezone.)
+      is_dst: Used to pick the time for ambiguous rows, None means ambiguous
+              rows raise an exception.
+
+    Returns:
+      A list of datetime_tz objects, one per row.
+
+    Raises:
+      ValueError: If the columns aren't all the same length.
+      pytz.AmbiguousTimeError: If a row is ambiguous and is_dst is None.
+      pytz.NonExistentTimeError: If a row doesn't exist.
+    """
+    if tzinfo is None:
+      tzinfo = localtz()
+    tzinfo = _tzinfome(tzinfo)
+
+    # zip() would quietly drop the rows past the end of the shortest column.
+    columns = []
+    for column in (years, months, days, hours, minutes, seconds, microseconds):
+      if column is None:
+        column = itertools.repeat(0)
+      elif not hasattr(column, "__len__"):
+        column = list(column)
+      columns.append(column)
+    lengths = set(len(column) for column in columns
+                  if hasattr(column, "__len__"))
+    if len(lengths) > 1:
+      raise ValueError("Columns have different lengths %s" % sorted(lengths))
+    rows = zip(*columns)
+
+    index = tzindex.get(tzinfo)
+    if index is None:
+      return [cls(datetime.datetime(*row), tzinfo, is_dst=is_dst)
+              for row in rows]
+
+    # Consecutive rows are usually in the same period, which resolve() checks
+    # before searching.
+    resolve = index.resolve
+    return [_new_in_period(cls, wall, index, resolve(wall, is_dst))
+            for wall in itertools.starmap(datetime.datetime, rows)]
+
+  def __reduce__(self):
+    """Pickles the time as microseconds since the epoch and the zone's name.
+
+    The pickle is smaller than datetime's, and it is unpickled without
+    localizing so ambiguous times round trip.
+    """
+    tzinfo = self.tzinfo
+    entry = _pickle_zones.get(id(tzinfo))
+    if entry is not None and entry[0] is tzinfo:
+      zone = entry[1]
+    else:
+      zone = getattr(tzinfo, "zone", None)
+      if zone in zones.names() and (
+          tzindex.get(zones.get(zone)) is tzindex.get(tzinfo)):
+        _pickle_zones[id(tzinfo)] = (tzinfo, zone)
+      elif isinstance(tzinfo, (pytz.tzinfo.DstTzInfo,
+                               pytz.tzinfo.StaticTzInfo)):
+        # pytz pickles its zones by name, which only loads if the name is in
+        # the pytz database. Zones such as the one registered for
+        # /etc/localtime are pickled with their transitions instead.
+        zone = _zone_data(tzinfo)
+      else:
+        # Not a zone we can find again by name (a FixedOffset for example).
+        zone = tzinfo
+
+    if type(self) is datetime_tz:
+      return (_unpickle, (self.sort_key(), zone))
+    return (_unpickle, (self.sort_key(), zone, type(self)))
+
+  def __reduce_ex__(self, protocol):
+    # datetime defines __reduce_ex__, which pickle prefers to __reduce__.
+    return self.__reduce__()
+
+  # datetime_tz objects are immutable, so copies can be the object itself.
   def __copy__(self):
-    return type(self)(self)
+    return self
 
   def __deepcopy__(self, memo):
-    dpcpy = type(self)(self)
-    memo[id(self)] = dpcpy
-    return dpcpy
+    memo[id(self)] = self
+    return self
 
   def asdatetime(self, naive=True):
     """Return this datetime_tz as a datetime object.
@@ -482,10 +1115,100 @@ class datetime_tz(datetime.datetime):
     Returns:
       This datetime_tz as a datetime object.
     """
-    args = list(self.timetuple()[0:6])+[self.microsecond]
-    if not naive:
-      args.append(self.tzinfo)
-    return datetime.datetime(*args)
+    if naive:
+      return tzindex.wall_naive(self)
+    return datetime.datetime(tzindex.state(self), self.tzinfo)
+
+  def __add__(self, other):
+    if not isinstance(other, datetime.timedelta):
+      return NotImplemented
+
+    index = tzindex.get(self.tzinfo)
+    if index is None:
+      return type(self)(self.asdatetime(naive=False) + other)
+
+    # Only moves to another period if the result crosses a transition.
+    utc = tzindex.utc_naive(self) + other
+    period = index.period_utc(utc)
+    return _new_in_period(
+        type(self), utc + index.offsets[period], index, period)
+
+  __radd__ = __add__
+
+  def __sub__(self, other):
+    if isinstance(other, datetime.datetime):
+      # Differences don't need a datetime_tz to be created.
+      return datetime.datetime.__sub__(self, other)
+
+    if not isinstance(other, datetime.timedelta):
+      return NotImplemented
+
+    index = tzindex.get(self.tzinfo)
+    if index is None:
+      return type(self)(self.asdatetime(naive=False) - other)
+
+    utc = tzindex.utc_naive(self) - other
+    period = index.period_utc(utc)
+    return _new_in_period(
+        type(self), utc + index.offsets[period], index, period)
+
+  def __rsub__(self, other):
+    if isinstance(other, datetime.datetime):
+      return datetime.datetime.__sub__(other, self)
+    return NotImplemented
+
+  def sort_key(self):
+    """Returns this time as an integer number of microseconds since the epoch.
+
+    The key orders datetime_tz objects the same way comparing them does, no
+    matter which timezone they are in, and only needs to be worked out once.
+
+    Returns:
+      Microseconds since 1970-01-01 00:00:00 UTC.
+    """
+    try:
+      return self._epoch_us
+    except AttributeError:
+      delta = tzindex.utc_naive(self) - tzindex._EPOCH_NAIVE
+      key = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+      self._epoch_us = key
+      return key
+
+  # Comparing two aware datetimes asks both tzinfo objects for their utcoffset
+  # every time, between datetime_tz objects the cached sort_key is used.
+  def __eq__(self, other):
+    if isinstance(other, datetime_tz):
+      return self.sort_key() == other.sort_key()
+    return datetime.datetime.__eq__(self, other)
+
+  def __ne__(self, other):
+    if isinstance(other, datetime_tz):
+      return self.sort_key() != other.sort_key()
+    return datetime.datetime.__ne__(self, other)
+
+  def __lt__(self, other):
+    if isinstance(other, datetime_tz):
+      return self.sort_key() < other.sort_key()
+    return datetime.datetime.__lt__(self, other)
+
+  def __le__(self, other):
+    if isinstance(other, datetime_tz):
+      return self.sort_key() <= other.sort_key()
+    return datetime.datetime.__le__(self, other)
+
+  def __gt__(self, other):
+    if isinstance(other, datetime_tz):
+      return self.sort_key() > other.sort_key()
+    return datetime.datetime.__gt__(self, other)
+
+  def __ge__(self, other):
+    if isinstance(other, datetime_tz):
+      return self.sort_key() >= other.sort_key()
+    return datetime.datetime.__ge__(self, other)
+
+  # Equal datetime_tz and datetime objects must hash the same, so keep
+  # datetime's hash (which it caches after the first call).
+  __hash__ = datetime.datetime.__hash__
 
   def asdate(self):
     """Return this datetime_tz as a date object.
@@ -520,6 +1243,10 @@ class datetime_tz(datetime.datetime):
 
     tzinfo = _tzinfome(tzinfo)
 
+    index = tzindex.get(tzinfo)
+    if index is not None:
+      return _new_from_utc(type(self), tzindex.utc_naive(self), index)
+
     d = self.asdatetime(naive=False).astimezone(tzinfo)
     return type(self)(d)
 
@@ -560,12 +1287,21 @@ class datetime_tz(datetime.datetime):
 
     replaced = self.asdatetime().replace(**kw)
 
+    # Reuse the zone we already have rather than looking it up by name again.
+    if tzinfo is None:
+      index = tzindex.get(self.tzinfo)
+    else:
+      index = tzindex.get(_tzinfome(tzinfo))
+    if index is not None:
+      return _new_in_period(
+          type(self), replaced, index, index.resolve(replaced, is_dst))
+
     return type(self)(
         replaced, tzinfo=tzinfo or self.tzinfo.zone, is_dst=is_dst)
 
   # pylint: disable=line-to-long
   @classmethod
-  def smartparse(cls, toparse, tzinfo=None):
+  def smartparse(cls, toparse, tzinfo=None, now=None, epoch_unit=None):
     """Method which uses dateutil.parse and extras to try and parse the string.
 
     Valid dates are found at:
@@ -578,14 +1314,26 @@ class datetime_tz(datetime.datetime):
       "5 minutes ago"
       "10 hours ago"
       "10h5m ago"
+      "in 2 days and an hour"
+      "next monday"
       "start of yesterday"
       "end of tomorrow"
       "end of 3rd of March"
+      "start of month"
+      "end of next quarter"
+      "1436618094" or "1436618094123" (Unix time, see the epoch module)
+
+    (See the relative module for the full grammar.)
 
     Args:
       toparse: The string to parse.
       tzinfo: Timezone for the resultant datetime_tz object should be in.
               (Defaults to your local timezone.)
+      now: The datetime relative expressions are relative to. (Defaults to
+           datetime_tz.now(), see also reference_time.)
+      epoch_unit: "s", "ms", "us" or "ns" to read any number as a Unix time
+                  in that unit, rather than working the unit out from the
+                  number of digits.
 
     Returns:
       New datetime_tz object.
@@ -593,110 +1341,341 @@ class datetime_tz(datetime.datetime):
     Raises:
       ValueError: If unable to make sense of the input.
     """
-    # Default for empty fields are:
-    #  year/month/day == now
-    #  hour/minute/second/microsecond == 0
     toparse = toparse.strip()
 
+    # Results which don't depend on the current time are cached, see
+    # smartparse_cache.
     if tzinfo is None:
-      dt = cls.now()
+      key = (cls, toparse, localtz(), epoch_unit)
     else:
+      key = (cls, toparse, _tzinfome(tzinfo), epoch_unit)
+    dt = smartparse_cache.get(key)
+    if dt is not None:
+      return dt
+
+    dt, clock_independent = cls._smartparse(toparse, tzinfo, now, epoch_unit)
+    if clock_independent:
+      smartparse_cache.put(key, dt)
+    return dt
+
+  @classmethod
+  def _smartparse(cls, toparse, tzinfo, now, epoch_unit):
+    """Does the work of smartparse.
+
+    Args:
+      toparse: The stripped string to parse.
+      tzinfo: Timezone for the resultant datetime_tz object should be in.
+      now: The datetime relative expressions are relative to, or None.
+      epoch_unit: The unit of Unix times, or None to work it out.
+
+    Returns:
+      A (datetime_tz, clock_independent) tuple, clock_independent is True if
+      parsing the string at any other time gives the same result.
+    """
+    # Most strings are strict ISO 8601 timestamps, which need neither dateutil
+    # nor the current time.
+    try:
+      dt = iso8601.parse(toparse)
+    except ValueError:
+      pass
+    else:
+      if dt.tzinfo is not None:
+        return cls(dt), True
+      if tzinfo is None:
+        tzinfo = localtz()
+      return cls(dt, tzinfo), True
+
+    # Unix times never go near dateutil, which would read "1436618094" as a
+    # year.
+    epoch_us = epoch.parse(toparse, epoch_unit)
+    if epoch_us is not None:
+      if tzinfo is None:
+        tzinfo = localtz()
+      else:
+        tzinfo = _tzinfome(tzinfo)
+      return _from_epoch_us(cls, epoch_us, tzinfo), True
+
+    # "start of " and "end of " prefixes apply to relative and absolute times.
+    boundary, toparse = relative.split_boundary(toparse)
+    expression = relative.parse(toparse, boundary)
+
+    if now is None:
       dt = cls.now(tzinfo)
+    elif tzinfo is None:
+      dt = _reference_in(cls, _reference_aware(now), localtz())
+    else:
+      dt = _reference_in(cls, _reference_aware(now), _tzinfome(tzinfo))
 
-    default = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    if expression is not None:
+      return expression.resolve(dt, boundary), False
 
-    # Remove "start of " and "end of " prefix in the string
-    if toparse.lower().startswith("end of "):
-      toparse = toparse[7:].strip()
+    # Default for empty fields are:
+    #  year/month/day == now
+    #  hour/minute/second/microsecond == 0 (or the end of the day for "end of")
+    if boundary == "end":
+      default = relative.end_of(dt)
+    else:
+      default = relative.start_of(dt)
 
-      dt += datetime.timedelta(days=1)
-      dt = dt.replace(hour=0, minute=0, second=0, microsecond=0)
-      dt -= datetime.timedelta(microseconds=1)
+    # Handle strings with normal datetime format, use original case.
+    default = _parse_default(tzindex.state(default))
+    dt = dateutil.parser.parse(toparse, default=default,
+                               tzinfos=pytz_abbr.tzinfos)
+    if dt is None:
+      raise ValueError("Was not able to parse date!")
 
-      default = dt
+    if dt.tzinfo is pytz_abbr.unknown:
+      dt = dt.replace(tzinfo=None)
 
-    elif toparse.lower().startswith("start of "):
-      toparse = toparse[9:].strip()
+    if dt.tzinfo is None:
+      if tzinfo is None:
+        tzinfo = localtz()
+      dt = cls(dt, tzinfo)
+    elif isinstance(dt.tzinfo, pytz_abbr.tzabbr):
+      abbr = dt.tzinfo
+      dt = cls(dt.replace(tzinfo=None), abbr.zone, is_dst=abbr.is_dst)
+    else:
+      dt = cls(dt)
 
-      dt = dt.replace(hour=0, minute=0, second=0, microsecond=0)
-      default = dt
+    return dt, default.clock_independent()
 
-    # Handle strings with "now", "today", "yesterday", "tomorrow" and "ago".
-    # Need to use lowercase
-    toparselower = toparse.lower()
+  @classmethod
+  def smartparse_many(cls, iterable, tzinfo=None, sample_size=20, now=None,
+                      epoch_unit=None):
+    """Parses many strings, which are expected to share one format.
 
-    if toparselower in ["now", "today"]:
-      pass
+    The format is worked out from the first sample_size strings and the rest
+    are parsed with a parser made for it, falling back to smartparse for any
+    string which doesn't fit. A format is only used if it gives the same
+    results as smartparse for the whole sample.
 
-    elif toparselower == "yesterday":
-      dt -= datetime.timedelta(days=1)
-
-    elif toparselower in ("tomorrow", "tommorrow"):
-      # tommorrow is spelled wrong, but code out there might be depending on it
-      # working
-      dt += datetime.timedelta(days=1)
-
-    elif "ago" in toparselower:
-      # Remove the "ago" bit
-      toparselower = toparselower[:-3]
-      # Replace all "a day and an hour" with "1 day 1 hour"
-      toparselower = toparselower.replace("a ", "1 ")
-      toparselower = toparselower.replace("an ", "1 ")
-      toparselower = toparselower.replace(" and ", " ")
-
-      # Match the following
-      # 1 hour ago
-      # 1h ago
-      # 1 h ago
-      # 1 hour ago
-      # 2 hours ago
-      # Same with minutes, seconds, etc.
-
-      tocheck = ("seconds", "minutes", "hours", "days", "weeks", "months",
-                 "years")
-      result = {}
-      for match in re.finditer("([0-9]+)([^0-9]*)", toparselower):
-        amount = int(match.group(1))
-        unit = match.group(2).strip()
-
-        for bit in tocheck:
-          regex = "^([%s]|((%s)s?))$" % (
-              bit[0], bit[:-1])
-
-          bitmatch = re.search(regex, unit)
-          if bitmatch:
-            result[bit] = amount
-            break
-        else:
-          raise ValueError("Was not able to parse date unit %r!" % unit)
-
-      delta = dateutil.relativedelta.relativedelta(**result)
-      dt -= delta
+    Args:
+      iterable: The strings to parse, read lazily.
+      tzinfo: Timezone for the resultant datetime_tz object should be in.
+              (Defaults to your local timezone.)
+      sample_size: How many strings to work the format out from.
+      now: The datetime relative expressions are relative to. (Defaults to
+           the time each string is parsed.)
+      epoch_unit: The unit of Unix times, see smartparse.
+
+    Yields:
+      A datetime_tz object for each string.
 
+    Raises:
+      ValueError: If unable to make sense of a string (as smartparse).
+    """
+    if tzinfo is None:
+      tzinfo = localtz()
     else:
-      # Handle strings with normal datetime format, use original case.
-      dt = dateutil.parser.parse(toparse, default=default.asdatetime(),
-                                 tzinfos=pytz_abbr.tzinfos)
-      if dt is None:
-        raise ValueError("Was not able to parse date!")
-
-      if dt.tzinfo is pytz_abbr.unknown:
-        dt = dt.replace(tzinfo=None)
-
-      if dt.tzinfo is None:
-        if tzinfo is None:
-          tzinfo = localtz()
-        dt = cls(dt, tzinfo)
-      else:
-        if isinstance(dt.tzinfo, pytz_abbr.tzabbr):
-          abbr = dt.tzinfo
-          dt = dt.replace(tzinfo=None)
-          dt = cls(dt, abbr.zone, is_dst=abbr.is_dst)
+      tzinfo = _tzinfome(tzinfo)
+
+    iterator = iter(iterable)
+    sample = list(itertools.islice(iterator, sample_size))
+
+    # smartparse results (or the exception) for the sample.
+    parsed = []
+    for toparse in sample:
+      try:
+        parsed.append(
+            (cls.smartparse(toparse, tzinfo, now, epoch_unit), None))
+      except Exception as e:  # pylint: disable=broad-except
+        parsed.append((None, e))
+
+    parser = _infer_parser(cls, sample, parsed, tzinfo, epoch_unit)
 
-        dt = cls(dt)
+    for result, error in parsed:
+      if error is not None:
+        raise error
+      yield result
 
+    for toparse in iterator:
+      if parser is not None and isinstance(toparse, basestring):
+        try:
+          yield parser(toparse)
+          continue
+        except (ValueError, pytz.InvalidTimeError):
+          pass
+      yield cls.smartparse(toparse, tzinfo, now, epoch_unit)
+
+  @classmethod
+  def try_smartparse(cls, toparse, tzinfo=None, default=None, now=None,
+                     epoch_unit=None):
+    """Like smartparse, but returns default rather than raising.
+
+    Strings which obviously aren't dates (such as "-", "null" or "N/A") are
+    rejected without being parsed, which is much cheaper than smartparse
+    failing on them.
+
+    Args:
+      toparse: The string to parse, None and other objects which aren't
+               strings give default.
+      tzinfo: Timezone for the resultant datetime_tz object should be in.
+              (Defaults to your local timezone.)
+      default: Returned if the string can't be parsed.
+      now: The datetime relative expressions are relative to. (Defaults to
+           datetime_tz.now().)
+      epoch_unit: The unit of Unix times, see smartparse.
+
+    Returns:
+      New datetime_tz object, or default.
+    """
+    dt, _ = cls._try_smartparse(toparse, tzinfo, now, epoch_unit)
+    if dt is None:
+      return default
     return dt
 
+  @classmethod
+  def try_smartparse_many(cls, iterable, tzinfo=None, sample_size=20,
+                          now=None, epoch_unit=None):
+    """Parses many strings without raising, see smartparse_many.
+
+    Args:
+      iterable: The strings to parse.
+      tzinfo: Timezone for the resultant datetime_tz object should be in.
+              (Defaults to your local timezone.)
+      sample_size: How many strings to work the format out from.
+      now: The datetime relative expressions are relative to. (Defaults to
+           the time each string is parsed.)
+      epoch_unit: The unit of Unix times, see smartparse.
+
+    Returns:
+      A (results, errors) tuple of lists with an entry for each string. The
+      result is a datetime_tz object, or None if the string couldn't be
+      parsed. The error is PARSE_OK, or the PARSE_* code saying why it
+      couldn't be (None is PARSE_EMPTY and other objects which aren't strings
+      are PARSE_INVALID).
+    """
+    if tzinfo is None:
+      tzinfo = localtz()
+    else:
+      tzinfo = _tzinfome(tzinfo)
+
+    results = []
+    errors = []
+    iterator = iter(iterable)
+    sample = list(itertools.islice(iterator, sample_size))
+    for toparse in sample:
+      dt, error = cls._try_smartparse(toparse, tzinfo, now, epoch_unit)
+      results.append(dt)
+      errors.append(error)
+
+    parser = _infer_parser(
+        cls, sample, [(dt, None) for dt in results], tzinfo, epoch_unit)
+
+    for toparse in iterator:
+      if parser is not None and isinstance(toparse, basestring):
+        try:
+          results.append(parser(toparse))
+          errors.append(PARSE_OK)
+          continue
+        except (ValueError, pytz.InvalidTimeError):
+          pass
+      dt, error = cls._try_smartparse(toparse, tzinfo, now, epoch_unit)
+      results.append(dt)
+      errors.append(error)
+
+    return results, errors
+
+  @classmethod
+  def _try_smartparse(cls, toparse, tzinfo, now, epoch_unit):
+    """Does the work of try_smartparse.
+
+    Returns:
+      A (datetime_tz, error) tuple, the datetime_tz is None unless the error
+      is PARSE_OK.
+    """
+    if toparse is None:
+      return None, PARSE_EMPTY
+    if not isinstance(toparse, basestring):
+      return None, PARSE_INVALID
+    toparse = toparse.strip()
+    if not toparse:
+      return None, PARSE_EMPTY
+    if not _could_be_date(toparse):
+      return None, PARSE_NOT_A_DATE
+
+    try:
+      return cls.smartparse(toparse, tzinfo, now, epoch_unit), PARSE_OK
+    except pytz.AmbiguousTimeError:
+      return None, PARSE_AMBIGUOUS
+    except pytz.NonExistentTimeError:
+      return None, PARSE_NONEXISTENT
+    except (ValueError, OverflowError):
+      return None, PARSE_INVALID
+
+  @classmethod
+  def strptime(cls, toparse, fmt, tzinfo=None):
+    """Parses a string in a known format, see datetime.datetime.strptime.
+
+    The format is compiled the first time it is seen, see the formats module.
+    %z (an offset) and %Z (an abbreviation from pytz_abbr) give the timezone
+    of the result.
+
+    Args:
+      toparse: The string to parse.
+      fmt: A strptime format string.
+      tzinfo: Timezone for strings without a %z or %Z. (Defaults to your
+              local timezone.)
+
+    Returns:
+      New datetime_tz object.
+
+    Raises:
+      ValueError: If the string doesn't match the format.
+      pytz.AmbiguousTimeError: If the time is ambiguous.
+      pytz.NonExistentTimeError: If the time doesn't exist.
+    """
+    wall, zone, is_dst = formats.get(fmt).parse(toparse)
+    if zone is None:
+      if tzinfo is None:
+        zone = localtz()
+      else:
+        zone = _tzinfome(tzinfo)
+
+    index = tzindex.get(zone)
+    if index is not None:
+      return _new_in_period(cls, wall, index, index.resolve(wall, is_dst))
+    return cls(wall, zone, is_dst=is_dst)
+
+  @classmethod
+  def strptime_many(cls, iterable, fmt, tzinfo=None):
+    """Parses many strings in the same known format, see strptime.
+
+    Args:
+      iterable: The strings to parse.
+      fmt: A strptime format string.
+      tzinfo: Timezone for strings without a %z or %Z. (Defaults to your
+              local timezone.)
+
+    Returns:
+      A list of datetime_tz objects, one per string.
+
+    Raises:
+      ValueError: If a string doesn't match the format.
+      pytz.AmbiguousTimeError: If a time is ambiguous.
+      pytz.NonExistentTimeError: If a time doesn't exist.
+    """
+    if tzinfo is None:
+      tzinfo = localtz()
+    else:
+      tzinfo = _tzinfome(tzinfo)
+    default_index = tzindex.get(tzinfo)
+
+    parse = formats.get(fmt).parse
+    results = []
+    for toparse in iterable:
+      wall, zone, is_dst = parse(toparse)
+      if zone is None:
+        zone, index = tzinfo, default_index
+      else:
+        index = tzindex.get(zone)
+      if index is not None:
+        results.append(
+            _new_in_period(cls, wall, index, index.resolve(wall, is_dst)))
+      else:
+        results.append(cls(wall, zone, is_dst=is_dst))
+    return results
+
   @classmethod
   def utcfromtimestamp(cls, timestamp):
     """Returns a datetime object of a given timestamp (in UTC)."""
@@ -712,14 +1691,25 @@ class datetime_tz(datetime.datetime):
 
   @classmethod
   def utcnow(cls):
-    """Return a new datetime representing UTC day and time."""
-    obj = datetime.datetime.utcnow()
-    obj = cls(obj, tzinfo=pytz.utc)
-    return obj
+    """Return a new datetime representing UTC day and time.
+
+    Inside reference_time() this is the reference time.
+    """
+    clock = _clock.get()
+    if clock is not None:
+      return clock.now(cls, pytz.utc)
+    return _new_from_utc(cls, datetime.datetime.utcnow(), _UTC_INDEX)
 
   @classmethod
   def now(cls, tzinfo=None):
-    """[tz] -> new datetime with tz's local day and time."""
+    """[tz] -> new datetime with tz's local day and time.
+
+    Inside reference_time() this is the reference time.
+    """
+    clock = _clock.get()
+    if clock is not None:
+      return clock.now(cls, tzinfo)
+
     obj = cls.utcnow()
     if tzinfo is None:
       tzinfo = localtz()
@@ -852,40 +1842,13 @@ class iterate(object):
     return iterate.between(start, datetime.timedelta(minutes=1), end)
 
 
-def _wrap_method(name):
-  """Wrap a method.
-
-  Patch a method which might return a datetime.datetime to return a
-  datetime_tz.datetime_tz instead.
-
-  Args:
-    name: The name of the method to patch
-  """
-  method = getattr(datetime.datetime, name)
-
-  # Have to give the second argument as method has no __module__ option.
-  @functools.wraps(method, ("__name__", "__doc__"), ())
-  def wrapper(self, *args, **kw):
-    r = method(self.asdatetime(naive=False), *args, **kw)
-
-    if isinstance(r, datetime.datetime) and not isinstance(r, type(self)):
-      r = type(self)(r)
-    return r
-
-  setattr(datetime_tz, name, wrapper)
-
-for methodname in ["__add__", "__radd__", "__rsub__", "__sub__"]:
-
-  # Make sure we have not already got an override for this method
-  assert methodname not in datetime_tz.__dict__
-  # pypy 1.5.0 lacks __rsub__
-  if hasattr(datetime.datetime, methodname):
-    _wrap_method(methodname)
-
 __all__ = [
     "datetime_tz", "detect_timezone", "iterate", "localtz",
-    "localtz_set", "timedelta", "_detect_timezone_environ",
+    "localtz_set", "local_timezone", "reference_time", "timedelta",
+    "_detect_timezone_environ",
     "_detect_timezone_etc_localtime", "_detect_timezone_etc_timezone",
     "_detect_timezone_php", "localize", "get_naive", "localtz_name",
-    "require_timezone"]
+    "require_timezone", "smartparse_cache", "sorted_events", "PARSE_OK",
+    "PARSE_EMPTY", "PARSE_NOT_A_DATE", "PARSE_INVALID", "PARSE_AMBIGUOUS",
+    "PARSE_NONEXISTENT"]
 
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: set ts=2 sw=2 et sts=2 ai:
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Parser for numeric Unix timestamps, such as "1436618094" or "1436618094.5".
+
+Without a unit the unit is picked by the number of digits before the point,
+
+  9 to 11 digits   seconds       (1973 to 5138)
+  13 digits        milliseconds
+  15 or 16 digits  microseconds
+  17 to 19 digits  nanoseconds
+
+Shorter numbers, and 12 and 14 digit ones which are more likely to be
+YYYYMMDDHHMM[SS] dates, are not timestamps unless a unit is given.
+
+The arithmetic is done on integers so no precision is lost, fractions of a
+microsecond are rounded down.
+"""
+
+import re
+
+_NUMBER = re.compile(r"([-+]?)(\d+)(?:\.(\d*))?\Z")
+
+# Decimal digits in a second, by unit.
+UNITS = {"s": 0, "ms": 3, "us": 6, "ns": 9}
+
+# Unit by the number of integer digits, for numbers without a unit.
+_UNIT_BY_DIGITS = {
+    9: "s", 10: "s", 11: "s",
+    13: "ms",
+    15: "us", 16: "us",
+    17: "ns", 18: "ns", 19: "ns",
+}
+
+
+def parse(toparse, unit=None):
+  """Parses a numeric Unix timestamp.
+
+  Args:
+    toparse: The string to parse, without surrounding whitespace.
+    unit: "s", "ms", "us" or "ns", or None to pick one from the number of
+          digits.
+
+  Returns:
+    The time as an integer number of microseconds since the epoch, or None if
+    the string is not a timestamp.
+
+  Raises:
+    ValueError: If unit is not one of UNITS.
+  """
+  if unit is not None and unit not in UNITS:
+    raise ValueError("Unknown epoch unit %r, use one of %s" % (
+        unit, ", ".join(sorted(UNITS))))
+
+  match = _NUMBER.match(toparse)
+  if match is None:
+    return None
+
+  sign, whole, fraction = match.groups()
+  if unit is None:
+    unit = _UNIT_BY_DIGITS.get(len(whole.lstrip("0") or "0"))
+    if unit is None:
+      return None
+
+  fraction = fraction or ""
+  number = int(sign + whole + fraction)
+  scale = 10 ** len(fraction)
+  digits = UNITS[unit]
+  if digits <= 6:
+    return number * 10 ** (6 - digits) // scale
+  return number // (scale * 10 ** (digits - 6))
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: set ts=2 sw=2 et sts=2 ai:
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Compiled strptime style formats, used by datetime_tz.strptime.
+
+A format is turned into a single regular expression (the same ones the
+standard library's _strptime uses) and a list of field converters the first
+time it is seen. Unlike datetime.strptime the result also carries the
+timezone,
+
+  %z  is an offset ("+1000", "-04:30", "+05:30:45" or "Z") and gives a
+      pytz.FixedOffset (or pytz.utc)
+  %Z  is an abbreviation looked up in pytz_abbr ("EST", "AEDT", "UTC")
+
+Month and weekday names are always English, whatever the locale. Formats with
+directives which aren't supported here (such as %j, %U or %c) are handed to
+datetime.datetime.strptime.
+"""
+
+import datetime
+import re
+
+import pytz
+
+from . import pytz_abbr
+from . import zones
+
+_MONTHS = ("january", "february", "march", "april", "may", "june", "july",
+           "august", "september", "october", "november", "december")
+_MONTH_ABBRS = tuple(name[:3] for name in _MONTHS)
+_WEEKDAYS = ("monday", "tuesday", "wednesday", "thursday", "friday",
+             "saturday", "sunday")
+
+
+def _names(names):
+  """Returns a regex group matching any of names, longest first."""
+  return "(%s)" % "|".join(sorted(names, key=len, reverse=True))
+
+
+def _year2(text):
+  # The POSIX rule, as datetime.strptime.
+  year = int(text)
+  if year <= 68:
+    return year + 2000
+  return year + 1900
+
+
+def _microsecond(text):
+  return int(text.ljust(6, "0"))
+
+
+def _month_name(text):
+  return _MONTHS.index(text.lower()) + 1
+
+
+def _month_abbr(text):
+  return _MONTH_ABBRS.index(text.lower()) + 1
+
+
+def _offset(text):
+  if text in ("Z", "z"):
+    return pytz.utc
+  digits = text[1:].replace(":", "")
+  if ":" in text and text.count(":") != len(digits) // 2 - 1:
+    raise ValueError("Inconsistent use of : in %s" % text)
+  seconds = int(digits[:2]) * 3600 + int(digits[2:4]) * 60 + int(
+      digits[4:] or 0)
+  return zones.fixed_offset(-seconds if text[0] == "-" else seconds)
+
+
+def _abbr(text):
+  abbr = pytz_abbr.all.get(text.upper())
+  if abbr is None:
+    raise ValueError("Unknown timezone found %s" % text)
+  return abbr
+
+
+# Slots of the parsed values, the first 7 are the datetime fields.
+_YEAR, _MONTH, _DAY, _HOUR, _MINUTE, _SECOND, _MICROSECOND = range(7)
+_PM, _TZINFO, _ABBR, _IGNORED = range(7, 11)
+
+# directive: (regex, slot, converter)
+_DIRECTIVES = {
+    "Y": (r"(\d\d\d\d)", _YEAR, int),
+    "y": (r"(\d\d)", _YEAR, _year2),
+    "m": (r"(1[0-2]|0[1-9]|[1-9])", _MONTH, int),
+    "B": (_names(_MONTHS), _MONTH, _month_name),
+    "b": (_names(_MONTH_ABBRS), _MONTH, _month_abbr),
+    "d": (r"(3[0-1]|[1-2]\d|0[1-9]|[1-9]| [1-9])", _DAY, int),
+    "H": (r"(2[0-3]|[0-1]\d|\d)", _HOUR, int),
+    "I": (r"(1[0-2]|0[1-9]|[1-9])", _HOUR, int),
+    "M": (r"([0-5]\d|\d)", _MINUTE, int),
+    "S": (r"(6[0-1]|[0-5]\d|\d)", _SECOND, int),
+    "f": (r"([0-9]{1,6})", _MICROSECOND, _microsecond),
+    "p": (r"(am|pm)", _PM, lambda text: text.lower() == "pm"),
+    "z": (r"([+-]\d\d:?[0-5]\d(?::?[0-5]\d)?|Z)", _TZINFO, _offset),
+    "Z": (r"([a-z]{1,5})", _ABBR, _abbr),
+    "A": (_names(_WEEKDAYS), _IGNORED, None),
+    "a": (_names(name[:3] for name in _WEEKDAYS), _IGNORED, None),
+}
+_DIRECTIVES["h"] = _DIRECTIVES["b"]
+
+_DIRECTIVE = re.compile(r"%(.)", re.DOTALL)
+_SPECIAL = re.compile(r"([\\.^$*+?\(\){}\[\]|])")
+_WHITESPACE = re.compile(r"\s+")
+
+# Formats by format string, cleared when it reaches _FORMATS_MAX entries (as
+# the re module does).
+_formats = {}
+_FORMATS_MAX = 100
+
+
+class Format(object):
+  """A compiled strptime format, see get()."""
+
+  __slots__ = ("format", "_regex", "_fields", "_twelve_hour")
+
+  def __init__(self, fmt):
+    """Compiles a format.
+
+    Args:
+      fmt: A strptime format string.
+    """
+    self.format = fmt
+    self._regex = None
+    self._fields = []
+    self._twelve_hour = False
+
+    # Alternating literal text and directives.
+    parts = _DIRECTIVE.split(fmt)
+    pattern = []
+    for i, part in enumerate(parts):
+      if i % 2 == 0:
+        if "%" in part:
+          # A stray %, let the standard library complain about it.
+          self._fields = None
+          return
+        # Whitespace matches any amount of whitespace, as datetime.strptime.
+        pattern.append(_WHITESPACE.sub(r"\\s+", _SPECIAL.sub(r"\\\1", part)))
+      elif part == "%":
+        pattern.append("%")
+      elif part in _DIRECTIVES:
+        regex, slot, convert = _DIRECTIVES[part]
+        pattern.append(regex)
+        self._fields.append((slot, convert))
+        if part == "I":
+          self._twelve_hour = True
+      else:
+        # Leave anything else (%j, %U, %c, ...) to the standard library.
+        self._fields = None
+        return
+
+    self._regex = re.compile("".join(pattern) + r"\Z", re.IGNORECASE)
+
+  def parse(self, toparse):
+    """Parses a string in this format.
+
+    Args:
+      toparse: The string to parse.
+
+    Returns:
+      A (wall, tzinfo, is_dst) tuple. wall is a naive datetime of the wall
+      clock time. tzinfo is the pytz timezone given by %z or %Z, or None.
+      is_dst is the daylight savings time flag of a %Z abbreviation, or None.
+
+    Raises:
+      ValueError: If the string doesn't match the format or is not a valid
+                  time.
+    """
+    if self._regex is None:
+      return self._parse_stdlib(toparse)
+
+    match = self._regex.match(toparse)
+    if match is None:
+      raise ValueError("time data %r does not match format %r" % (
+          toparse, self.format))
+
+    values = [1900, 1, 1, 0, 0, 0, 0, False, None, None, None]
+    for (slot, convert), text in zip(self._fields, match.groups()):
+      if convert is not None:
+        values[slot] = convert(text)
+
+    if self._twelve_hour:
+      # As datetime.strptime, a missing %p is AM.
+      values[_HOUR] %= 12
+      if values[_PM]:
+        values[_HOUR] += 12
+
+    wall = datetime.datetime(*values[:7])
+    abbr = values[_ABBR]
+    if abbr is not None:
+      return wall, abbr.zone, abbr.is_dst
+    return wall, values[_TZINFO], None
+
+  def _parse_stdlib(self, toparse):
+    """Does the work of parse() with datetime.datetime.strptime."""
+    dt = datetime.datetime.strptime(toparse, self.format)
+    if dt.tzinfo is None:
+      return dt, None, None
+    offset = dt.utcoffset()
+    if offset.microseconds:
+      # Only the standard library's timezone can have these.
+      return dt.replace(tzinfo=None), dt.tzinfo, None
+    seconds = offset.days * 86400 + offset.seconds
+    return dt.replace(tzinfo=None), zones.fixed_offset(seconds), None
+
+
+def get(fmt):
+  """Gets the compiled Format for a strptime format string.
+
+  Args:
+    fmt: A strptime format string.
+
+  Returns:
+    A Format object.
+  """
+  compiled = _formats.get(fmt)
+  if compiled is None:
+    if len(_formats) >= _FORMATS_MAX:
+      _formats.clear()
+    compiled = _formats[fmt] = Format(fmt)
+  return compiled
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: set ts=2 sw=2 et sts=2 ai:
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Strict parser for ISO 8601 / RFC 3339 timestamps.
+
+Accepts the extended ISO 8601 forms which make up most machine written
+timestamps, such as
+
+  2008-07-13
+  2008-07-13T12:05
+  2008-07-13 12:05:01
+  2008-07-13T12:05:01.123456Z
+  2008-07-13T12:05:01,5+05:30
+  2008-07-13T12:05:01-0400
+
+and gives the same result dateutil.parser.parse gives (with the datetime_tz
+tzinfos) for them, without the cost of dateutil's general tokenizer. Anything
+else is rejected so it can be handed to dateutil instead.
+"""
+
+import datetime
+import re
+
+import pytz
+
+from . import zones
+
+_ISO8601 = re.compile(r"""
+    (\d{4})-(\d{2})-(\d{2})                  # date
+    (?:[T ](\d{2}):(\d{2})                   # hour and minute
+       (?::(\d{2})(?:[.,](\d+))?)?           # seconds and fraction
+       (?:([Zz])|([-+])(\d{2})(?::?(\d{2}))?)?  # Z or offset
+    )?\Z""", re.VERBOSE)
+
+
+def parse(toparse):
+  """Parses a strict ISO 8601 / RFC 3339 timestamp.
+
+  Fractions of a second past microseconds are truncated. Z and zero offsets
+  give pytz.utc, other offsets a pytz.FixedOffset.
+
+  Args:
+    toparse: The string to parse, without surrounding whitespace.
+
+  Returns:
+    A datetime.datetime, which is naive if the string has no offset.
+
+  Raises:
+    ValueError: If the string is not an ISO 8601 timestamp or is not a valid
+                time.
+  """
+  match = _ISO8601.match(toparse)
+  if match is None:
+    raise ValueError("Not an ISO 8601 timestamp: %r" % toparse)
+
+  (year, month, day, hour, minute, second, fraction, zulu, sign, tzhour,
+   tzminute) = match.groups()
+
+  if hour is None:
+    return datetime.datetime(int(year), int(month), int(day))
+
+  if fraction:
+    microsecond = int(fraction[:6].ljust(6, "0"))
+  else:
+    microsecond = 0
+
+  if zulu:
+    tzinfo = pytz.utc
+  elif sign:
+    offset = int(tzhour) * 60 + int(tzminute or 0)
+    tzinfo = zones.fixed_offset(-offset * 60 if sign == "-" else offset * 60)
+  else:
+    tzinfo = None
+
+  return datetime.datetime(
+      int(year), int(month), int(day), int(hour), int(minute),
+      int(second or 0), microsecond, tzinfo)
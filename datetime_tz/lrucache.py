@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: set ts=2 sw=2 et sts=2 ai:
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""A bounded, thread safe least recently used cache.
+
+functools.lru_cache only wraps whole functions, while smartparse needs to
+decide per call whether a result may be cached at all.
+"""
+
+import collections
+import threading
+
+CacheInfo = collections.namedtuple(
+    "CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+
+class LRUCache(object):
+  """Maps keys to values, dropping the least recently used beyond maxsize."""
+
+  def __init__(self, maxsize=1024):
+    """Creates an empty cache.
+
+    Args:
+      maxsize: The most entries the cache will hold, 0 disables it.
+    """
+    self._lock = threading.Lock()
+    self._items = collections.OrderedDict()
+    self._maxsize = maxsize
+    self._hits = 0
+    self._misses = 0
+
+  def get(self, key, default=None):
+    """Returns the value for key (and marks it as recently used).
+
+    Args:
+      key: A hashable key.
+      default: Returned if the key is not in the cache.
+
+    Returns:
+      The cached value, or default.
+    """
+    if not self._maxsize:
+      return default
+
+    with self._lock:
+      try:
+        value = self._items.pop(key)
+      except KeyError:
+        self._misses += 1
+        return default
+      self._items[key] = value
+      self._hits += 1
+      return value
+
+  def put(self, key, value):
+    """Stores value for key, dropping the least recently used if full."""
+    if not self._maxsize:
+      return
+
+    with self._lock:
+      self._items.pop(key, None)
+      self._items[key] = value
+      while len(self._items) > self._maxsize:
+        self._items.popitem(last=False)
+
+  def resize(self, maxsize):
+    """Changes the most entries the cache will hold, 0 disables it."""
+    with self._lock:
+      self._maxsize = maxsize
+      while len(self._items) > maxsize:
+        self._items.popitem(last=False)
+
+  def clear(self):
+    """Empties the cache and resets the statistics."""
+    with self._lock:
+      self._items.clear()
+      self._hits = 0
+      self._misses = 0
+
+  def info(self):
+    """Returns the cache statistics as a CacheInfo tuple."""
+    with self._lock:
+      return CacheInfo(self._hits, self._misses, self._maxsize,
+                       len(self._items))
@@ -30,7 +30,8 @@ unique within a region. For example, EST can mean any of,
 Where there are two abbreviations the more popular one will appear in the all
 dictionary, while the less common one will only appear in that countries region
 dictionary. IE If using all, EST will be mapped to Eastern Standard Time in
-North America.
+North America. When the offset is also known ("EST+1000") tzinfos uses it to
+pick between the meanings of the abbreviation.
 
 CAVEAT 2: Many of the acronyms don't map to a neat Oslon timezones. For example,
 Eastern European Summer Time (EEDT) is used by many different countries in
@@ -47,6 +48,9 @@ import datetime
 import pytz
 import pytz.tzfile
 
+from . import tzindex
+from . import zones
+
 try:
   basestring
 except NameError:
@@ -54,6 +58,35 @@ except NameError:
   basestring = str
 
 
+_1970 = datetime.datetime(1970, 1, 1)
+
+
+def _offsets(abbr, zone, dst):
+  """Works out the UTC offsets an abbreviation stands for in a zone.
+
+  Args:
+    abbr: The abbreviation.
+    zone: The pytz zone it is mapped to.
+    dst: True if it is a daylight savings time abbreviation.
+
+  Returns:
+    A frozenset of offsets in seconds.
+  """
+  if not isinstance(zone, pytz.tzinfo.DstTzInfo):
+    offset = zone.utcoffset(_1970)
+    return frozenset([offset.days * 86400 + offset.seconds])
+
+  infos = list(zip(zone._utc_transition_times, zone._transition_info))
+  # The periods the zone itself calls abbr, otherwise (when the zone uses
+  # different names) the modern periods with the same DST setting.
+  matching = [info for _, info in infos if info[2] == abbr] or [
+      info for start, info in infos
+      if start >= _1970 and bool(info[1]) == dst] or [
+          info for _, info in infos]
+  return frozenset(
+      offset.days * 86400 + offset.seconds for offset, _, _ in matching)
+
+
 class tzabbr(datetime.tzinfo):
   """A timezone abbreviation.
 
@@ -75,12 +108,32 @@ class tzabbr(datetime.tzinfo):
 
     self.zone = zone
     self.is_dst = dst
+    # The UTC offsets (in seconds) the abbreviation stands for.
+    self.offsets = _offsets(abbr, zone, dst)
+    # (naive datetime, localized datetime) of the last _get_localized call.
+    self._last = None
 
   def _get_localized(self, dt):
     # To make this a fully-functioning pass-through to the underlying pytz
     # zone, we would want to use `fold` to set `is_dst`, but since this is
     # only a temporary proxy for the zone, we will fix the DST status
-    return self.zone.localize(dt.replace(tzinfo=None), is_dst=self.is_dst)
+    wall = dt.replace(tzinfo=None)
+
+    # dateutil (and then datetime_tz) usually ask about the same time a few
+    # times in a row.
+    last = self._last
+    if last is not None and last[0] == wall:
+      return last[1]
+
+    index = tzindex.get(self.zone)
+    if index is None:
+      localized = self.zone.localize(wall, is_dst=self.is_dst)
+    else:
+      # The same period pytz's localize picks, without the normalize calls.
+      localized = wall.replace(
+          tzinfo=index.tzinfos[index.localize(wall, self.is_dst)])
+    self._last = (wall, localized)
+    return localized
 
   def tzname(self, dt):
     return self._get_localized(dt).tzname()
@@ -112,6 +165,11 @@ all = regions["all"]
 military = regions["military"]
 
 
+# Every registered abbreviation (whatever its region) keyed by (abbreviation,
+# UTC offset in seconds), in the order they were registered.
+by_offset = {}
+
+
 def tzabbr_register(abbr, name, region, zone, dst):
   """Register a new timezone abbreviation in the global registry.
 
@@ -129,24 +187,58 @@ def tzabbr_register(abbr, name, region, zone, dst):
   assert abbr not in regions[region]
   regions[region][abbr] = newabbr
 
+  for offset in newabbr.offsets:
+    by_offset.setdefault((abbr, offset), []).append(newabbr)
+
 
 def tzinfos_create(use_region):
-  abbrs = regions[use_region]
+  """Creates a dateutil tzinfos function which uses the abbreviation tables.
+
+  Args:
+    use_region: The region to look abbreviations up in, or a list of regions
+                to look in one after the other. "all" has every
+                abbreviation, in its most popular meaning.
+
+  Returns:
+    A function taking the abbreviation and offset (in seconds) dateutil found,
+    and returning a tzinfo object. When both are given the offset picks
+    between the meanings of the abbreviation in the allowed regions, and a
+    ValueError is raised if none of them has that offset.
+  """
+  if isinstance(use_region, basestring):
+    use_region = [use_region]
+  tables = [regions[region] for region in use_region]
+  if "all" in use_region:
+    allowed = None
+  else:
+    allowed = frozenset(use_region)
 
   def tzinfos(abbr, offset):
     if abbr:
-      if abbr in abbrs:
-        result = abbrs[abbr]
-        if offset:
-          # FIXME: Check the offset matches the abbreviation we just selected.
-          pass
-        return result
+      for abbrs in tables:
+        if abbr in abbrs:
+          result = abbrs[abbr]
+          break
       else:
         raise ValueError("Unknown timezone found %s" % abbr)
-    if offset == 0:
-      return pytz.utc
-    if offset:
-      return pytz.FixedOffset(offset/60)
+
+      if offset is None:
+        return result
+
+      # dateutil reads "IST+05:30" the POSIX way, as 5:30 behind UTC (but "IST
+      # +05:30" as ahead), so the sign of the offset can't be trusted. Prefer
+      # a meaning with the offset as given, then one with the sign flipped.
+      for possible in (offset, -offset):
+        if possible in result.offsets:
+          return result
+        for other in by_offset.get((abbr, possible), ()):
+          if allowed is None or other.region in allowed:
+            return other
+      raise ValueError("Timezone %s is never %+d seconds from UTC" % (
+          abbr, offset))
+
+    if offset is not None:
+      return zones.fixed_offset(offset)
     return unknown
 
   return tzinfos
@@ -279,3 +371,26 @@ tzabbr_register("WST", u"Western Standard Time", u"Australia",
 tzabbr_register("X", u"X-ray Time Zone", u"Military", "Etc/GMT+11", False)
 tzabbr_register("Y", u"Yankee Time Zone", u"Military", "Etc/GMT+12", False)
 tzabbr_register("Z", u"Zulu Time Zone", u"Military", pytz.utc, False)
+
+# Less common meanings of the abbreviations above, which are only used when the
+# offset says so (or the region is asked for).
+tzabbr_register("AST", u"Arabia Standard Time", u"Middle East",
+                "Asia/Riyadh", False)
+tzabbr_register("BST", u"Bangladesh Standard Time", u"Asia",
+                "Asia/Dhaka", False)
+tzabbr_register("CDT", u"Australian Central Daylight Time", u"Australia",
+                "Australia/Adelaide", True)
+tzabbr_register("CST", u"China Standard Time", u"Asia",
+                "Asia/Shanghai", False)
+tzabbr_register("CST", u"Australian Central Standard Time", u"Australia",
+                "Australia/Adelaide", False)
+tzabbr_register("EDT", u"Australian Eastern Daylight Time", u"Australia",
+                "Australia/Sydney", True)
+tzabbr_register("EST", u"Australian Eastern Standard Time", u"Australia",
+                "Australia/Sydney", False)
+tzabbr_register("IST", u"India Standard Time", u"Asia",
+                "Asia/Kolkata", False)
+tzabbr_register("IST", u"Israel Standard Time", u"Middle East",
+                "Asia/Jerusalem", False)
+tzabbr_register("PST", u"Philippine Standard Time", u"Asia",
+                "Asia/Manila", False)
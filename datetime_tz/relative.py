@@ -0,0 +1,323 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: set ts=2 sw=2 et sts=2 ai:
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Grammar for the relative time expressions understood by smartparse.
+
+An expression is an optional boundary followed by a body,
+
+  expression := [("start of" | "end of")] body
+  body       := "now" | "today" | "yesterday" | "tomorrow"
+              | duration "ago" | "in" duration | duration "from now"
+              | ("next" | "last") weekday
+              | ["next" | "last" | "this"] ("week" | "month" | "quarter"
+                                            | "year")
+  duration   := amount unit [["and" | ","] amount unit]...
+  amount     := digits | "a" | "an"
+
+for example "10h5m ago", "in 2 days and an hour", "next monday", "start of
+yesterday", "start of month" and "end of last quarter".
+
+The body is resolved first and the boundary is then taken in wall clock time,
+of the day or of the week, month, quarter or year named. A bare period
+("month") is only an expression with a boundary. Bodies which are not
+relative are left for an absolute parser, "start of 3rd of March" still means
+the start of that day.
+
+All the patterns are compiled once, at import.
+"""
+
+import datetime
+import re
+
+import dateutil.relativedelta
+
+_BOUNDARY = re.compile(r"\s*(start|end)\s+of\s+", re.IGNORECASE)
+
+_KEYWORDS = {
+    "now": 0,
+    "today": 0,
+    "yesterday": -1,
+    "tomorrow": 1,
+    # tommorrow is spelled wrong, but code out there might be depending on it
+    # working
+    "tommorrow": 1,
+}
+
+_AGO = re.compile(r"(.+?) ?\bago\Z")
+_IN = re.compile(r"in (.+)\Z")
+_FROM_NOW = re.compile(r"(.+) from now\Z")
+_PERIOD = re.compile(r"(?:(next|last|this) )?(week|month|quarter|year)\Z")
+_WEEKDAY = re.compile(r"(next|last) ([a-z]+)\Z")
+
+_DURATION_PART = re.compile(r"(?:(?:and|,) ?)?(\d+|an?(?= )) ?([a-z]+) ?")
+
+_UNITS = {}
+for _unit, _names in (
+    ("seconds", ("s", "sec", "secs", "second", "seconds")),
+    ("minutes", ("m", "min", "mins", "minute", "minutes")),
+    ("hours", ("h", "hr", "hrs", "hour", "hours")),
+    ("days", ("d", "day", "days")),
+    ("weeks", ("w", "week", "weeks")),
+    ("months", ("month", "months")),
+    ("years", ("y", "yr", "yrs", "year", "years"))):
+  for _name in _names:
+    _UNITS[_name] = _unit
+
+_WEEKDAYS = {}
+for _weekday, _names in enumerate((
+    ("mon", "monday"),
+    ("tue", "tues", "tuesday"),
+    ("wed", "wednesday"),
+    ("thu", "thur", "thurs", "thursday"),
+    ("fri", "friday"),
+    ("sat", "saturday"),
+    ("sun", "sunday"))):
+  for _name in _names:
+    _WEEKDAYS[_name] = _weekday
+
+# How far "next" and "last" move for each period.
+_PERIODS = {
+    "day": datetime.timedelta(days=1),
+    "week": datetime.timedelta(weeks=1),
+    "month": dateutil.relativedelta.relativedelta(months=1),
+    "quarter": dateutil.relativedelta.relativedelta(months=3),
+    "year": dateutil.relativedelta.relativedelta(years=1),
+}
+
+# Any expression without digits has at least one of these words in it.
+DATE_WORDS = frozenset(
+    list(_KEYWORDS) + list(_UNITS) + list(_WEEKDAYS) + list(_PERIODS))
+
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+# Expressions (which are immutable) by (string, boundary), cleared when it
+# reaches _PARSED_MAX entries.
+_parsed = {}
+_PARSED_MAX = 1024
+
+
+def split_boundary(toparse):
+  """Splits a "start of " or "end of " prefix off a string.
+
+  Args:
+    toparse: The string to parse.
+
+  Returns:
+    A (boundary, rest) tuple, boundary is "start", "end" or None.
+  """
+  match = _BOUNDARY.match(toparse)
+  if match is None:
+    return None, toparse
+  return match.group(1).lower(), toparse[match.end():].strip()
+
+
+def _duration(text):
+  """Parses "2 days and 5h" style durations.
+
+  Args:
+    text: The normalized (lower case, single spaced) duration.
+
+  Returns:
+    A dateutil.relativedelta.relativedelta.
+
+  Raises:
+    ValueError: If text is not a duration.
+  """
+  amounts = {}
+  pos = 0
+  while pos < len(text):
+    match = _DURATION_PART.match(text, pos)
+    if match is None:
+      raise ValueError("Was not able to parse duration %r!" % text[pos:])
+    amount, unit = match.groups()
+    if unit not in _UNITS:
+      raise ValueError("Was not able to parse date unit %r!" % unit)
+    unit = _UNITS[unit]
+    amounts[unit] = amounts.get(unit, 0) + (
+        1 if amount in ("a", "an") else int(amount))
+    pos = match.end()
+
+  if not amounts:
+    raise ValueError("Was not able to parse duration %r!" % text)
+  if "months" in amounts or "years" in amounts:
+    return dateutil.relativedelta.relativedelta(**amounts)
+  # Adding a timedelta gives the same result, much more cheaply.
+  return datetime.timedelta(**amounts)
+
+
+class Expression(object):
+  """A parsed relative expression, see parse().
+
+  Attributes:
+    shift: Added to the current time (a timedelta or relativedelta), or
+           None.
+    weekday: Weekday (0 is Monday) to move to for "next/last <weekday>", or
+             None.
+    direction: 1 for "next", -1 for "last".
+    period: The period a boundary is taken of ("day", "week", "month",
+            "quarter" or "year").
+  """
+
+  __slots__ = ("shift", "weekday", "direction", "period")
+
+  def __init__(self, shift=None, weekday=None, direction=1, period="day"):
+    self.shift = shift
+    self.weekday = weekday
+    self.direction = direction
+    self.period = period
+
+  def resolve(self, now, boundary=None):
+    """Works out the time the expression refers to.
+
+    Args:
+      now: The current time, as a datetime_tz.
+      boundary: "start", "end" or None.
+
+    Returns:
+      A datetime_tz in the same timezone as now.
+    """
+    dt = now
+    if self.shift is not None:
+      dt = dt + self.shift
+
+    if self.weekday is not None:
+      # The weekday strictly after (or before) today, at the start of the day.
+      date = dt.date() + dateutil.relativedelta.relativedelta(
+          days=self.direction, weekday=dateutil.relativedelta.weekday(
+              self.weekday, self.direction))
+      dt = _at_midnight(dt, date)
+
+    if boundary == "start":
+      return start_of(dt, self.period)
+    if boundary == "end":
+      return end_of(dt, self.period)
+    return dt
+
+
+def parse(toparse, boundary=None):
+  """Parses a relative expression (without its boundary).
+
+  Args:
+    toparse: The string to parse, see split_boundary().
+    boundary: The boundary split off the string, bare periods ("month") are
+              only expressions with one.
+
+  Returns:
+    An Expression, or None if the string isn't a relative expression.
+
+  Raises:
+    ValueError: If the string looks like a relative expression but isn't a
+                valid one (such as "5 billion years ago").
+  """
+  key = (toparse, boundary)
+  try:
+    return _parsed[key]
+  except KeyError:
+    pass
+
+  expression = _parse(" ".join(toparse.lower().split()), boundary)
+  if len(_parsed) >= _PARSED_MAX:
+    _parsed.clear()
+  _parsed[key] = expression
+  return expression
+
+
+def _parse(text, boundary):
+  """Does the work of parse() on the normalized text."""
+
+  if text in _KEYWORDS:
+    days = _KEYWORDS[text]
+    if days:
+      return Expression(shift=datetime.timedelta(days=days))
+    return Expression()
+
+  match = _AGO.match(text)
+  if match is not None:
+    return Expression(shift=-_duration(match.group(1)))
+
+  match = _IN.match(text) or _FROM_NOW.match(text)
+  if match is not None:
+    return Expression(shift=_duration(match.group(1)))
+
+  match = _PERIOD.match(text)
+  if match is not None:
+    which, period = match.groups()
+    if which == "next":
+      return Expression(shift=_PERIODS[period], period=period)
+    if which == "last":
+      return Expression(shift=-_PERIODS[period], period=period)
+    if which == "this" or boundary is not None:
+      return Expression(period=period)
+    return None
+
+  match = _WEEKDAY.match(text)
+  if match is not None and match.group(2) in _WEEKDAYS:
+    which, weekday = match.groups()
+    return Expression(weekday=_WEEKDAYS[weekday],
+                      direction=1 if which == "next" else -1)
+
+  return None
+
+
+def _at_midnight(dt, date):
+  """Returns the start of date, in the timezone of the datetime_tz dt."""
+  if date == dt.date():
+    return dt.replace(hour=0, minute=0, second=0, microsecond=0)
+  return dt.replace(year=date.year, month=date.month, day=date.day, hour=0,
+                    minute=0, second=0, microsecond=0)
+
+
+def _period_start(date, period):
+  """Returns the first date of the period date is in."""
+  if period == "week":
+    return date - datetime.timedelta(days=date.weekday())
+  if period == "month":
+    return date.replace(day=1)
+  if period == "quarter":
+    return date.replace(month=(date.month - 1) // 3 * 3 + 1, day=1)
+  if period == "year":
+    return date.replace(month=1, day=1)
+  return date
+
+
+def start_of(dt, period="day"):
+  """Returns the start of the period a datetime_tz is in.
+
+  Args:
+    dt: A datetime_tz.
+    period: "day", "week" (starting on Monday), "month", "quarter" or
+            "year".
+
+  Returns:
+    A datetime_tz at midnight on the first day of the period.
+  """
+  return _at_midnight(dt, _period_start(dt.date(), period))
+
+
+def end_of(dt, period="day"):
+  """Returns the last microsecond of the period a datetime_tz is in.
+
+  Args:
+    dt: A datetime_tz.
+    period: "day", "week" (starting on Monday), "month", "quarter" or
+            "year".
+
+  Returns:
+    A datetime_tz a microsecond before the start of the next period.
+  """
+  date = _period_start(dt.date(), period) + _PERIODS[period]
+  return _at_midnight(dt, date) - _MICROSECOND
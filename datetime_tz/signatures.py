@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: set ts=2 sw=2 et sts=2 ai:
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Index of zones by the signature the time module gives for them.
+
+The last resort of timezone detection (the "PHP" method) only has what the
+time module knows about the local zone,
+
+  (time.tzname[0], time.timezone, bool(time.daylight))
+
+that is the standard time abbreviation, the standard offset in seconds west of
+UTC and whether the zone has daylight savings time. Like the time module, the
+signature of a zone is worked out from its periods on the 1st of January and
+the 1st of July of a year.
+
+The index maps each signature to the zone names which have it for a year. It
+is built by reading the zone files directly (so pytz's cache of loaded zones
+isn't filled with every zone) and is kept in memory, and on disk when the
+tzcache is turned on so that only the first process of a year builds it.
+"""
+
+import bisect
+import datetime
+
+import pytz
+
+from . import tzcache
+
+_FILENAME = "signatures.json"
+
+# Indexes by year.
+_indexes = {}
+
+
+def _period(tzinfo, utc):
+  """Returns the (utcoffset, dst, tzname) of a pytz zone at a naive UTC time."""
+  # pylint: disable=protected-access
+  transitions = getattr(tzinfo, "_utc_transition_times", None)
+  if not transitions:
+    return tzinfo._utcoffset, datetime.timedelta(0), tzinfo._tzname
+  i = max(bisect.bisect_right(transitions, utc) - 1, 0)
+  return tzinfo._transition_info[i]
+
+
+def signature(tzinfo, year):
+  """Works out the signature of a zone.
+
+  Args:
+    tzinfo: A pytz timezone.
+    year: The year to look at.
+
+  Returns:
+    A (standard abbreviation, standard offset west of UTC in seconds, has
+    daylight savings time) tuple.
+  """
+  january = _period(tzinfo, datetime.datetime(year, 1, 1))
+  july = _period(tzinfo, datetime.datetime(year, 7, 1))
+  # The southern hemisphere has daylight savings time in January.
+  standard = july if january[1] else january
+  offset = standard[0].days * 86400 + standard[0].seconds
+  return (standard[2], -offset, january[0] != july[0])
+
+
+def build(year):
+  """Builds the index for a year.
+
+  Args:
+    year: The year to work out the signatures for.
+
+  Returns:
+    A dictionary of signature to the list of zone names with it, in the order
+    of pytz.all_timezones.
+  """
+  index = {}
+  for name in pytz.all_timezones:
+    try:
+      f = pytz.open_resource(name)
+      try:
+        tzinfo = pytz.tzfile.build_tzinfo(name, f)
+      finally:
+        f.close()
+    except (IOError, OSError):
+      continue
+    index.setdefault(signature(tzinfo, year), []).append(name)
+  return index
+
+
+def get(year):
+  """Gets the index for a year, building it only if it isn't cached.
+
+  Args:
+    year: The year to work out the signatures for.
+
+  Returns:
+    A dictionary as build() returns.
+  """
+  index = _indexes.get(year)
+  if index is not None:
+    return index
+
+  cachekey = [pytz.__version__, year]
+  rows = tzcache.load(cachekey, _FILENAME)
+  if rows is not None:
+    index = dict(((tzname, offset, daylight), names)
+                 for tzname, offset, daylight, names in rows)
+  else:
+    index = build(year)
+    rows = [list(key) + [names] for key, names in index.items()]
+    tzcache.store(cachekey, rows, _FILENAME)
+
+  _indexes[year] = index
+  return index
+
+
+def lookup(sig, year):
+  """Gets the names of the zones with a signature.
+
+  Args:
+    sig: A signature, as signature() returns.
+    year: The year the signature is for.
+
+  Returns:
+    A list of zone names, in the order of pytz.all_timezones.
+  """
+  return get(year).get(sig, [])
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: set ts=2 sw=2 et sts=2 ai:
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""On disk cache of the detected local timezone, shared between processes.
+
+Detecting the local timezone can mean reading the whole zoneinfo database, so
+the name of the zone found is stored in a small JSON file along with the
+inputs detection depends on,
+
+  * the TZ and TZDIR environment values,
+  * the contents of /etc/timezone,
+  * the inode, modification time and size of /etc/localtime (and where it
+    links to),
+  * the modification time of the zoneinfo directory (so updating tzdata
+    invalidates it),
+  * the pytz version.
+
+A later process only has to stat those files to reuse the result, and any
+change to them makes the entry stale.
+
+The cache is off unless the DATETIME_TZ_CACHE_DIR environment value names
+the directory to keep it in, so by default nothing is ever written to disk.
+Other slow to build data (such as the signatures index) is kept in its own
+file there. Errors reading or writing the cache are ignored, it is only ever
+an optimization.
+"""
+
+import json
+import os
+import os.path
+import tempfile
+
+import pytz
+
+_FILENAME = "localtz.json"
+
+
+def directory():
+  """Returns the cache directory, or None if the cache is turned off."""
+  return os.environ.get("DATETIME_TZ_CACHE_DIR") or None
+
+
+def key():
+  """Returns the inputs timezone detection depends on, as a JSON-able list."""
+  try:
+    f = open("/etc/timezone")
+    try:
+      etc_timezone = f.read()
+    finally:
+      f.close()
+  except (IOError, OSError):
+    etc_timezone = None
+
+  try:
+    st = os.stat("/etc/localtime")
+    etc_localtime = [st.st_ino, getattr(st, "st_mtime_ns", st.st_mtime),
+                     st.st_size]
+    if os.path.islink("/etc/localtime"):
+      etc_localtime.append(os.readlink("/etc/localtime"))
+  except OSError:
+    etc_localtime = None
+
+  tzdir = os.environ.get("TZDIR", "/usr/share/zoneinfo")
+  try:
+    st = os.stat(tzdir)
+    tzdir_mtime = getattr(st, "st_mtime_ns", st.st_mtime)
+  except OSError:
+    tzdir_mtime = None
+
+  return [pytz.__version__, os.environ.get("TZ"), os.environ.get("TZDIR"),
+          etc_timezone, etc_localtime, tzdir_mtime]
+
+
+def load(cachekey, filename=_FILENAME):
+  """Gets the cached zone name.
+
+  Args:
+    cachekey: The current key().
+    filename: The cache file, other modules keep their own values in the same
+              directory.
+
+  Returns:
+    The zone name (or other value) stored with the same key, or None.
+  """
+  cachedir = directory()
+  if cachedir is None:
+    return None
+
+  try:
+    f = open(os.path.join(cachedir, filename))
+    try:
+      entry = json.load(f)
+    finally:
+      f.close()
+  except (IOError, OSError, ValueError):
+    return None
+
+  if not isinstance(entry, dict) or entry.get("key") != cachekey:
+    return None
+  return entry.get("value")
+
+
+def store(cachekey, value, filename=_FILENAME):
+  """Stores the zone name detected for a key.
+
+  The file is written to a temporary name and renamed over the old one, so
+  other processes never see a partial entry.
+
+  Args:
+    cachekey: The key() the zone was detected with.
+    value: The zone name (or other JSON-able value).
+    filename: The cache file, as for load().
+  """
+  cachedir = directory()
+  if cachedir is None:
+    return
+
+  try:
+    if not os.path.isdir(cachedir):
+      os.makedirs(cachedir)
+    fd, tmppath = tempfile.mkstemp(prefix=filename, dir=cachedir)
+    try:
+      f = os.fdopen(fd, "w")
+      try:
+        json.dump({"key": cachekey, "value": value}, f)
+      finally:
+        f.close()
+      os.rename(tmppath, os.path.join(cachedir, filename))
+    except Exception:  # pylint: disable=broad-except
+      os.unlink(tmppath)
+      raise
+  except (IOError, OSError):
+    pass
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: set ts=2 sw=2 et sts=2 ai:
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# pylint: disable=protected-access
+
+"""Compiled transition tables for pytz timezones.
+
+A pytz zone is a list of periods, each starting at a UTC transition time and
+having a fixed (utcoffset, dst, tzname). pytz's localize() finds the period
+for a wall clock time by trying candidate periods and normalizing the result,
+raising exceptions to signal ambiguous and non-existent times.
+
+A ZoneIndex keeps the start of every period both in UTC and in wall clock time
+in sorted lists, so the period for either can be found with a bisect and
+ambiguous or non-existent wall clock times are detected without exceptions.
+Each index also remembers the last period it found, as consecutive lookups
+are usually close together in time.
+"""
+
+import bisect
+import datetime
+
+import pytz
+
+_MIN = datetime.datetime.min
+_MAX = datetime.datetime.max
+
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=pytz.utc)
+_EPOCH_NAIVE = datetime.datetime(1970, 1, 1)
+
+# Older versions of pytz only have AmbiguousTimeError.
+_NonExistentTimeError = getattr(
+    pytz, "NonExistentTimeError", pytz.AmbiguousTimeError)
+
+
+# (tzinfo, utcoffset) keyed by id(tzinfo), for the tzinfo of every period of
+# every zone which has been indexed.
+_offsets = {}
+
+
+def state(dt):
+  """Returns the pickle state of a datetime, which holds all but the tzinfo.
+
+  datetime.datetime.__new__(cls, state(dt), tzinfo) is the cheapest way to
+  create a datetime (subclass) with the fields of dt.
+  """
+  return datetime.datetime.__reduce__(dt)[1][0]
+
+
+def wall_naive(dt):
+  """Returns the wall clock time of a datetime as a naive datetime."""
+  return datetime.datetime(datetime.datetime.__reduce__(dt)[1][0])
+
+
+def utc_naive(dt):
+  """Returns an aware datetime as a naive datetime in UTC."""
+  tzinfo = dt.tzinfo
+  entry = _offsets.get(id(tzinfo))
+  if entry is not None and entry[0] is tzinfo:
+    # The offset of an indexed period is known without asking the tzinfo.
+    return datetime.datetime(datetime.datetime.__reduce__(dt)[1][0]) - entry[1]
+  return _EPOCH_NAIVE + datetime.datetime.__sub__(dt, _EPOCH)
+
+
+class ZoneIndex(object):
+  """Sorted transition tables for a single pytz zone.
+
+  Periods are numbered from 0, the first period extends back to the start of
+  time and the last one forward to the end of time.
+
+  Attributes:
+    tzinfos: The localized tzinfo object of every period.
+    offsets: The utcoffset of every period.
+    dsts: True for every period which is in daylight savings time.
+    utc: The UTC start time of every period (naive, sorted).
+    wall: The wall clock start time of every period (naive, sorted).
+    wall_end: The wall clock end time of every period (naive).
+  """
+
+  __slots__ = ("tzinfos", "offsets", "dsts", "utc", "utc_end", "wall",
+               "wall_end", "_core", "_core_end", "_last")
+
+  def __init__(self, tzinfo):
+    if isinstance(tzinfo, pytz.tzinfo.DstTzInfo):
+      utc = list(tzinfo._utc_transition_times)
+      self.tzinfos = [tzinfo._tzinfos[info]
+                      for info in tzinfo._transition_info]
+      self.offsets = [info[0] for info in tzinfo._transition_info]
+      self.dsts = [bool(info[1]) for info in tzinfo._transition_info]
+    else:
+      utc = [_MIN]
+      self.tzinfos = [tzinfo]
+      self.offsets = [tzinfo.utcoffset(_EPOCH_NAIVE)]
+      self.dsts = [bool(tzinfo.dst(_EPOCH_NAIVE))]
+
+    utc[0] = _MIN
+    self.utc = utc
+    self.utc_end = utc[1:] + [_MAX]
+
+    self.wall = [_MIN] + [
+        start + offset for start, offset in zip(utc[1:], self.offsets[1:])]
+    self.wall_end = [
+        end + offset for end, offset in zip(utc[1:], self.offsets)] + [_MAX]
+
+    # The part of each period which isn't overlapped by its neighbours, a wall
+    # clock time in here can only belong to that period.
+    self._core = [max(start, previous_end) for start, previous_end in zip(
+        self.wall, [_MIN] + self.wall_end[:-1])]
+    self._core_end = [min(end, next_start) for end, next_start in zip(
+        self.wall_end, self.wall[1:] + [_MAX])]
+
+    self._last = len(utc) - 1
+
+    for period_tzinfo, offset in zip(self.tzinfos, self.offsets):
+      _offsets[id(period_tzinfo)] = (period_tzinfo, offset)
+
+  def __len__(self):
+    return len(self.utc)
+
+  def is_sorted(self):
+    """Returns True if the wall clock start times are in order."""
+    return all(a <= b for a, b in zip(self.wall, self.wall[1:]))
+
+  def period_utc(self, utc):
+    """Finds the period a UTC time falls in.
+
+    Args:
+      utc: A naive datetime in UTC.
+
+    Returns:
+      The period number.
+    """
+    last = self._last
+    if self.utc[last] <= utc < self.utc_end[last]:
+      return last
+    period = bisect.bisect_right(self.utc, utc) - 1
+    self._last = period
+    return period
+
+  def periods(self, wall):
+    """Finds the periods a wall clock time falls in.
+
+    Args:
+      wall: A naive datetime in wall clock time.
+
+    Returns:
+      A tuple of period numbers. It is empty if the time was skipped by a
+      transition and has two entries if it is ambiguous.
+    """
+    last = self._last
+    if self._core[last] <= wall < self._core_end[last]:
+      return (last,)
+
+    period = bisect.bisect_right(self.wall, wall) - 1
+    if period and wall < self.wall_end[period - 1]:
+      if wall < self.wall_end[period]:
+        return (period - 1, period)
+      return (period - 1,)
+    if wall < self.wall_end[period]:
+      self._last = period
+      return (period,)
+    return ()
+
+  def _choose(self, wall, periods, is_dst):
+    """Picks a period the same way pytz does for an ambiguous time."""
+    matching = [p for p in periods if self.dsts[p] == is_dst] or periods
+    if len(matching) == 1:
+      return matching[0]
+    # is_dst=True gets the earliest UTC time, is_dst=False the latest.
+    choose = min if is_dst else max
+    return choose(matching, key=lambda p: wall - self.offsets[p])
+
+  def resolve(self, wall, is_dst=None):
+    """Finds the period for a wall clock time, using datetime_tz's rules.
+
+    Args:
+      wall: A naive datetime in wall clock time.
+      is_dst: Used to pick a period if the time is ambiguous, None means
+              ambiguous times raise an exception.
+
+    Returns:
+      The period number.
+
+    Raises:
+      pytz.AmbiguousTimeError: If the time is ambiguous and is_dst is None.
+      pytz.NonExistentTimeError: If the time doesn't exist (whatever is_dst
+                                 is).
+    """
+    periods = self.periods(wall)
+    if len(periods) == 1:
+      return periods[0]
+    if not periods:
+      raise _NonExistentTimeError(wall)
+    if is_dst is None:
+      raise pytz.AmbiguousTimeError(wall)
+    return self._choose(wall, periods, is_dst)
+
+  def localize(self, wall, is_dst=False):
+    """Finds the period for a wall clock time, using pytz's rules.
+
+    This gives the same period as pytz's tzinfo.localize(wall, is_dst).
+
+    Args:
+      wall: A naive datetime in wall clock time.
+      is_dst: Used to pick a period if the time is ambiguous or doesn't exist,
+              None means those raise an exception.
+
+    Returns:
+      The period number.
+
+    Raises:
+      pytz.AmbiguousTimeError: If the time is ambiguous and is_dst is None.
+      pytz.NonExistentTimeError: If the time doesn't exist and is_dst is None.
+    """
+    periods = self.periods(wall)
+    if len(periods) == 1:
+      return periods[0]
+    if periods:
+      if is_dst is None:
+        raise pytz.AmbiguousTimeError(wall)
+      return self._choose(wall, periods, is_dst)
+    if is_dst is None:
+      raise _NonExistentTimeError(wall)
+    # Like pytz, use the period on the requested side of the gap.
+    if is_dst:
+      return self.localize(wall + datetime.timedelta(hours=6), True)
+    return self.localize(wall - datetime.timedelta(hours=6), False)
+
+
+# (tzinfo, ZoneIndex) keyed by id(tzinfo).
+_indexes = {}
+
+
+def get(tzinfo):
+  """Gets the ZoneIndex for a tzinfo object.
+
+  Localized tzinfo objects of a zone share the index of the zone.
+
+  Args:
+    tzinfo: A datetime.tzinfo object.
+
+  Returns:
+    A ZoneIndex, or None if the tzinfo object is not a pytz timezone.
+  """
+  entry = _indexes.get(id(tzinfo))
+  if entry is not None and entry[0] is tzinfo:
+    return entry[1]
+
+  if isinstance(tzinfo, pytz.tzinfo.DstTzInfo):
+    # Localized versions of a zone all share the same _tzinfos dictionary, see
+    # if one of them has been indexed already.
+    for other in tzinfo._tzinfos.values():
+      entry = _indexes.get(id(other))
+      if entry is not None and entry[0] is other:
+        index = entry[1]
+        break
+    else:
+      index = ZoneIndex(tzinfo)
+      if not index.is_sorted():
+        index = None
+  elif isinstance(tzinfo, (pytz.tzinfo.BaseTzInfo, pytz._FixedOffset)):
+    index = ZoneIndex(tzinfo)
+  else:
+    # Not a pytz timezone, don't hold on to it.
+    return None
+
+  _indexes[id(tzinfo)] = (tzinfo, index)
+  return index
@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim: set ts=2 sw=2 et sts=2 ai:
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Registry of the named timezones datetime_tz knows about.
+
+pytz.all_timezones is a (lazy) list, so checking a name against it is a linear
+scan. This module keeps the names in a set for O(1) validation, caches the
+tzinfo object for every name which has been resolved and knows which names are
+only links to another zone (for example US/Eastern is a link to
+America/New_York).
+
+Extra zones which are not part of the pytz database (such as the zone loaded
+from /etc/localtime) can be added with register().
+"""
+
+import threading
+
+import pytz
+
+try:
+  basestring
+except NameError:
+  # pylint: disable=redefined-builtin
+  basestring = str
+
+
+# frozenset of all the zone names in the pytz database, created on first use.
+_names = None
+
+# Resolved tzinfo objects, keyed by the name they were requested with.
+_tzinfos = {}
+
+# Names given to register(), which is_valid() accepts as well as names().
+_registered = set()
+
+# Maps a link name to the name of the zone it links to, created on first use.
+_links = None
+
+_lock = threading.Lock()
+
+# Interned fixed offset tzinfo objects, keyed by the offset in seconds.
+_fixed_offsets = {0: pytz.utc}
+
+
+def names():
+  """Returns a frozenset of all the valid zone names."""
+  # pylint: disable=global-statement
+  global _names
+  if _names is None:
+    _names = frozenset(pytz.all_timezones)
+  return _names
+
+
+def is_valid(name):
+  """Returns True if name is a zone name which get() will accept.
+
+  Only the names in the pytz database (see names()) and names given to
+  register() are valid, whatever spellings (such as "us/eastern") get() has
+  been asked for before.
+  """
+  try:
+    return name in names() or name in _registered
+  except TypeError:
+    return False
+
+
+def get(name):
+  """Gets the tzinfo object for a zone name.
+
+  Args:
+    name: A zone name (as accepted by pytz.timezone) or a name given to
+          register().
+
+  Returns:
+    A datetime.tzinfo object.
+
+  Raises:
+    pytz.UnknownTimeZoneError: If the name is not a known zone.
+  """
+  try:
+    return _tzinfos[name]
+  except (KeyError, TypeError):
+    pass
+
+  if not isinstance(name, basestring):
+    raise pytz.UnknownTimeZoneError(name)
+
+  tzinfo = pytz.timezone(name)
+  if tzinfo.zone not in names():
+    raise pytz.UnknownTimeZoneError(name)
+
+  # Setting a dict item is atomic, so racing threads at worst both resolve
+  # the same zone.
+  _tzinfos[name] = tzinfo
+  return tzinfo
+
+
+def register(name, tzinfo):
+  """Registers a tzinfo object which is not in the pytz database.
+
+  Args:
+    name: The name to register the tzinfo under.
+    tzinfo: A datetime.tzinfo object.
+  """
+  _registered.add(name)
+  _tzinfos[name] = tzinfo
+
+
+def fixed_offset(seconds):
+  """Gets the tzinfo object for a fixed offset from UTC.
+
+  Args:
+    seconds: The offset in seconds, east of UTC is positive.
+
+  Returns:
+    pytz.utc for an offset of 0, otherwise a pytz.FixedOffset. The same object
+    is returned every time for the same offset.
+  """
+  try:
+    return _fixed_offsets[seconds]
+  except KeyError:
+    pass
+  minutes, remainder = divmod(seconds, 60)
+  if remainder:
+    # Only Python 3.7 and later allow offsets which aren't whole minutes.
+    # pylint: disable=protected-access
+    tzinfo = pytz._FixedOffset(seconds / 60.0)
+  else:
+    tzinfo = pytz.FixedOffset(minutes)
+  return _fixed_offsets.setdefault(seconds, tzinfo)
+
+
+def _load_links():
+  """Reads the link lines from the tzdata.zi file shipped with pytz.
+
+  Returns:
+    A dictionary mapping link names to the names they link to. Empty if this
+    version of pytz does not come with a tzdata.zi file.
+  """
+  links = {}
+  try:
+    f = pytz.open_resource("tzdata.zi")
+  except (IOError, ValueError):
+    return links
+
+  try:
+    for line in f.read().decode("utf-8").splitlines():
+      # Link lines look like "L America/New_York US/Eastern"
+      if line.startswith("L "):
+        _, target, link = line.split()
+        links[link] = target
+  finally:
+    f.close()
+  return links
+
+
+def canonical_name(name):
+  """Returns the name of the zone a link name points to.
+
+  For example canonical_name("US/Eastern") == "America/New_York". Names which
+  are not links are returned as is.
+
+  Args:
+    name: A zone name.
+
+  Returns:
+    The canonical zone name.
+
+  Raises:
+    pytz.UnknownTimeZoneError: If the name is not a known zone.
+  """
+  # pylint: disable=global-statement
+  global _links
+  if _links is None:
+    with _lock:
+      if _links is None:
+        _links = _load_links()
+
+  zone = get(name).zone
+  # Links to links are allowed by the tz database, follow them all the way.
+  seen = set()
+  while zone in _links and zone not in seen:
+    seen.add(zone)
+    zone = _links[zone]
+  return zone
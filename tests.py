@@ -39,18 +39,28 @@
 
 __author__ = "tansell@google.com (Tim Ansell)"
 
+import array
 import copy
 import ctypes
 import datetime
+import hashlib
 import itertools
+import operator
 import os
+import pickle
 import random
+import shutil
+import subprocess
 import sys
+import tempfile
+import threading
+import time
 import unittest
 import warnings
 
 import dateutil
 import dateutil.parser
+import dateutil.tz
 import pytz
 
 import datetime_tz
@@ -303,6 +313,7 @@ class TestLocalTimezoneDetection(TestTimeZoneBase):
         return True
       return os_path_exists(filename)
     self.mocked("os.path.exists", os_path_exists_fake)
+    self.mocked("os.path.islink", lambda filename: False)
 
     os_walk = os.walk
     def os_walk_fake(dirname, *args, **kw):
@@ -336,9 +347,13 @@ class TestLocalTimezoneDetection(TestTimeZoneBase):
       return real_open(filename, *args, **kw)
     self.mocked("builtins.open", localtime_valid_fake)
 
+    index = datetime_tz._load_local_zoneinfo_index()
     self.assertEqual(
         ["Australia/Melbourne", "Australia/Sydney", "Etc/UTC"],
-        list(sorted(datetime_tz._load_local_tzinfo().keys())))
+        list(sorted(itertools.chain.from_iterable(index.values()))))
+    self.assertEqual(
+        [["Australia/Melbourne", "Australia/Sydney"], ["Etc/UTC"]],
+        list(sorted(sorted(names) for names in index.values())))
 
     # Test the case where single match in the local database which also exists
     # in the pytz database.
@@ -357,14 +372,15 @@ class TestLocalTimezoneDetection(TestTimeZoneBase):
     # Test the case where multiple matches in the local database, but only one
     # is in pytz database.
     localtime_file = "test_zonedata_sydney"
-    self.mocked("pytz.all_timezones", ["Australia/Sydney"])
+    self.mocked("datetime_tz.zones.names",
+                lambda: frozenset(["Australia/Sydney"]))
 
     r = datetime_tz._detect_timezone_etc_localtime()
     self.assertTimezoneEqual(r, pytz.timezone("Australia/Sydney"))
 
     # Test the no matches case
     localtime_file = "test_zonedata_sydney"
-    self.mocked("pytz.all_timezones", [])
+    self.mocked("datetime_tz.zones.names", frozenset)
 
     r = datetime_tz._detect_timezone_etc_localtime()
     self.assertTimezoneEqual(r, pytz.timezone("/etc/localtime"))
@@ -375,8 +391,10 @@ class TestLocalTimezoneDetection(TestTimeZoneBase):
     # Test the case where /etc/localtime doesn't match anything in the local
     # database and nothing in pytz.
     localtime_file = "test_zonedata_utc"
-    self.mocked("datetime_tz._load_local_tzinfo",
-                lambda: {"Australia/Sydney": test_tzinfo_sydney})
+    sydney_digest = hashlib.sha1(
+        open(test_zonedata_sydney, "rb").read()).digest()
+    self.mocked("datetime_tz._load_local_zoneinfo_index",
+                lambda: {sydney_digest: ["Australia/Sydney"]})
     self.mocked("pytz.all_timezones", ["Australia/Sydney"])
 
     r = datetime_tz._detect_timezone_etc_localtime()
@@ -388,7 +406,7 @@ class TestLocalTimezoneDetection(TestTimeZoneBase):
     # Test the case where there is no local database, so we fall back to
     # matching pytz database
     localtime_file = "test_zonedata_sydney"
-    self.mocked("datetime_tz._load_local_tzinfo", lambda: {})
+    self.mocked("datetime_tz._load_local_zoneinfo_index", lambda: {})
     self.mocked("pytz.all_timezones", ["Australia/Sydney"])
     self.mocked("datetime_tz._tzinfome", lambda x: test_tzinfo_sydney)
 
@@ -396,9 +414,225 @@ class TestLocalTimezoneDetection(TestTimeZoneBase):
     self.assertNotEqual(r.zone, "/etc/localtime")
     self.assertTimezoneEqual(r, test_tzinfo_sydney)
 
+  def testEtcLocaltimeMethodSymlink(self):
+    if sys.platform == "win32":
+      raise self.skipTest("/etc timezone method will never work on Windows")
+
+    def os_path_exists_fake(filename, os_path_exists=os.path.exists):
+      if filename == "/etc/localtime":
+        return True
+      return os_path_exists(filename)
+    self.mocked("os.path.exists", os_path_exists_fake)
+    self.mocked("os.path.islink", lambda filename: filename == "/etc/localtime")
+
+    def load_fake():
+      raise AssertionError("The zoneinfo database should not be loaded.")
+    self.mocked("datetime_tz._load_local_zoneinfo_index", load_fake)
+
+    for target, zone in (
+        ("/usr/share/zoneinfo/Australia/Sydney", "Australia/Sydney"),
+        ("../usr/share/zoneinfo/posix/US/Pacific", "US/Pacific"),
+        ("/var/db/timezone/zoneinfo/Europe/London", "Europe/London")):
+      self.mocked("os.readlink", lambda path, target=target: target)
+      r = datetime_tz._detect_timezone_etc_localtime()
+      self.assertEqual(r.zone, zone)
+
+    # Links outside a zoneinfo tree, or to zones pytz doesn't know, fall back
+    # to looking at the contents.
+    real_open = builtins.open
+    def localtime_fake(filename, *args, **kw):
+      if filename == "/etc/localtime":
+        filename = os.path.join(os.path.dirname(__file__), "test_zonedata_utc")
+      return real_open(filename, *args, **kw)
+    self.mocked("builtins.open", localtime_fake)
+    utc_digest = hashlib.sha1(open(os.path.join(
+        os.path.dirname(__file__), "test_zonedata_utc"), "rb").read()).digest()
+    self.mocked("datetime_tz._load_local_zoneinfo_index",
+                lambda: {utc_digest: ["Etc/UTC"]})
+
+    for target in ("/etc/mytimezone", "/usr/share/zoneinfo/right/Etc/UTC"):
+      self.mocked("os.readlink", lambda path, target=target: target)
+      r = datetime_tz._detect_timezone_etc_localtime()
+      self.assertTimezoneEqual(r, pytz.timezone("Etc/UTC"))
+
+  def testCache(self):
+    cachedir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, cachedir)
+    old_cachedir = os.environ.get("DATETIME_TZ_CACHE_DIR")
+    def restore_cachedir():
+      if old_cachedir is None:
+        del os.environ["DATETIME_TZ_CACHE_DIR"]
+      else:
+        os.environ["DATETIME_TZ_CACHE_DIR"] = old_cachedir
+    self.addCleanup(restore_cachedir)
+    os.environ["DATETIME_TZ_CACHE_DIR"] = os.path.join(cachedir, "sub")
+
+    key = datetime_tz.tzcache.key()
+    self.assertEqual(key, datetime_tz.tzcache.key())
+    self.assertEqual(None, datetime_tz.tzcache.load(key))
+    datetime_tz.tzcache.store(key, "Australia/Sydney")
+    self.assertEqual("Australia/Sydney", datetime_tz.tzcache.load(key))
+    self.assertEqual(None, datetime_tz.tzcache.load(key + ["changed"]))
+    self.assertEqual(["localtz.json"],
+                     os.listdir(os.path.join(cachedir, "sub")))
+
+    # Only the first process has to detect the timezone.
+    self.mocked("datetime_tz.tzcache.key", lambda: ["test"])
+    self.mocked("datetime_tz._detect_timezone_environ", lambda: None)
+    self.mocked("datetime_tz._detect_timezone_etc_timezone", lambda: None)
+    detected = []
+    def detect_fake():
+      detected.append(True)
+      return pytz.timezone("US/Pacific")
+    self.mocked("datetime_tz._detect_timezone_etc_localtime", detect_fake)
+
+    for _ in range(2):
+      self.assertEqual("US/Pacific", datetime_tz.detect_timezone().zone)
+      self.assertEqual(1, len(detected))
+
+    # A change to the inputs means detecting again.
+    self.mocked("datetime_tz.tzcache.key", lambda: ["changed"])
+    self.assertEqual("US/Pacific", datetime_tz.detect_timezone().zone)
+    self.assertEqual(2, len(detected))
+
+    # Zones which aren't in the pytz database are never cached.
+    self.mocked("datetime_tz.tzcache.key", lambda: ["localtime"])
+    f = open(os.path.join(os.path.dirname(__file__), "test_zonedata_utc"), "rb")
+    localtime = pytz.tzfile.build_tzinfo("/etc/localtime", f)
+    f.close()
+    self.mocked("datetime_tz._detect_timezone_etc_localtime",
+                lambda: localtime)
+    self.assertEqual("/etc/localtime", datetime_tz.detect_timezone().zone)
+    self.assertEqual(None, datetime_tz.tzcache.load(["localtime"]))
+
+    # An empty directory turns the cache off.
+    os.environ["DATETIME_TZ_CACHE_DIR"] = ""
+    self.assertEqual(None, datetime_tz.tzcache.directory())
+    self.assertEqual(None, datetime_tz.tzcache.load(["changed"]))
+
+  def testCacheOffByDefault(self):
+    home = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, home)
+    saved = dict((name, os.environ.get(name)) for name in (
+        "DATETIME_TZ_CACHE_DIR", "HOME", "XDG_CACHE_HOME"))
+    def restore():
+      for name, value in saved.items():
+        if value is None:
+          os.environ.pop(name, None)
+        else:
+          os.environ[name] = value
+    self.addCleanup(restore)
+    os.environ.pop("DATETIME_TZ_CACHE_DIR", None)
+    os.environ["HOME"] = home
+    os.environ["XDG_CACHE_HOME"] = os.path.join(home, ".cache")
+
+    self.assertEqual(None, datetime_tz.tzcache.directory())
+    self.mocked("datetime_tz._detect_timezone_environ", lambda: None)
+    self.mocked("datetime_tz._detect_timezone_etc_timezone", lambda: None)
+    self.mocked("datetime_tz._detect_timezone_etc_localtime",
+                lambda: pytz.timezone("US/Pacific"))
+    self.assertEqual("US/Pacific", datetime_tz.detect_timezone().zone)
+    self.mocked("datetime_tz.signatures._indexes", {})
+    self.mocked("datetime_tz.signatures.build", lambda year: {})
+    datetime_tz.signatures.get(2020)
+    datetime_tz.tzcache.store(["test"], "US/Pacific")
+
+    self.assertEqual([], os.listdir(home))
+
+  def testLocaltzSingleFlight(self):
+    self.mocked("datetime_tz._localtz", None)
+    threads_count = 8
+
+    # Detection doesn't finish until every thread has called localtz(), so
+    # they all find the timezone missing.
+    arrived = [0]
+    barrier = threading.Condition()
+    detected = []
+    def detect_fake():
+      detected.append(True)
+      with barrier:
+        while arrived[0] < threads_count:
+          barrier.wait(10)
+      return pytz.timezone("US/Pacific")
+    self.mocked("datetime_tz.detect_timezone", detect_fake)
+
+    results = []
+    def caller():
+      with barrier:
+        arrived[0] += 1
+        barrier.notify_all()
+      results.append(datetime_tz.localtz())
+
+    threads = [threading.Thread(target=caller) for _ in range(threads_count)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join(10)
+
+    self.assertEqual(1, len(detected))
+    self.assertEqual(["US/Pacific"] * threads_count,
+                     [tz.zone for tz in results])
+
+    # localtz_set waits for a detection in progress, rather than being
+    # overwritten by it.
+    datetime_tz._localtz = None
+    del detected[:]
+    started = threading.Event()
+    finish = threading.Event()
+    def detect_slow():
+      detected.append(True)
+      started.set()
+      finish.wait(10)
+      return pytz.timezone("US/Pacific")
+    self.mocked("datetime_tz.detect_timezone", detect_slow)
+
+    detector = threading.Thread(target=datetime_tz.localtz)
+    detector.start()
+    self.assertTrue(started.wait(10))
+    setter = threading.Thread(
+        target=lambda: datetime_tz.localtz_set("Australia/Sydney"))
+    setter.start()
+    setter.join(0.2)
+    self.assertTrue(setter.is_alive())
+    finish.set()
+    detector.join(10)
+    setter.join(10)
+    self.assertEqual(1, len(detected))
+    self.assertEqual("Australia/Sydney", datetime_tz.localtz().zone)
+
   def testPHPMethod(self):
-    # FIXME: Actually test this method sometime in the future.
-    pass
+    cachedir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, cachedir)
+    self.mocked("datetime_tz.tzcache.directory", lambda: cachedir)
+    self.mocked("datetime_tz.signatures._indexes", {})
+
+    year = datetime.date.today().year
+    for tzname in ("Australia/Sydney", "US/Pacific", "Asia/Tokyo"):
+      tz = pytz.timezone(tzname)
+      january = tz.localize(datetime.datetime(year, 1, 1))
+      july = tz.localize(datetime.datetime(year, 7, 1))
+      standard = july if january.dst() else january
+      self.mocked("time.tzname", (standard.tzname(), "XXX"))
+      self.mocked("time.timezone",
+                  -int(standard.utcoffset().total_seconds()))
+      self.mocked("time.daylight", int(january.dst() != july.dst()))
+
+      r = datetime_tz._detect_timezone_php()
+      self.assertEqual(
+          datetime_tz.signatures.signature(r, year),
+          datetime_tz.signatures.signature(tz, year))
+      self.assertTrue(
+          tzname in datetime_tz.signatures.lookup(
+              (time.tzname[0], time.timezone, bool(time.daylight)), year))
+
+    # Later processes read the index from the cache.
+    self.mocked("datetime_tz.signatures._indexes", {})
+    self.mocked("datetime_tz.signatures.build", None)
+    self.assertTrue("Asia/Tokyo" in datetime_tz.signatures.lookup(
+        ("JST", -32400, False), year))
+
+    self.mocked("time.tzname", ("XXX", "XXX"))
+    self.assertEqual(None, datetime_tz._detect_timezone_php())
 
   def testWindowsTimezones(self):
     if sys.platform == "win32":
@@ -601,6 +835,93 @@ class TestDatetimeTZ(TestTimeZoneBase):
     self.assertTimezoneEqual(d7.tzinfo, pytz.timezone("US/Pacific"))
     self.assertEqual(d7.tzinfo._dst, datetime.timedelta(0, 3600))
 
+  def testAdopt(self):
+    # Adopting a pytz localized datetime keeps the tzinfo instance
+    tz = pytz.timezone("US/Eastern")
+    for naive, is_dst in ((datetime.datetime(2002, 10, 27, 1, 30), True),
+                          (datetime.datetime(2002, 10, 27, 1, 30), False),
+                          (datetime.datetime(2008, 7, 13, 12, 5, 1, 15), None),
+                          (datetime.datetime(2008, 12, 5), None)):
+      dt = tz.localize(naive, is_dst=is_dst)
+      d = datetime_tz.datetime_tz.adopt(dt)
+      self.assertTrue(isinstance(d, datetime_tz.datetime_tz))
+      self.assertTrue(d.tzinfo is dt.tzinfo)
+      self.assertEqual(d.strftime(FMT), dt.strftime(FMT))
+      self.assertEqual(d.microsecond, dt.microsecond)
+      self.assertEqual(d, datetime_tz.datetime_tz(dt))
+      self.assertEqual(d.is_dst, datetime_tz.datetime_tz(dt).is_dst)
+
+    # Static zones are fine too
+    d = datetime_tz.datetime_tz.adopt(
+        datetime.datetime(2008, 7, 13, tzinfo=pytz.utc))
+    self.assertTrue(d.tzinfo is pytz.utc)
+    self.assertFalse(d.is_dst)
+    d = datetime_tz.datetime_tz.adopt(
+        datetime.datetime(2008, 7, 13, tzinfo=pytz.FixedOffset(330)))
+    self.assertEqual(str(d), "2008-07-13 00:00:00+05:30")
+
+    # A datetime_tz is returned as is
+    self.assertTrue(datetime_tz.datetime_tz.adopt(d) is d)
+
+    # Subclasses get their own type
+    d = datetime_tz_test_subclass.adopt(d)
+    self.assertTrue(isinstance(d, datetime_tz_test_subclass))
+
+    self.assertRaises(TypeError, datetime_tz.datetime_tz.adopt,
+                      datetime.datetime(2008, 7, 13))
+
+  def testFromFieldsMany(self):
+    # Rows crossing the end of daylight savings, including the ambiguous hour
+    years = array.array("H", [2002] * 4)
+    months = array.array("B", [10] * 4)
+    days = array.array("B", [26, 27, 27, 27])
+    hours = [12, 0, 1, 2]
+    minutes = [0, 30, 30, 30]
+
+    for is_dst in (True, False):
+      ds = datetime_tz.datetime_tz.from_fields_many(
+          years, months, days, hours, minutes, tzinfo="US/Eastern",
+          is_dst=is_dst)
+      self.assertEqual(len(ds), 4)
+      for d, day, hour, minute in zip(ds, days, hours, minutes):
+        expected = datetime_tz.datetime_tz(
+            2002, 10, day, hour, minute, tzinfo="US/Eastern", is_dst=is_dst)
+        self.assertTrue(isinstance(d, datetime_tz.datetime_tz))
+        self.assertEqual(d, expected)
+        self.assertEqual(d.is_dst, expected.is_dst)
+        self.assertTrue(d.tzinfo is expected.tzinfo)
+    self.assertEqual(str(ds[2]), "2002-10-27 01:30:00-05:00")
+
+    # Missing time columns are 0
+    ds = datetime_tz.datetime_tz.from_fields_many(
+        [2008], [7], [13], seconds=[5], tzinfo=pytz.utc)
+    self.assertEqual(str(ds[0]), "2008-07-13 00:00:05+00:00")
+
+    # Subclasses get their own type
+    ds = datetime_tz_test_subclass.from_fields_many(
+        [2008], [7], [13], tzinfo="Australia/Sydney")
+    self.assertTrue(isinstance(ds[0], datetime_tz_test_subclass))
+
+    self.assertRaises(pytz.AmbiguousTimeError,
+                      datetime_tz.datetime_tz.from_fields_many,
+                      years, months, days, hours, minutes,
+                      tzinfo="US/Eastern")
+    self.assertRaises(pytz.NonExistentTimeError,
+                      datetime_tz.datetime_tz.from_fields_many,
+                      [2002], [4], [7], [2], [30], tzinfo="US/Eastern",
+                      is_dst=True)
+
+    # Uneven columns are an error, rather than losing rows
+    self.assertRaises(ValueError, datetime_tz.datetime_tz.from_fields_many,
+                      [2008, 2009], [7, 8], [13], tzinfo=pytz.utc)
+    self.assertRaises(ValueError, datetime_tz.datetime_tz.from_fields_many,
+                      [2008], [7], [13], seconds=iter([5, 6]), tzinfo=pytz.utc)
+    ds = datetime_tz.datetime_tz.from_fields_many(
+        iter([2008, 2009]), array.array("i", [7, 8]), (13, 14),
+        tzinfo=pytz.utc)
+    self.assertEqual([str(d) for d in ds],
+                     ["2008-07-13 00:00:00+00:00", "2009-08-14 00:00:00+00:00"])
+
   def testBadDates(self):
     # For example, 1:30am on 27th Oct 2002 happened twice in the US/Eastern
     # timezone when the clocks where put back at the end of Daylight Savings
@@ -733,6 +1054,192 @@ class TestDatetimeTZ(TestTimeZoneBase):
     before = loc_dt - datetime_tz.timedelta(minutes=10)
     self.assertEqual(before.strftime(FMT), "2002-04-07 01:40:00 EST-0500")
 
+  def testAstimezone(self):
+    # Every 20 minutes for two days around each transition in 2002
+    starts = (datetime.datetime(2002, 4, 6), datetime.datetime(2002, 10, 26))
+    targets = ("US/Eastern", "Australia/Sydney", "Asia/Kolkata", "UTC")
+    for start in starts:
+      for minutes in range(0, 2*24*60, 20):
+        utc_dt = datetime_tz.datetime_tz(
+            start + datetime.timedelta(minutes=minutes), pytz.utc)
+        for target in targets:
+          tz = pytz.timezone(target)
+          expected = pytz.utc.localize(
+              utc_dt.asdatetime()).astimezone(tz)
+
+          d = utc_dt.astimezone(target)
+          self.assertTrue(isinstance(d, datetime_tz.datetime_tz))
+          self.assertTrue(d.tzinfo is expected.tzinfo)
+          self.assertEqual(d.asdatetime(), expected.replace(tzinfo=None))
+          self.assertEqual(d.is_dst, bool(expected.dst()))
+
+          # And back again, through a zone which isn't UTC
+          back = d.astimezone("Europe/London").astimezone(pytz.utc)
+          self.assertTrue(back.tzinfo is pytz.utc)
+          self.assertEqual(back.asdatetime(), utc_dt.asdatetime())
+
+    # Non-pytz timezones still work
+    d = datetime_tz.datetime_tz(2002, 10, 27, 6, 10, tzinfo=pytz.utc)
+    self.assertEqual(d.astimezone(pytz.FixedOffset(-300)).hour, 1)
+
+  def testArithmetic(self):
+    random.seed(3)
+    for zone in ("US/Eastern", "Australia/Sydney", "Australia/Lord_Howe"):
+      tz = pytz.timezone(zone)
+      d = datetime_tz.datetime_tz(2002, 1, 1, tzinfo=tz)
+      for _ in range(300):
+        delta = datetime.timedelta(minutes=random.randrange(-60*24*30,
+                                                            60*24*30))
+        expected = tz.normalize(d.asdatetime(naive=False) + delta)
+        for actual in (d + delta, delta + d, d - -delta):
+          self.assertTrue(isinstance(actual, datetime_tz.datetime_tz))
+          self.assertTrue(actual.tzinfo is expected.tzinfo)
+          self.assertEqual(actual.asdatetime(), expected.replace(tzinfo=None))
+          self.assertEqual(actual.is_dst, bool(expected.dst()))
+        d = datetime_tz.datetime_tz(expected)
+
+    # Differences are plain timedeltas
+    a = datetime_tz.datetime_tz(2002, 10, 27, 1, 30, tzinfo="US/Eastern",
+                                is_dst=True)
+    b = datetime_tz.datetime_tz(2002, 10, 27, 1, 30, tzinfo="US/Eastern",
+                                is_dst=False)
+    self.assertEqual(b - a, datetime.timedelta(hours=1))
+    self.assertEqual(type(b - a), datetime.timedelta)
+    utc_b = datetime.datetime(2002, 10, 27, 6, 30, tzinfo=pytz.utc)
+    self.assertEqual(utc_b - a, datetime.timedelta(hours=1))
+    self.assertEqual(a - utc_b, datetime.timedelta(hours=-1))
+    self.assertRaises(TypeError, lambda: a - datetime.datetime(2002, 1, 1))
+    self.assertRaises(TypeError, lambda: a + a)
+    self.assertRaises(TypeError, lambda: a - 1)
+
+    # Other things which know how to add themselves to a datetime still work
+    self.assertEqual(
+        a + dateutil.relativedelta.relativedelta(months=1),
+        datetime_tz.datetime_tz(2002, 11, 27, 1, 30, tzinfo="US/Eastern"))
+
+  def testSortKey(self):
+    d = datetime_tz.datetime_tz(1970, 1, 1, 10, tzinfo="Australia/Sydney")
+    self.assertEqual(d.sort_key(), 0)
+    d = datetime_tz.datetime_tz(2002, 10, 27, 1, 30, 0, 5, tzinfo="US/Eastern",
+                                is_dst=False)
+    self.assertEqual(d.sort_key(), d.totimestamp() * 1000000)
+    self.assertEqual(d.sort_key(), 1035700200000005)
+    d = datetime_tz.datetime_tz(1900, 1, 1, tzinfo=pytz.utc)
+    self.assertEqual(d.sort_key(), -2208988800000000)
+
+    # Comparisons agree with comparing plain datetimes, across zones
+    random.seed(8)
+    start = datetime_tz.datetime_tz(2002, 1, 1, tzinfo=pytz.utc)
+    events = []
+    for _ in range(200):
+      event = start + datetime.timedelta(minutes=random.randrange(60*24*365))
+      events.append(event.astimezone(random.choice(
+          ("US/Eastern", "Australia/Sydney", "UTC", pytz.FixedOffset(330)))))
+    events.append(events[0].astimezone("Europe/London"))
+    for a, b in zip(events, events[1:] + events[:1]):
+      plain_a = a.asdatetime(naive=False)
+      plain_b = b.asdatetime(naive=False)
+      for op in (operator.eq, operator.ne, operator.lt, operator.le,
+                 operator.gt, operator.ge):
+        self.assertEqual(op(a, b), op(plain_a, plain_b))
+        self.assertEqual(op(a, plain_b), op(plain_a, plain_b))
+        self.assertEqual(op(plain_a, b), op(plain_a, plain_b))
+      self.assertEqual(hash(a), hash(plain_a))
+      if a == b:
+        self.assertEqual(hash(a), hash(b))
+
+    self.assertEqual(datetime_tz.sorted_events(events),
+                     sorted(e.asdatetime(naive=False) for e in events))
+    self.assertEqual(datetime_tz.sorted_events(events, reverse=True),
+                     sorted(events, reverse=True))
+    records = [{"when": e} for e in events]
+    self.assertEqual(
+        [r["when"] for r in datetime_tz.sorted_events(
+            records, key=lambda r: r["when"])],
+        datetime_tz.sorted_events(events))
+
+    # Naive datetimes are never equal and can't be ordered
+    naive = datetime.datetime(2002, 1, 1)
+    self.assertFalse(start == naive)
+    self.assertTrue(start != naive)
+    self.assertRaises(TypeError, lambda: start < naive)
+    self.assertFalse(start == "2002-01-01")
+
+  def testPickle(self):
+    for tzinfo in ("US/Eastern", "Australia/Lord_Howe", "UTC", pytz.utc,
+                   pytz.FixedOffset(330)):
+      for is_dst in (True, False):
+        # An ambiguous time in US/Eastern and Lord Howe
+        d = datetime_tz.datetime_tz(2002, 10, 27, 1, 30, 0, 5, tzinfo=tzinfo,
+                                    is_dst=is_dst)
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+          loaded = pickle.loads(pickle.dumps(d, protocol))
+          self.assertTrue(isinstance(loaded, datetime_tz.datetime_tz))
+          self.assertEqual(loaded, d)
+          self.assertEqual(loaded.asdatetime(), d.asdatetime())
+          self.assertEqual(loaded.is_dst, d.is_dst)
+          self.assertTrue(loaded.tzinfo is d.tzinfo)
+
+    # Much smaller than a datetime with a pytz tzinfo
+    d = datetime_tz.datetime_tz(2002, 10, 27, 1, 30, tzinfo="US/Eastern",
+                                is_dst=True)
+    self.assertTrue(len(pickle.dumps(d, 2)) <
+                    len(pickle.dumps(d.asdatetime(naive=False), 2)) / 2)
+
+    d = datetime_tz_test_subclass(2015, 7, 11, 12, 34, 54, "Australia/Sydney")
+    loaded = pickle.loads(pickle.dumps(d, 2))
+    self.assertTrue(isinstance(loaded, datetime_tz_test_subclass))
+    self.assertEqual(loaded, d)
+
+    # Only the tzinfo objects of named zones are remembered
+    pickle_zones = len(datetime_tz._pickle_zones)
+    for minutes in range(-600, 600, 7):
+      pickle.dumps(datetime_tz.datetime_tz(
+          2002, 10, 27, tzinfo=pytz.FixedOffset(minutes)), 2)
+    self.assertEqual(len(datetime_tz._pickle_zones), pickle_zones)
+
+  def testPickleRegisteredZone(self):
+    # A zone registered under a name pytz doesn't know (as /etc/localtime is)
+    # loads in a new process.
+    testdir = os.path.dirname(os.path.abspath(__file__))
+    f = open(os.path.join(testdir, "test_zonedata_sydney"), "rb")
+    tzinfo = pytz.tzfile.build_tzinfo("Test/Pickled", f)
+    f.close()
+    datetime_tz.zones.register("Test/Pickled", tzinfo)
+    try:
+      d = datetime_tz.datetime_tz(2010, 3, 10, 17, 23, 26, tzinfo=tzinfo)
+      data = pickle.dumps(d, 2)
+    finally:
+      del datetime_tz.zones._tzinfos["Test/Pickled"]
+      datetime_tz.zones._registered.discard("Test/Pickled")
+
+    loaded = pickle.loads(data)
+    self.assertEqual(loaded, d)
+    self.assertEqual(str(loaded), "2010-03-10 17:23:26+11:00")
+    self.assertTrue(loaded.tzinfo is pickle.loads(data).tzinfo)
+
+    process = subprocess.Popen(
+        [sys.executable, "-c",
+         "import pickle, sys; "
+         "d = pickle.load(getattr(sys.stdin, 'buffer', sys.stdin)); "
+         "print(d); print(d.replace(month=7))"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd=testdir)
+    stdout, _ = process.communicate(data)
+    self.assertEqual(process.returncode, 0)
+    self.assertEqual(stdout.decode("ascii").split(),
+                     ["2010-03-10", "17:23:26+11:00",
+                      "2010-07-10", "17:23:26+10:00"])
+
+  def testCopy(self):
+    for is_dst in (True, False):
+      d = datetime_tz.datetime_tz(2002, 10, 27, 1, 30, tzinfo="US/Eastern",
+                                  is_dst=is_dst)
+      for d_copy in (copy.copy(d), copy.deepcopy(d),
+                     copy.deepcopy({"a": [d, (d,)]})["a"][1][0]):
+        self.assertTrue(d_copy is d)
+        self.assertEqual(d_copy.is_dst, is_dst)
+        self.assertTrue(d_copy.tzinfo is d.tzinfo)
+
   def testOperations(self):
     dadd = datetime_tz.datetime_tz.now() + datetime.timedelta(days=1)
 
@@ -925,6 +1432,26 @@ class TestDatetimeTZ(TestTimeZoneBase):
     self.assertRaises(pytz.NonExistentTimeError, loc_dt.replace,
                       hour=2, minute=30, second=0, microsecond=0)
 
+    # Replace keeps the tzinfo when the period doesn't change
+    replace = loc_dt.replace(hour=12)
+    self.assertTrue(replace.tzinfo is loc_dt.tzinfo)
+    replace = loc_dt.replace(tzinfo="US/Eastern")
+    self.assertTrue(replace.tzinfo is loc_dt.tzinfo)
+
+    # Replacing the timezone
+    replace = loc_dt.replace(tzinfo="Australia/Sydney")
+    self.assertEqual(str(replace), "2002-04-07 03:10:00+10:00")
+
+    # Zones which aren't in the pytz database can be used with replace
+    f = open(os.path.join(os.path.dirname(__file__), "test_zonedata_sydney"),
+             "rb")
+    test_tzinfo = pytz.tzfile.build_tzinfo("Test/Sydney", f)
+    f.close()
+    dt = datetime_tz.datetime_tz(2010, 3, 10, 17, 23, 26, tzinfo=test_tzinfo)
+    replaced = dt.replace(month=7)
+    self.assertEqual(str(replaced), "2010-07-10 17:23:26+10:00")
+    self.assertFalse(replaced.is_dst)
+
   def testSmartParse(self):
     datetime_tz.localtz_set("Australia/Sydney")
 
@@ -1264,6 +1791,448 @@ class TestDatetimeTZ(TestTimeZoneBase):
     self.assertEqual(
         d, toparse.replace(hour=0, minute=0, second=0, microsecond=0))
 
+  def testSmartParseRelative(self):
+    tz = pytz.timezone("US/Pacific")
+    # A Wednesday, just after daylight savings ended
+    now = datetime_tz.datetime_tz(2008, 11, 5, 15, 4, 5, tzinfo=tz)
+
+    @staticmethod
+    def now_fake(tzinfo):
+      self.assertTrue(tzinfo is tz)
+      return now
+    self.mocked("datetime_tz.datetime_tz.now", now_fake)
+
+    def parse(toparse):
+      return str(datetime_tz.datetime_tz.smartparse(toparse, tz))
+
+    self.assertEqual(datetime_tz.datetime_tz.smartparse("in 5 minutes", tz),
+                     now + datetime.timedelta(minutes=5))
+    self.assertEqual(
+        datetime_tz.datetime_tz.smartparse("2 days and an hour from now", tz),
+        now + datetime.timedelta(days=2, hours=1))
+    self.assertEqual(
+        datetime_tz.datetime_tz.smartparse("In 1 month, 2 hrs", tz),
+        now + dateutil.relativedelta.relativedelta(months=1, hours=2))
+    self.assertEqual(datetime_tz.datetime_tz.smartparse("this month", tz), now)
+
+    self.assertEqual(parse("next monday"), "2008-11-10 00:00:00-08:00")
+    self.assertEqual(parse("last monday"), "2008-11-03 00:00:00-08:00")
+    self.assertEqual(parse("next wed"), "2008-11-12 00:00:00-08:00")
+    self.assertEqual(parse("last Wednesday"), "2008-10-29 00:00:00-07:00")
+    self.assertEqual(parse("end of next monday"),
+                     "2008-11-10 23:59:59.999999-08:00")
+
+    self.assertEqual(parse("start of week"), "2008-11-03 00:00:00-08:00")
+    self.assertEqual(parse("End  Of Last Week"),
+                     "2008-11-02 23:59:59.999999-08:00")
+    self.assertEqual(parse("start of month"), "2008-11-01 00:00:00-07:00")
+    self.assertEqual(parse("end of month"), "2008-11-30 23:59:59.999999-08:00")
+    self.assertEqual(parse("start of quarter"), "2008-10-01 00:00:00-07:00")
+    self.assertEqual(parse("end of quarter"),
+                     "2008-12-31 23:59:59.999999-08:00")
+    self.assertEqual(parse("end of next quarter"),
+                     "2009-03-31 23:59:59.999999-07:00")
+    self.assertEqual(parse("start of year"), "2008-01-01 00:00:00-08:00")
+    self.assertEqual(parse("start of last year"), "2007-01-01 00:00:00-08:00")
+
+    # The time is moved before the boundary is taken
+    self.assertEqual(parse("start of 20 hours ago"),
+                     "2008-11-04 00:00:00-08:00")
+    self.assertEqual(parse("end of in 9 hours"),
+                     "2008-11-06 23:59:59.999999-08:00")
+
+    for toparse in ("month", "in 5 fortnights", "next", "2 days and ago"):
+      self.assertRaises(ValueError, datetime_tz.datetime_tz.smartparse,
+                        toparse, tz)
+
+  def testSmartParseCache(self):
+    tz = pytz.timezone("US/Pacific")
+    now = datetime_tz.datetime_tz(2008, 1, 31, 12, tzinfo=tz)
+
+    @staticmethod
+    def now_fake(tzinfo=None):
+      return now.astimezone(tzinfo or datetime_tz.localtz())
+    self.mocked("datetime_tz.datetime_tz.now", now_fake)
+
+    cache = datetime_tz.smartparse_cache
+    self.addCleanup(cache.resize, cache.info().maxsize)
+    cache.clear()
+
+    # Strings with the whole date are cached
+    for toparse in ("2008-07-13T12:05:01Z", "2008-07-13 12:05",
+                    "Sun Jul 13 12:05:01 EST 2008", "13 July 2008",
+                    "start of 13 July 2008", "end of 13 Feb 2008"):
+      d = datetime_tz.datetime_tz.smartparse(toparse, tz)
+      self.assertTrue(datetime_tz.datetime_tz.smartparse(toparse, tz) is d)
+      self.assertTrue(datetime_tz.datetime_tz.smartparse(
+          "  %s " % toparse, "US/Pacific") is d)
+    self.assertEqual(cache.info(), (12, 6, 1024, 6))
+
+    # Per timezone and class
+    d = datetime_tz.datetime_tz.smartparse("2008-07-13 12:05", tz)
+    self.assertEqual(str(d), "2008-07-13 12:05:00-07:00")
+    d = datetime_tz.datetime_tz.smartparse("2008-07-13 12:05")
+    self.assertEqual(str(d), "2008-07-13 12:05:00+10:00")
+    d = datetime_tz_test_subclass.smartparse("2008-07-13 12:05", tz)
+    self.assertTrue(isinstance(d, datetime_tz_test_subclass))
+    self.assertEqual(cache.info().currsize, 8)
+
+    # Anything which uses the current time isn't
+    for toparse in ("now", "tomorrow", "5 minutes ago", "end of tomorrow",
+                    "July 13", "13:05", "monday", "2008", "February 2008"):
+      datetime_tz.datetime_tz.smartparse(toparse, tz)
+    self.assertEqual(cache.info().currsize, 8)
+
+    # The default day of 31 gets clamped by dateutil
+    d = datetime_tz.datetime_tz.smartparse("February 2008", tz)
+    self.assertEqual(d.day, 29)
+    now = datetime_tz.datetime_tz(2008, 1, 5, 12, tzinfo=tz)
+    self.assertEqual(
+        datetime_tz.datetime_tz.smartparse("February 2008", tz).day, 5)
+
+    # The least recently used entries are dropped
+    cache.resize(2)
+    self.assertEqual(cache.info().currsize, 2)
+    d = datetime_tz.datetime_tz.smartparse("2008-07-13 12:05", tz)
+    datetime_tz.datetime_tz.smartparse("2008-07-14", tz)
+    datetime_tz.datetime_tz.smartparse("2008-07-15", tz)
+    self.assertTrue(datetime_tz.datetime_tz.smartparse(
+        "2008-07-13 12:05", tz) is not d)
+
+    # And a size of 0 disables it
+    cache.resize(0)
+    d = datetime_tz.datetime_tz.smartparse("2008-07-13 12:05", tz)
+    self.assertTrue(datetime_tz.datetime_tz.smartparse(
+        "2008-07-13 12:05", tz) is not d)
+    self.assertEqual(cache.info().currsize, 0)
+
+  def testSmartParseMany(self):
+    tz = pytz.timezone("US/Pacific")
+    start = datetime_tz.datetime_tz(2008, 7, 13, 12, 5, 1, tzinfo=tz)
+
+    def column(fmt, count=100):
+      for i in range(count):
+        yield (start + datetime.timedelta(hours=i * 7)).strftime(fmt)
+
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S.%f%z",
+                "%b %d %H:%M:%S %Y", "%d %B %Y", "%m/%d/%Y", "%Y%m%d",
+                "%d/%m/%Y %H:%M", "%H:%M %d %b %Y"):
+      expected = [datetime_tz.datetime_tz.smartparse(toparse, tz)
+                  for toparse in column(fmt)]
+      results = datetime_tz.datetime_tz.smartparse_many(column(fmt), tz)
+      self.assertFalse(isinstance(results, list))
+      results = list(results)
+      self.assertEqual(results, expected)
+      for result, dt in zip(results, expected):
+        self.assertTrue(isinstance(result, datetime_tz.datetime_tz))
+        self.assertEqual(result.asdatetime(), dt.asdatetime())
+        self.assertTrue(result.tzinfo is dt.tzinfo)
+
+    # Rows which don't fit the format still get parsed
+    toparse = list(column("%Y-%m-%d %H:%M:%S", 30))
+    toparse[25] = "Sun Jul 13 12:05:01 EST 2008"
+    toparse[26] = " 2008-07-13T12:05:01+05:30 "
+    self.assertEqual(
+        list(datetime_tz.datetime_tz.smartparse_many(toparse, "US/Pacific")),
+        [datetime_tz.datetime_tz.smartparse(s, tz) for s in toparse])
+
+    # Rows the inferred parser can't place in the zone fall back to smartparse
+    def strict_parser(toparse):
+      if toparse == toparse_invalid:
+        raise pytz.NonExistentTimeError(toparse)
+      return datetime_tz.datetime_tz.smartparse(toparse, tz)
+    toparse = list(column("%Y-%m-%d %H:%M:%S", 30))
+    toparse_invalid = toparse[20]
+    self.mocked("datetime_tz._infer_parser", lambda *args: strict_parser)
+    self.assertEqual(
+        list(datetime_tz.datetime_tz.smartparse_many(toparse, tz)),
+        [datetime_tz.datetime_tz.smartparse(s, tz) for s in toparse])
+    self.mocked.tearDown()
+
+    # Results are streamed, so endless inputs are fine
+    endless = ("2008-07-%02d" % (i % 28 + 1) for i in itertools.count())
+    results = datetime_tz.datetime_tz.smartparse_many(endless, tz)
+    self.assertEqual(len(list(itertools.islice(results, 50))), 50)
+
+    # Defaults to the local timezone, and subclasses get their own type
+    d, = datetime_tz_test_subclass.smartparse_many(["2008-07-13"])
+    self.assertTrue(isinstance(d, datetime_tz_test_subclass))
+    self.assertEqual(str(d), "2008-07-13 00:00:00+10:00")
+
+    self.assertEqual(list(datetime_tz.datetime_tz.smartparse_many([])), [])
+    self.assertRaises(ValueError, list,
+                      datetime_tz.datetime_tz.smartparse_many(
+                          ["2008-07-13", "not a date", "2008-07-14"]))
+    self.assertRaises(ValueError, list,
+                      datetime_tz.datetime_tz.smartparse_many(
+                          ["2008-07-13"] * 30 + ["not a date"]))
+
+  def testTrySmartParse(self):
+    tz = pytz.timezone("US/Eastern")
+    parse = datetime_tz.datetime_tz.try_smartparse
+
+    self.assertEqual(parse("2008-07-13 12:05", tz),
+                     datetime_tz.datetime_tz.smartparse("2008-07-13 12:05", tz))
+    self.assertTrue(isinstance(datetime_tz_test_subclass.try_smartparse(
+        "2008-07-13"), datetime_tz_test_subclass))
+    for toparse in ("", "  ", "-", "null", "N/A", "hello world", "12 monkeys",
+                    "2002-10-27 01:30", "2002-04-07 02:30", "5 parsecs ago",
+                    "Feb 30 2008", "99999999999999999999"):
+      self.assertEqual(parse(toparse, tz), None)
+      self.assertEqual(parse(toparse, tz, default=False), False)
+
+    # Strings without a digit have to have a word like a month in them
+    for toparse in ("July", "Sept", "monday", "yesterday", "an hour ago",
+                    "start of month", "next tues"):
+      self.assertTrue(datetime_tz._could_be_date(toparse), toparse)
+    for toparse in ("-", "null", "none", "N/A", "a", "EST", "noon",
+                    "end of"):
+      self.assertFalse(datetime_tz._could_be_date(toparse), toparse)
+
+    strings = ["2002-10-27 00:30", "", "null", "2002-10-27 01:30",
+               "2002-04-07 02:30", "2002-02-30 01:30", "2002-10-27 02:30"]
+    results, errors = datetime_tz.datetime_tz.try_smartparse_many(
+        strings, tz, sample_size=1)
+    self.assertEqual(errors, [
+        datetime_tz.PARSE_OK, datetime_tz.PARSE_EMPTY,
+        datetime_tz.PARSE_NOT_A_DATE, datetime_tz.PARSE_AMBIGUOUS,
+        datetime_tz.PARSE_NONEXISTENT, datetime_tz.PARSE_INVALID,
+        datetime_tz.PARSE_OK])
+    self.assertEqual([str(d) for d in results], [
+        "2002-10-27 00:30:00-04:00", "None", "None", "None", "None", "None",
+        "2002-10-27 02:30:00-05:00"])
+
+    results, errors = datetime_tz.datetime_tz.try_smartparse_many([])
+    self.assertEqual((results, errors), ([], []))
+
+    # Objects which aren't strings give an error code rather than raising
+    for toparse in (None, 1436618094, 2.5, object(), ["2002-10-27"]):
+      self.assertEqual(
+          datetime_tz.datetime_tz.try_smartparse(toparse, tz, default="x"),
+          "x")
+    if not isinstance(b"", str):
+      self.assertEqual(datetime_tz.datetime_tz.try_smartparse(
+          b"2002-10-27 00:30", tz), None)
+    results, errors = datetime_tz.datetime_tz.try_smartparse_many(
+        ["2002-10-27 00:30", None, 5, b"2002-10-27 01:30" * 2,
+         "2002-10-27 02:30", None], tz, sample_size=1)
+    self.assertEqual(errors, [
+        datetime_tz.PARSE_OK, datetime_tz.PARSE_EMPTY,
+        datetime_tz.PARSE_INVALID, datetime_tz.PARSE_INVALID,
+        datetime_tz.PARSE_OK, datetime_tz.PARSE_EMPTY])
+    self.assertEqual(results[1:4] + results[5:], [None] * 4)
+
+  def testSmartParseEpoch(self):
+    tz = pytz.timezone("US/Pacific")
+    parse = datetime_tz.datetime_tz.smartparse
+
+    for toparse in ("1436618094", "1436618094000", "1436618094000000",
+                    "1436618094000000000", "  1436618094.000 "):
+      self.assertEqual(str(parse(toparse, tz)), "2015-07-11 05:34:54-07:00")
+    self.assertEqual(str(parse("1436618094.25")),
+                     "2015-07-11 22:34:54.250000+10:00")
+    d = parse("1436618094", "UTC")
+    self.assertEqual(d.tzinfo, pytz.utc)
+    self.assertEqual(d.sort_key(), 1436618094000000)
+    self.assertTrue(isinstance(datetime_tz_test_subclass.smartparse(
+        "1436618094"), datetime_tz_test_subclass))
+
+    # Short numbers are still dates, unless given a unit
+    self.assertEqual(str(parse("20080713", tz)), "2008-07-13 00:00:00-07:00")
+    self.assertEqual(str(parse("20080713120501", tz)),
+                     "2008-07-13 12:05:01-07:00")
+    self.assertEqual(str(parse("20080713", tz, epoch_unit="s")),
+                     "1970-08-21 02:58:33-07:00")
+    self.assertEqual(str(parse("200807131205", "UTC", epoch_unit="ms")),
+                     "1976-05-13 03:45:31.205000+00:00")
+    self.assertEqual(str(parse("2008-07-13", tz, epoch_unit="s")),
+                     "2008-07-13 00:00:00-07:00")
+    self.assertRaises(ValueError, parse, "12", tz, epoch_unit="days")
+    self.assertRaises(OverflowError, parse, "99999999999999", epoch_unit="s")
+
+    # And in batches
+    column = ["%d" % (1436618094 + i * 3600) for i in range(30)]
+    results = list(datetime_tz.datetime_tz.smartparse_many(column, tz))
+    self.assertEqual(results, [parse(toparse, tz) for toparse in column])
+    results, errors = datetime_tz.datetime_tz.try_smartparse_many(
+        ["1436618094", "12"], tz, epoch_unit="s")
+    self.assertEqual([d.sort_key() for d in results],
+                     [1436618094000000, 12000000])
+    self.assertEqual(errors, [datetime_tz.PARSE_OK] * 2)
+
+  def testStrptime(self):
+    tz = pytz.timezone("US/Eastern")
+
+    d = datetime_tz.datetime_tz.strptime("2008-07-13 12:05", "%Y-%m-%d %H:%M")
+    self.assertEqual(str(d), "2008-07-13 12:05:00+10:00")
+    d = datetime_tz.datetime_tz.strptime("2008-07-13 12:05", "%Y-%m-%d %H:%M",
+                                         "US/Eastern")
+    self.assertEqual(str(d), "2008-07-13 12:05:00-04:00")
+    self.assertTrue(d.is_dst)
+
+    # The string's timezone wins over tzinfo
+    d = datetime_tz.datetime_tz.strptime(
+        "2008-07-13 12:05 +0530", "%Y-%m-%d %H:%M %z", tz)
+    self.assertEqual(str(d), "2008-07-13 12:05:00+05:30")
+    d = datetime_tz.datetime_tz.strptime(
+        "Sun Oct 27 01:30:00 EST 2002", "%a %b %d %H:%M:%S %Z %Y")
+    self.assertEqual(d.strftime(FMT), "2002-10-27 01:30:00 EST-0500")
+    d = datetime_tz.datetime_tz.strptime(
+        "Sun Oct 27 01:30:00 EDT 2002", "%a %b %d %H:%M:%S %Z %Y")
+    self.assertEqual(d.strftime(FMT), "2002-10-27 01:30:00 EDT-0400")
+
+    # Same as smartparse
+    for toparse, fmt in (("13 Jul 2008 12:05:01", "%d %b %Y %H:%M:%S"),
+                         ("Jul 13 12:05:01 EST 2008", "%b %d %H:%M:%S %Z %Y"),
+                         ("2008-07-13T12:05:01-0400", "%Y-%m-%dT%H:%M:%S%z")):
+      self.assertEqual(
+          repr(datetime_tz.datetime_tz.strptime(toparse, fmt, tz)),
+          repr(datetime_tz.datetime_tz.smartparse(toparse, tz)))
+
+    self.assertTrue(isinstance(
+        datetime_tz_test_subclass.strptime("2008", "%Y"),
+        datetime_tz_test_subclass))
+    self.assertRaises(ValueError, datetime_tz.datetime_tz.strptime,
+                      "2008-07-13", "%Y/%m/%d")
+    self.assertRaises(pytz.AmbiguousTimeError,
+                      datetime_tz.datetime_tz.strptime,
+                      "2002-10-27 01:30", "%Y-%m-%d %H:%M", tz)
+
+    # And the batch version
+    strings = ["2002-10-27 %02d:30" % hour for hour in (0, 3, 5)]
+    results = datetime_tz.datetime_tz.strptime_many(
+        strings, "%Y-%m-%d %H:%M", tz)
+    self.assertEqual(
+        results, [datetime_tz.datetime_tz.strptime(toparse, "%Y-%m-%d %H:%M",
+                                                   tz) for toparse in strings])
+    results = datetime_tz.datetime_tz.strptime_many(
+        ["2002-10-27 01:30 EDT", "2002-10-27 01:30 EST"], "%Y-%m-%d %H:%M %Z")
+    self.assertEqual([d.is_dst for d in results], [True, False])
+    self.assertRaises(ValueError, datetime_tz.datetime_tz.strptime_many,
+                      ["12:05", "01:30 EST"], "%H:%M %Z")
+
+  def testReferenceTime(self):
+    tz = pytz.timezone("US/Pacific")
+    ref = datetime_tz.datetime_tz(2008, 11, 5, 12, 30, tzinfo=tz)
+
+    with datetime_tz.reference_time(ref):
+      self.assertEqual(str(datetime_tz.datetime_tz.now()),
+                       "2008-11-06 07:30:00+11:00")
+      self.assertEqual(str(datetime_tz.datetime_tz.now(tz)),
+                       "2008-11-05 12:30:00-08:00")
+      self.assertEqual(str(datetime_tz.datetime_tz.now("US/Pacific")),
+                       "2008-11-05 12:30:00-08:00")
+      self.assertEqual(str(datetime_tz.datetime_tz.utcnow()),
+                       "2008-11-05 20:30:00+00:00")
+      self.assertTrue(datetime_tz.datetime_tz.now(tz) is
+                      datetime_tz.datetime_tz.now(tz))
+      self.assertTrue(isinstance(datetime_tz_test_subclass.now(),
+                                 datetime_tz_test_subclass))
+
+      # smartparse is relative to it
+      self.assertEqual(str(datetime_tz.datetime_tz.smartparse("5 days ago")),
+                       "2008-11-01 07:30:00+11:00")
+      self.assertEqual(
+          str(datetime_tz.datetime_tz.smartparse("start of tomorrow", tz)),
+          "2008-11-06 00:00:00-08:00")
+
+      # Reference times nest, naive ones are in the local timezone
+      with datetime_tz.reference_time(datetime.datetime(2001, 2, 3, 4, 5)):
+        self.assertEqual(str(datetime_tz.datetime_tz.utcnow()),
+                         "2001-02-02 17:05:00+00:00")
+      self.assertEqual(str(datetime_tz.datetime_tz.now(tz)),
+                       "2008-11-05 12:30:00-08:00")
+
+    # And are undone afterwards, even by an exception
+    try:
+      with datetime_tz.reference_time(ref):
+        raise KeyError()
+    except KeyError:
+      pass
+    self.assertTrue(datetime_tz.datetime_tz.now().year > 2008)
+
+    # A function is called each time
+    ticks = iter(range(10))
+    with datetime_tz.reference_time(
+        lambda: ref + datetime.timedelta(hours=next(ticks))):
+      self.assertEqual(datetime_tz.datetime_tz.now(tz).hour, 12)
+      self.assertEqual(datetime_tz.datetime_tz.now(tz).hour, 13)
+
+    # smartparse can also be given the time directly
+    for now in (ref, ref.asdatetime(naive=False), ref.astimezone(pytz.utc)):
+      self.assertEqual(
+          str(datetime_tz.datetime_tz.smartparse("in 1 hour", tz, now=now)),
+          "2008-11-05 13:30:00-08:00")
+    self.assertEqual(
+        str(datetime_tz.datetime_tz.smartparse("yesterday", now=ref)),
+        "2008-11-05 07:30:00+11:00")
+    self.assertEqual(
+        str(datetime_tz.datetime_tz.smartparse("13:05", tz, now=ref)),
+        "2008-11-05 13:05:00-08:00")
+    results = datetime_tz.datetime_tz.smartparse_many(
+        ["1 hour ago", "2 hours ago"], tz, now=ref)
+    self.assertEqual([d.hour for d in results], [11, 10])
+
+  def testLocalTimezone(self):
+    naive_dt = datetime.datetime(2010, 7, 11, 12, 34, 54)
+
+    with datetime_tz.local_timezone("Europe/Berlin") as tz:
+      self.assertEqual(tz.zone, "Europe/Berlin")
+      self.assertEqual(datetime_tz.localtz().zone, "Europe/Berlin")
+      self.assertEqual(datetime_tz.localtz_name(), "Europe/Berlin")
+      self.assertEqual(str(datetime_tz.localize(naive_dt)),
+                       "2010-07-11 12:34:54+02:00")
+      self.assertEqual(datetime_tz.datetime_tz.now().tzinfo.zone,
+                       "Europe/Berlin")
+      self.assertEqual(
+          str(datetime_tz.datetime_tz.smartparse("2010-07-11 12:34:54")),
+          "2010-07-11 12:34:54+02:00")
+      self.assertEqual(
+          str(datetime_tz.datetime_tz.combine(naive_dt.date(),
+                                              naive_dt.time())),
+          "2010-07-11 12:34:54+02:00")
+
+      # They nest
+      with datetime_tz.local_timezone(pytz.timezone("US/Pacific")):
+        self.assertEqual(datetime_tz.localtz().zone, "US/Pacific")
+        self.assertEqual(
+            str(datetime_tz.datetime_tz.smartparse("2010-07-11 12:34:54")),
+            "2010-07-11 12:34:54-07:00")
+      self.assertEqual(datetime_tz.localtz().zone, "Europe/Berlin")
+
+      # Other threads still see the process wide timezone
+      other = []
+      thread = threading.Thread(target=lambda: other.append(
+          datetime_tz.localtz()))
+      thread.start()
+      thread.join()
+      self.assertEqual(other[0].zone, "Australia/Sydney")
+
+    self.assertEqual(datetime_tz.localtz().zone, "Australia/Sydney")
+    self.assertEqual(
+        str(datetime_tz.datetime_tz.smartparse("2010-07-11 12:34:54")),
+        "2010-07-11 12:34:54+10:00")
+
+    self.assertRaises(pytz.UnknownTimeZoneError,
+                      datetime_tz.local_timezone("Invalid/Timezone").__enter__)
+
+  def testLocalTimezoneContexts(self):
+    if datetime_tz.contextvars is None:
+      raise self.skipTest("Needs contextvars (Python 3.7+)")
+
+    # asyncio runs each task in its own copy of the context.
+    def handler(zone):
+      with datetime_tz.local_timezone(zone):
+        context = datetime_tz.contextvars.copy_context()
+      results.append(context.run(lambda: datetime_tz.localtz().zone))
+
+    results = []
+    with datetime_tz.local_timezone("Europe/Berlin"):
+      for zone in ("US/Pacific", "Asia/Tokyo"):
+        handler(zone)
+      results.append(datetime_tz.localtz().zone)
+    self.assertEqual(results, ["US/Pacific", "Asia/Tokyo", "Europe/Berlin"])
+
   def testLocalize(self):
     # Test naive to sydney and utc
     naive_dt = datetime.datetime(2010, 7, 11, 12, 34, 54)
@@ -1343,6 +2312,450 @@ class TestDatetimeTZ(TestTimeZoneBase):
     self.assertTrue(def_tz.has_key("Australia/Sydney"))
     self.assertRaises(KeyError, def_tz.get, "Made/Up")
     self.assertEqual(def_tz.get("Made/Up", None), None)
+    self.assertEqual(list(def_tz.keys()), list(pytz.all_timezones))
+    self.assertEqual(list(def_tz), list(pytz.all_timezones))
+
+
+class TestZones(unittest.TestCase):
+
+  def testValid(self):
+    self.assertTrue(datetime_tz.zones.is_valid("Australia/Sydney"))
+    self.assertTrue(datetime_tz.zones.is_valid("US/Eastern"))
+    self.assertFalse(datetime_tz.zones.is_valid("Made/Up"))
+    self.assertFalse(datetime_tz.zones.is_valid(None))
+    self.assertFalse(datetime_tz.zones.is_valid([]))
+    self.assertEqual(datetime_tz.zones.names(), set(pytz.all_timezones))
+
+    # Doesn't depend on what get() has been asked for
+    self.assertFalse(datetime_tz.zones.is_valid("us/eastern"))
+    datetime_tz.zones.get("us/eastern")
+    self.assertFalse(datetime_tz.zones.is_valid("us/eastern"))
+
+  def testGet(self):
+    tz = datetime_tz.zones.get("Australia/Sydney")
+    self.assertTrue(tz is pytz.timezone("Australia/Sydney"))
+    self.assertTrue(tz is datetime_tz.zones.get("Australia/Sydney"))
+    self.assertTrue(datetime_tz.zones.get("UTC") is pytz.utc)
+    self.assertTrue(datetime_tz.zones.get("utc") is pytz.utc)
+
+    self.assertRaises(pytz.UnknownTimeZoneError,
+                      datetime_tz.zones.get, "Made/Up")
+    self.assertRaises(pytz.UnknownTimeZoneError,
+                      datetime_tz.zones.get, None)
+    self.assertRaises(pytz.UnknownTimeZoneError,
+                      datetime_tz._tzinfome, "Made/Up")
+    self.assertRaises(pytz.UnknownTimeZoneError,
+                      datetime_tz._tzinfome, 10)
+
+  def testRegister(self):
+    tz = pytz.FixedOffset(330)
+    self.assertFalse(datetime_tz.zones.is_valid("Test/Registered"))
+    datetime_tz.zones.register("Test/Registered", tz)
+    try:
+      self.assertTrue(datetime_tz.zones.is_valid("Test/Registered"))
+      self.assertTrue(datetime_tz._tzinfome("Test/Registered") is tz)
+    finally:
+      del datetime_tz.zones._tzinfos["Test/Registered"]
+      datetime_tz.zones._registered.discard("Test/Registered")
+
+  def testFixedOffset(self):
+    fixed_offset = datetime_tz.zones.fixed_offset
+    self.assertTrue(fixed_offset(0) is pytz.utc)
+    self.assertTrue(fixed_offset(19800) is fixed_offset(19800))
+    self.assertTrue(fixed_offset(19800) is pytz.FixedOffset(330))
+    self.assertEqual(fixed_offset(-14400).utcoffset(None),
+                     datetime.timedelta(hours=-4))
+    self.assertRaises(ValueError, fixed_offset, 86400)
+
+    # Offsets which aren't whole minutes don't give float keys
+    tzinfo = fixed_offset(19845)
+    self.assertTrue(fixed_offset(19845) is tzinfo)
+    for key in datetime_tz.zones._fixed_offsets:
+      self.assertTrue(isinstance(key, int))
+    if sys.version_info >= (3, 7):
+      self.assertEqual(tzinfo.utcoffset(None),
+                       datetime.timedelta(hours=5, minutes=30, seconds=45))
+
+  def testCanonicalName(self):
+    # Older pytz versions don't ship the link information
+    if not datetime_tz.zones._load_links():
+      raise self.skipTest("pytz has no tzdata.zi file")
+
+    self.assertEqual(datetime_tz.zones.canonical_name("US/Eastern"),
+                     "America/New_York")
+    self.assertEqual(datetime_tz.zones.canonical_name("Australia/NSW"),
+                     "Australia/Sydney")
+    self.assertEqual(datetime_tz.zones.canonical_name("Australia/Sydney"),
+                     "Australia/Sydney")
+    self.assertEqual(datetime_tz.zones.canonical_name("UTC"), "Etc/UTC")
+    self.assertRaises(pytz.UnknownTimeZoneError,
+                      datetime_tz.zones.canonical_name, "Made/Up")
+
+
+class TestZoneIndex(unittest.TestCase):
+
+  ZONES = ("Australia/Sydney", "America/New_York", "Australia/Lord_Howe",
+           "Europe/Dublin", "America/St_Johns", "Europe/Minsk", "UTC",
+           "Etc/GMT+5")
+
+  def _transition_points(self, index):
+    points = []
+    for start in index.utc[1:]:
+      for offset in set(index.offsets):
+        for seconds in (-3601, -3600, -1800, -1, 0, 1, 1800, 3599, 3600):
+          points.append(start + offset + datetime.timedelta(seconds=seconds))
+    return points
+
+  def testLocalizeMatchesPytz(self):
+    random.seed(1)
+    for zone in self.ZONES:
+      tz = pytz.timezone(zone)
+      index = datetime_tz.tzindex.get(tz)
+
+      points = self._transition_points(index)
+      points = random.sample(points, min(len(points), 400))
+      points += [datetime.datetime(1900, 1, 1) + datetime.timedelta(
+          seconds=random.randrange(0, 200*365*86400)) for _ in range(100)]
+
+      for wall in points:
+        for is_dst in (None, True, False):
+          try:
+            expected = tz.localize(wall, is_dst=is_dst).tzinfo
+          except pytz.InvalidTimeError as e:
+            expected = type(e)
+          try:
+            actual = index.tzinfos[index.localize(wall, is_dst)]
+          except pytz.InvalidTimeError as e:
+            actual = type(e)
+          self.assertTrue(expected is actual,
+                          (zone, wall, is_dst, expected, actual))
+
+  def testFromUtcMatchesPytz(self):
+    random.seed(2)
+    for zone in self.ZONES:
+      tz = pytz.timezone(zone)
+      index = datetime_tz.tzindex.get(tz)
+
+      points = [start + datetime.timedelta(seconds=seconds)
+                for start in index.utc[1:] for seconds in (-1, 0, 1)]
+      points = random.sample(points, min(len(points), 300))
+      points += [datetime.datetime(1900, 1, 1) + datetime.timedelta(
+          seconds=random.randrange(0, 200*365*86400)) for _ in range(100)]
+      for utc in points:
+        expected = tz.fromutc(utc.replace(tzinfo=tz))
+        period = index.period_utc(utc)
+        self.assertTrue(expected.tzinfo is index.tzinfos[period])
+        self.assertEqual(expected.replace(tzinfo=None),
+                         utc + index.offsets[period])
+
+  def testPeriods(self):
+    index = datetime_tz.tzindex.get(pytz.timezone("US/Eastern"))
+
+    self.assertEqual(
+        len(index.periods(datetime.datetime(2002, 10, 27, 0, 30))), 1)
+    self.assertEqual(
+        len(index.periods(datetime.datetime(2002, 10, 27, 1, 30))), 2)
+    self.assertEqual(
+        len(index.periods(datetime.datetime(2002, 4, 7, 2, 30))), 0)
+
+    self.assertRaises(pytz.AmbiguousTimeError, index.resolve,
+                      datetime.datetime(2002, 10, 27, 1, 30))
+    for is_dst in (None, True, False):
+      self.assertRaises(pytz.NonExistentTimeError, index.resolve,
+                        datetime.datetime(2002, 4, 7, 2, 30), is_dst)
+
+  def testGet(self):
+    tz = pytz.timezone("Australia/Sydney")
+    index = datetime_tz.tzindex.get(tz)
+    self.assertTrue(index is datetime_tz.tzindex.get(tz))
+
+    # Localized versions of the zone share the index
+    localized = tz.localize(datetime.datetime(2010, 1, 1)).tzinfo
+    self.assertFalse(localized is tz)
+    self.assertTrue(index is datetime_tz.tzindex.get(localized))
+
+    self.assertEqual(len(datetime_tz.tzindex.get(pytz.utc)), 1)
+    self.assertEqual(len(datetime_tz.tzindex.get(pytz.FixedOffset(60))), 1)
+    self.assertEqual(datetime_tz.tzindex.get(dateutil.tz.tzutc()), None)
+
+  def testUtcNaive(self):
+    dt = pytz.timezone("US/Eastern").localize(
+        datetime.datetime(2002, 10, 27, 1, 30), is_dst=True)
+    self.assertEqual(datetime_tz.tzindex.utc_naive(dt),
+                     datetime.datetime(2002, 10, 27, 5, 30))
+
+
+class TestIso8601(TestTimeZoneBase):
+
+  def setUp(self):
+    datetime_tz.localtz_set("Australia/Sydney")
+    self.mocked = MockMe()
+
+  def tearDown(self):
+    self.mocked.tearDown()
+
+  def testParse(self):
+    parse = datetime_tz.iso8601.parse
+    self.assertEqual(parse("2008-07-13"), datetime.datetime(2008, 7, 13))
+    self.assertEqual(parse("2008-07-13T12:05"),
+                     datetime.datetime(2008, 7, 13, 12, 5))
+    self.assertEqual(parse("2008-07-13 12:05:01"),
+                     datetime.datetime(2008, 7, 13, 12, 5, 1))
+
+    dt = parse("2008-07-13T12:05:01.123456789Z")
+    self.assertEqual(dt.replace(tzinfo=None),
+                     datetime.datetime(2008, 7, 13, 12, 5, 1, 123456))
+    self.assertTrue(dt.tzinfo is pytz.utc)
+    self.assertEqual(parse("2008-07-13T12:05:01,5z").microsecond, 500000)
+    self.assertTrue(parse("2008-07-13T12:05:01-00:00").tzinfo is pytz.utc)
+    self.assertTrue(parse("2008-07-13T12:05:01+05:30").tzinfo is
+                    pytz.FixedOffset(330))
+    self.assertTrue(parse("2008-07-13T12:05:01-0400").tzinfo is
+                    pytz.FixedOffset(-240))
+    self.assertTrue(parse("2008-07-13T12:05:01+01").tzinfo is
+                    pytz.FixedOffset(60))
+
+    for toparse in ("2008-07-13T12:05:01 UTC", "20080713T120501Z",
+                    "2008-07-13T12", "2008-07-13Z", "13/07/2008", "now",
+                    "2008-07-13T24:00:00", "2008-02-30", ""):
+      self.assertRaises(ValueError, parse, toparse)
+
+  def testMatchesDateutil(self):
+    tz = pytz.timezone("US/Eastern")
+    cases = ["2008-07-13", "2008-07-13T12:05", "2008-07-13 12:05:01",
+             "2008-07-13T12:05:01.5", "2002-10-27T01:30:00",
+             "2002-04-07T02:30:00", "2008-02-30", "2008-07-13T24:00"]
+    for zone in ("Z", "z", "+00:00", "-00:00", "+05:30", "-0400", "+11",
+                 "+25:00"):
+      cases.append("2008-07-13T12:05:01.123456789" + zone)
+      cases.append("2008-07-13T12:05" + zone)
+
+    def results(toparse):
+      for tzinfo in (None, tz):
+        try:
+          d = datetime_tz.datetime_tz.smartparse(toparse, tzinfo)
+          yield (str(d), d.tzinfo, d.is_dst)
+        except Exception as e:  # pylint: disable=broad-except
+          yield type(e)
+
+    fast = [list(results(toparse)) for toparse in cases]
+
+    def no_fast_path(unused_toparse):
+      raise ValueError()
+    self.mocked("datetime_tz.iso8601.parse", no_fast_path)
+    slow = [list(results(toparse)) for toparse in cases]
+
+    self.assertEqual(fast, slow)
+
+
+class TestFormats(unittest.TestCase):
+
+  def testParse(self):
+    def parse(toparse, fmt):
+      return datetime_tz.formats.get(fmt).parse(toparse)
+
+    self.assertEqual(parse("2008-07-13 12:05:01", "%Y-%m-%d %H:%M:%S"),
+                     (datetime.datetime(2008, 7, 13, 12, 5, 1), None, None))
+    self.assertEqual(parse("sun JUL  13 08", "%a %b %d %y")[0],
+                     datetime.datetime(2008, 7, 13))
+    self.assertEqual(parse("12:05 am", "%I:%M %p")[0],
+                     datetime.datetime(1900, 1, 1, 0, 5))
+    self.assertEqual(parse("12:05:01.5 PM", "%I:%M:%S.%f %p")[0],
+                     datetime.datetime(1900, 1, 1, 12, 5, 1, 500000))
+    self.assertEqual(parse("13 July 2008 100%", "%d %B %Y 100%%")[0],
+                     datetime.datetime(2008, 7, 13))
+
+    self.assertTrue(parse("12:05Z", "%H:%M%z")[1] is pytz.utc)
+    self.assertTrue(parse("12:05-0000", "%H:%M%z")[1] is pytz.utc)
+    self.assertTrue(parse("12:05+05:30", "%H:%M%z")[1] is
+                    pytz.FixedOffset(330))
+    self.assertEqual(parse("12:05 est", "%H:%M %Z")[1:],
+                     (pytz.timezone("US/Eastern"), False))
+    self.assertEqual(parse("12:05 AEDT", "%H:%M %Z")[1:],
+                     (pytz.timezone("Australia/Sydney"), True))
+
+    # Directives which aren't compiled are left to datetime.strptime
+    self.assertEqual(parse("195 2008", "%j %Y")[0],
+                     datetime.datetime(2008, 7, 13))
+
+    for toparse, fmt in (("2008-07-13 12:05", "%Y-%m-%d"),
+                         ("2008-02-30", "%Y-%m-%d"),
+                         ("12:05 XYZ", "%H:%M %Z"),
+                         ("12:05+5", "%H:%M%z"),
+                         ("12:05+05:3045", "%H:%M%z"),
+                         ("12:05", "%H:%M %")):
+      self.assertRaises(ValueError, parse, toparse, fmt)
+
+  def testMatchesStrptime(self):
+    start = datetime.datetime(1960, 1, 1)
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S,%f",
+                "%d/%m/%y %I:%M %p", "%a %b %d %H:%M:%S %Y",
+                "%A, %d %B %Y", "%Y%m%d%H%M%S", "%d-%b-%Y  %H:%M"):
+      for i in range(200):
+        dt = start + datetime.timedelta(seconds=i * 9876543.21)
+        toparse = dt.strftime(fmt)
+        if i % 2:
+          toparse = toparse.upper()
+        self.assertEqual(datetime_tz.formats.get(fmt).parse(toparse)[0],
+                         datetime.datetime.strptime(toparse, fmt))
+
+  def testOffsetMatchesStrptime(self):
+    # Before 3.7 strptime only takes +HHMM offsets, of whole minutes
+    if sys.version_info < (3, 7):
+      raise self.skipTest("datetime.strptime %z doesn't take seconds")
+
+    fmt = "%Y-%m-%d %H:%M:%S%z"
+    for offset in ("Z", "+0000", "-0000", "+0530", "-05:30", "+053045",
+                   "+05:30:45", "-000001", "-23:59:59"):
+      toparse = "2008-07-13 12:05:01" + offset
+      wall, tzinfo, _ = datetime_tz.formats.get(fmt).parse(toparse)
+      expected = datetime.datetime.strptime(toparse, fmt)
+      self.assertEqual(wall, expected.replace(tzinfo=None))
+      self.assertEqual(tzinfo.utcoffset(wall), expected.utcoffset())
+
+    # The same through the standard library
+    self.assertEqual(
+        datetime_tz.formats.get("%j %Y %z").parse("195 2008 +05:30:45")[1],
+        datetime_tz.zones.fixed_offset(19845))
+
+  def testCache(self):
+    self.assertTrue(datetime_tz.formats.get("%Y %m") is
+                    datetime_tz.formats.get("%Y %m"))
+    for i in range(datetime_tz.formats._FORMATS_MAX + 1):
+      datetime_tz.formats.get("%Y " + "x" * i)
+    self.assertTrue(
+        len(datetime_tz.formats._formats) <= datetime_tz.formats._FORMATS_MAX)
+
+
+class TestEpoch(unittest.TestCase):
+
+  def testParse(self):
+    parse = datetime_tz.epoch.parse
+    self.assertEqual(parse("1436618094"), 1436618094000000)
+    self.assertEqual(parse("+1436618094"), 1436618094000000)
+    self.assertEqual(parse("-1436618094"), -1436618094000000)
+    self.assertEqual(parse("0001436618094"), 1436618094000000)
+    self.assertEqual(parse("1436618094.5"), 1436618094500000)
+    self.assertEqual(parse("1436618094."), 1436618094000000)
+    self.assertEqual(parse("99999999999"), 99999999999000000)
+    self.assertEqual(parse("1436618094123"), 1436618094123000)
+    self.assertEqual(parse("1436618094123.4567"), 1436618094123456)
+    self.assertEqual(parse("143661809412345"), 143661809412345)
+    self.assertEqual(parse("1436618094123456"), 1436618094123456)
+    self.assertEqual(parse("1436618094123456789"), 1436618094123456)
+    # Fractions of a microsecond are rounded down, not towards zero
+    self.assertEqual(parse("-1436618094123456789"), -1436618094123457)
+    self.assertEqual(parse("-0.0000001"), None)
+    self.assertEqual(parse("-0.0000001", "s"), -1)
+
+    # Dates, or too short to be sure, without a unit
+    for toparse in ("12", "2008", "080713", "20080713", "123456789012",
+                    "200807131205", "20080713120501", "12345678901234567890",
+                    "1436618094e3", "0x1436618094", "1 436 618 094", "."):
+      self.assertEqual(parse(toparse), None, toparse)
+
+    self.assertEqual(parse("20080713", "s"), 20080713000000)
+    self.assertEqual(parse("12", "ms"), 12000)
+    self.assertEqual(parse("12.5", "us"), 12)
+    self.assertEqual(parse("12", "ns"), 0)
+    self.assertRaises(ValueError, parse, "12", "days")
+
+
+class TestPytzAbbr(unittest.TestCase):
+
+  def testMatchesLocalize(self):
+    abbrs = datetime_tz.pytz_abbr.all
+    for name in ("EST", "EDT", "AEST", "AEDT", "BST", "UTC", "A"):
+      abbr = abbrs[name]
+      walls = [datetime.datetime(2002, 10, 27, 0, 30),
+               datetime.datetime(2002, 10, 27, 1, 30),  # US ambiguous
+               datetime.datetime(2002, 4, 7, 2, 30),  # US skipped
+               datetime.datetime(2008, 4, 6, 2, 30),  # Australia ambiguous
+               datetime.datetime(2008, 10, 5, 2, 30),  # Australia skipped
+               datetime.datetime(1890, 1, 1)]
+      for wall in walls:
+        expected = abbr.zone.localize(wall, is_dst=abbr.is_dst)
+        dt = wall.replace(tzinfo=abbr)
+        self.assertEqual(
+            (abbr.tzname(dt), abbr.utcoffset(dt), abbr.dst(dt)),
+            (expected.tzname(), expected.utcoffset(), expected.dst()),
+            (name, wall))
+
+    # Asking again about the same time doesn't localize again
+    abbr = abbrs["EST"]
+    dt = datetime.datetime(2002, 10, 27, 1, 30, tzinfo=abbr)
+    self.assertTrue(abbr._get_localized(dt) is abbr._get_localized(dt))
+
+  def testOffsets(self):
+    abbrs = datetime_tz.pytz_abbr.all
+    self.assertEqual(abbrs["EST"].offsets, frozenset([-5 * 3600]))
+    self.assertEqual(abbrs["AEDT"].offsets, frozenset([11 * 3600]))
+    self.assertEqual(abbrs["UTC"].offsets, frozenset([0]))
+    self.assertEqual(abbrs["A"].offsets, frozenset([3600]))
+    # Australia/West doesn't call its periods WST
+    self.assertEqual(abbrs["WST"].offsets, frozenset([8 * 3600]))
+
+  def testTzinfos(self):
+    pytz_abbr = datetime_tz.pytz_abbr
+    tzinfos = pytz_abbr.tzinfos
+    est = pytz_abbr.all["EST"]
+    self.assertTrue(tzinfos("EST", None) is est)
+    self.assertTrue(tzinfos("EST", -5 * 3600) is est)
+    # dateutil gives "EST-05:00" a POSIX style offset
+    self.assertTrue(tzinfos("EST", 5 * 3600) is est)
+    self.assertTrue(tzinfos(None, 0) is pytz.utc)
+    self.assertTrue(tzinfos(None, 5 * 3600) is pytz.FixedOffset(300))
+    self.assertTrue(tzinfos(None, -5 * 3600 - 1800) is
+                    datetime_tz.zones.fixed_offset(-19800))
+    self.assertTrue(tzinfos(None, 19845) is
+                    datetime_tz.zones.fixed_offset(19845))
+    self.assertTrue(tzinfos(None, None) is pytz_abbr.unknown)
+    self.assertRaises(ValueError, tzinfos, "XYZ", None)
+
+    # The offset picks between the meanings of an abbreviation
+    for abbr, offset, zone in (
+        ("IST", None, "Europe/Dublin"),
+        ("IST", 3600, "Europe/Dublin"),
+        ("IST", 19800, "Asia/Kolkata"),
+        ("IST", -19800, "Asia/Kolkata"),
+        ("IST", 7200, "Asia/Jerusalem"),
+        ("CST", -6 * 3600, "US/Central"),
+        ("CST", 8 * 3600, "Asia/Shanghai"),
+        ("CST", 9 * 3600 + 1800, "Australia/Adelaide"),
+        ("EST", 10 * 3600, "Australia/Sydney")):
+      self.assertEqual(tzinfos(abbr, offset).zone.zone, zone)
+    self.assertTrue(pytz_abbr.all["IST"] is tzinfos("IST", 3600))
+    # An offset no meaning has is rejected
+    self.assertRaises(ValueError, tzinfos, "IST", 3 * 3600)
+    self.assertRaises(ValueError, tzinfos, "EST", 7 * 3600)
+
+    # Region chains are searched in order
+    tzinfos = pytz_abbr.tzinfos_create(["Asia", "all"])
+    self.assertEqual(tzinfos("IST", None).zone.zone, "Asia/Kolkata")
+    self.assertEqual(tzinfos("IST", 3600).zone.zone, "Europe/Dublin")
+    self.assertTrue(tzinfos("EDT", None) is pytz_abbr.all["EDT"])
+    # and only meanings in the regions given are used
+    tzinfos = pytz_abbr.tzinfos_create("North America")
+    self.assertRaises(ValueError, tzinfos, "CST", 8 * 3600)
+    self.assertRaises(ValueError, tzinfos, "AEST", None)
+    tzinfos = pytz_abbr.tzinfos_create(["North America", "Asia"])
+    self.assertEqual(tzinfos("CST", None).zone.zone, "US/Central")
+    self.assertEqual(tzinfos("CST", 8 * 3600).zone.zone, "Asia/Shanghai")
+
+  def testSmartParse(self):
+    for toparse, expected in (
+        ("2002-10-27 01:20:00 EST", "2002-10-27 01:20:00 EST-0500"),
+        ("2002-10-27 01:20:00 EDT", "2002-10-27 01:20:00 EDT-0400"),
+        ("2002-07-27 01:20:00 EST", "2002-07-27 01:20:00 EDT-0400"),
+        ("2008-04-06 02:30:00 AEDT", "2008-04-06 02:30:00 AEDT+1100"),
+        ("2002-10-27 01:20:00 IST+0530", "2002-10-27 01:20:00 IST+0530"),
+        ("2002-10-27 01:20:00 IST +05:30", "2002-10-27 01:20:00 IST+0530"),
+        ("2002-10-27 01:20:00 CST+08:00", "2002-10-27 01:20:00 CST+0800"),
+        ("2002-10-27 01:20:00 EST-05:00", "2002-10-27 01:20:00 EST-0500")):
+      self.assertEqual(
+          datetime_tz.datetime_tz.smartparse(toparse).strftime(FMT), expected)
+    self.assertRaises(ValueError, datetime_tz.datetime_tz.smartparse,
+                      "2002-10-27 01:20:00 IST+0300")
 
 
 class datetime_tz_test_subclass(datetime_tz.datetime_tz):